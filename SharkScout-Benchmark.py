@@ -0,0 +1,826 @@
+#!/usr/bin/env python3
+
+import sys
+import time
+
+import argparse
+import asyncio
+import base64
+import cherrypy
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import os
+import psutil
+import pymongo
+import pynumparser
+import random
+import requests
+import resource
+import statistics
+import subprocess
+import tempfile
+import zlib
+from datetime import date, datetime
+
+import sharkscout
+
+
+# Every report() line, {section: {name: {...}}}, saved with --output and compared to with --compare
+results = {}
+compare = {}
+section = None
+
+
+# Time a function call repeatedly, returning the durations in milliseconds
+def timed(func, iterations):
+    func()  # warm up caches
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def report(name, durations):
+    durations = sorted(durations)
+    result = {
+        'mean_ms': statistics.mean(durations),
+        'p50_ms': durations[len(durations) // 2],
+        'p95_ms': durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+        'max_ms': durations[-1]
+    }
+    results.setdefault(section, {})[name] = result
+    was = compare.get(section, {}).get(name)
+    print('{:<40} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+        name, result['mean_ms'], result['p50_ms'], result['p95_ms'], result['max_ms']
+    ) + (' {:>9.3f} {:>+8.1f}%'.format(was['p50_ms'], (result['p50_ms'] / was['p50_ms'] - 1) * 100)
+         if was and was['p50_ms'] else ''))
+
+
+def report_header(title):
+    global section
+    section = title
+    print()
+    print('{:<40} {:>9} {:>9} {:>9} {:>9}'.format(title, 'mean ms', 'p50 ms', 'p95 ms', 'max ms') +
+          (' {:>9} {:>9}'.format('was p50', 'change') if compare else ''))
+
+
+# Sizes rather than times, {section: {name: {column: bytes}}} in the results
+bytes_columns = ['json', 'deflate', 'compact']
+
+
+def report_bytes(name, sizes):
+    result = dict(zip(bytes_columns, sizes))
+    results.setdefault(section, {})[name] = result
+    print('{:<40} {:>9.1f} {:>9.1f} {:>9.1f} {:>+8.1f}%'.format(
+        name, *(sizes + [(result['compact'] / result['json'] - 1) * 100])))
+
+
+def report_bytes_header(title):
+    global section
+    section = title
+    print()
+    print('{:<40} {:>9} {:>9} {:>9} {:>9}'.format(title, *(bytes_columns + ['change'])))
+
+
+# CherryServer.render() time per template, with and without the precompiled stream transforms
+def benchmark_render(args):
+    cherrypy.session = cherrypy.serving.session = {'team_number': '', 'user_name': 'benchmark'}
+    cherrypy.serving.request.path_info = '/'
+    server = sharkscout.CherryServer()
+
+    year = date.today().year
+    page = {
+        'event': {'key': str(year) + 'bench', 'year': year, 'name': 'Benchmark', 'teams': [], 'matches': []},
+        'match': {},
+        'teams': {},
+        'team': {},
+        'saved': {},
+        '__FORM__': '',
+        '__TEMPLATE__': 'index',
+        '__CONTENT__': ''
+    }
+
+    templates = [('index', True), ('scout_match', True), ('scout_pit', True)]
+    for root, dirs, files in os.walk(os.path.join(server.www, 'scouting')):
+        for file in sorted(files):
+            templates.append((os.path.relpath(os.path.join(root, file), server.www)[:-5].replace('\\', '/'), True))
+    if args.mongo_host:
+        sharkscout.Mongo(args.mongo_host)
+        templates.append(('www', False))
+
+    for mode in ['precompiled', 'transform per render']:
+        report_header(mode)
+        for template, strip_html in templates:
+            def render():
+                if mode != 'precompiled':
+                    server.compiled.clear()
+                server.render(template, dict(page, year=page['event']['year']), strip_html)
+
+            try:
+                report(template, timed(render, args.iterations))
+            except Exception as e:
+                print('{:<40} {}'.format(template, repr(e)))
+
+
+# Minimal CherryPy app that touches the session the way SharkScout pages do
+def _session_server(port, storage_class, locking, storage_path):
+    class Root(object):
+        @cherrypy.expose
+        def page(self):
+            # Like CherryServer.render() and CherryServer.display()
+            for key in ['team_number', 'user_name']:
+                if key not in cherrypy.session:
+                    cherrypy.session[key] = ''
+            if cherrypy.session.get('refresh') != cherrypy.request.path_info:
+                cherrypy.session['refresh'] = cherrypy.request.path_info
+            return 'page'
+
+        @cherrypy.expose
+        def settings(self):
+            cherrypy.session['user_name'] = str(time.time())
+            return 'settings'
+
+    cherrypy.config.update({
+        'server.socket_port': port,
+        'server.thread_pool': 30,
+        'log.screen': False,
+        'engine.autoreload.on': False
+    })
+    cherrypy.quickstart(Root(), '', {'/': {
+        'tools.sessions.on': True,
+        'tools.sessions.locking': locking,
+        'tools.sessions.storage_class': storage_class,
+        'tools.sessions.storage_path': storage_path
+    }})
+
+
+# Requests per second per session, with several concurrent requests sharing each session
+def benchmark_sessions(args):
+    backends = [
+        ('FileSession (early locking)', cherrypy.lib.sessions.FileSession, 'early'),
+        ('MemorySession', sharkscout.MemorySession, 'explicit')
+    ]
+    print()
+    print('{:<40} {:>9} {:>12} {:>14}'.format('backend', 'sessions', 'requests/s', 'req/s/session'))
+    for name, storage_class, locking in backends:
+        port = sharkscout.Util.open_port()
+        storage_path = tempfile.mkdtemp()
+        server = multiprocessing.Process(target=_session_server, args=(port, storage_class, locking, storage_path))
+        server.start()
+        url = 'http://127.0.0.1:' + str(port)
+        while True:
+            try:
+                requests.get(url + '/page')
+                break
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.1)
+
+        def client(session, idx):
+            count = 0
+            deadline = time.time() + args.seconds
+            while time.time() < deadline:
+                # 1 in 10 requests changes a setting, the rest are page views
+                session.get(url + ('/settings' if count % 10 == idx % 10 else '/page'))
+                count += 1
+            return count
+
+        sessions = []
+        for _ in range(args.sessions):
+            session = requests.Session()
+            session.get(url + '/page')
+            sessions.append(session)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.sessions * args.concurrency) as pool:
+            futures = [pool.submit(client, sessions[idx % args.sessions], idx)
+                       for idx in range(args.sessions * args.concurrency)]
+            total = sum([f.result() for f in futures])
+        server.terminate()
+        server.join()
+
+        rate = total / args.seconds
+        print('{:<40} {:>9} {:>12.1f} {:>14.1f}'.format(name, args.sessions, rate, rate / args.sessions))
+
+
+# Match scouting write latency and listing queries, normalized scouting_matches vs. the legacy embedded array
+def benchmark_scouting(args):
+    if not args.mongo_host:
+        print('the scouting benchmark needs --mongo')
+        sys.exit(1)
+
+    # Don't touch real data
+    sharkscout.Mongo.database = 'shark_scout_benchmark'
+    mongo = sharkscout.Mongo(args.mongo_host)
+    mongo.client.drop_database(sharkscout.Mongo.database)
+    mongo.index()
+    legacy = mongo.shark_scout.scouting_legacy
+    legacy.create_index([('event_key', pymongo.ASCENDING), ('team_key', pymongo.ASCENDING)], unique=True)
+
+    event_key = '2018bench'
+    teams = ['frc' + str(n) for n in range(1, args.teams + 1)]
+    matches = []
+    for match_number in range(1, args.matches + 1):
+        match_teams = random.sample(teams, 6)
+        matches.append({
+            'key': event_key + '_qm' + str(match_number),
+            'comp_level': 'qm',
+            'match_number': match_number,
+            'alliances': {'blue': {'teams': match_teams[:3]}, 'red': {'teams': match_teams[3:]}}
+        })
+    mongo.tba_events.insert_one({'key': event_key, 'year': 2018, 'event_code': 'bench', 'matches': matches})
+    mongo.tba_teams.insert_many([{'key': t, 'team_number': int(t[3:])} for t in teams])
+
+    submissions = []
+    for match in matches:
+        for color in match['alliances']:
+            for team_key in match['alliances'][color]['teams']:
+                submissions.append({
+                    'event_key': event_key,
+                    'match_key': match['key'],
+                    'team_key': team_key,
+                    'team_color': color,
+                    'scouter': 'benchmark',
+                    'cubes_scale': random.randint(0, 5),
+                    'cubes_switch_own': random.randint(0, 5),
+                    'comments': 'x' * 100
+                })
+
+    # The embedded layout before scouting_matches existed
+    def legacy_update(data):
+        result = legacy.update_one({
+            'event_key': data['event_key'],
+            'team_key': data['team_key'],
+            'matches.match_key': data['match_key']
+        }, {'$set': {'matches.$': data}})
+        if not result.matched_count:
+            legacy.update_one({
+                'event_key': data['event_key'],
+                'team_key': data['team_key'],
+            }, {'$push': {'matches': data}}, upsert=True)
+
+    def legacy_raw():
+        return list(legacy.aggregate([
+            {'$match': {'event_key': event_key}},
+            {'$unwind': {'path': '$matches'}},
+            {'$replaceRoot': {'newRoot': '$matches'}},
+            {'$sort': {'match_key': 1, 'team_key': 1}}
+        ]))
+
+    def legacy_match(data):
+        return list(legacy.aggregate([
+            {'$match': {'event_key': event_key, 'team_key': data['team_key']}},
+            {'$project': {'matches': {'$filter': {
+                'input': '$matches', 'as': 'match', 'cond': {'$eq': ['$$match.match_key', data['match_key']]}}}}},
+            {'$project': {'match': {'$arrayElemAt': ['$matches', 0]}}},
+            {'$match': {'match': {'$exists': True}}}
+        ]))
+
+    print()
+    print('{} matches, {} teams, {} submissions'.format(len(matches), len(teams), len(submissions)))
+
+    def writes(update):
+        durations = []
+        for data in submissions:
+            start = time.perf_counter()
+            update(dict(data))
+            durations.append((time.perf_counter() - start) * 1000)
+        return durations
+
+    report_header('writes (insert, then update)')
+    report('legacy embedded array insert', writes(legacy_update))
+    report('legacy embedded array update', writes(legacy_update))
+    report('scouting_matches insert', writes(mongo.scouting_match_update))
+    report('scouting_matches update', writes(mongo.scouting_match_update))
+
+    report_header('listing')
+    report('legacy scouting_matches_raw', timed(legacy_raw, args.iterations))
+    report('scouting_matches_raw', timed(lambda: mongo.scouting_matches_raw(event_key), args.iterations))
+    report('legacy scouting_match', timed(lambda: legacy_match(random.choice(submissions)), args.iterations))
+    report('scouting_match', timed(lambda: mongo.scouting_match(
+        event_key, *[random.choice(submissions)[k] for k in ['match_key', 'team_key']]), args.iterations))
+    report('scouting_matches', timed(lambda: mongo.scouting_matches(event_key), args.iterations))
+    report('scouting_stats', timed(lambda: mongo.scouting_stats(event_key), args.iterations))
+
+    mongo.client.drop_database(sharkscout.Mongo.database)
+
+# Time until the first page is served and memory once serving, per storage backend
+def benchmark_startup(args):
+    shark_scout = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SharkScout.py')
+    print()
+    print('{:<40} {:>9} {:>12} {:>12}'.format('backend', 'runs', 'startup ms', 'RSS MiB'))
+    for backend in sorted(sharkscout.Mongo.backends.keys()):
+        startups = []
+        rss = []
+        for _ in range(args.runs):
+            port = sharkscout.Util.open_port()
+            url = 'http://127.0.0.1:' + str(port)
+            start = time.perf_counter()
+            proc = subprocess.Popen([sys.executable, shark_scout, '-nb', '-b', backend, '-p', str(port)],
+                                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            while proc.poll() is None:
+                try:
+                    if requests.get(url + '/').status_code == 200:
+                        break
+                except requests.exceptions.ConnectionError:
+                    time.sleep(0.05)
+            if proc.poll() is not None:
+                print('{:<40} exited with code {}'.format(backend, proc.returncode))
+                break
+            startups.append((time.perf_counter() - start) * 1000)
+
+            # A few typical pages, then everything the app has running (mongod included, even if it was already up)
+            for page in ['/', '/events', '/teams', '/api/v1/events/' + str(date.today().year)]:
+                requests.get(url + page)
+            procs = [psutil.Process(proc.pid)] + psutil.Process(proc.pid).children(recursive=True)
+            if backend == 'mongod':
+                procs += [psutil.Process(pid) for pid in sharkscout.Util.pids('mongod') if
+                          pid not in [p.pid for p in procs]]
+            rss.append(sum([p.memory_info().rss for p in procs]) / 1024 / 1024)
+
+            proc.terminate()
+            proc.wait()
+        if startups:
+            print('{:<40} {:>9} {:>12.1f} {:>12.1f}'.format(backend, len(startups), statistics.mean(startups),
+                                                             statistics.mean(rss)))
+
+
+# Mongo method, page handler and Genshi render times against a synthetic dataset (see sharkscout.Synthetic)
+def benchmark_synthetic(args):
+    if args.backend == 'mongod' and not args.mongo_host:
+        print('the synthetic benchmark needs --mongo, or the sqlite backend')
+        sys.exit(1)
+
+    # Don't touch real data
+    sharkscout.Mongo.backend = args.backend
+    sharkscout.Mongo.database = 'shark_scout_benchmark'
+    mongo = sharkscout.Mongo(args.mongo_host)
+    mongo.client.drop_database(sharkscout.Mongo.database)
+    mongo.index()
+
+    synthetic = sharkscout.Synthetic(args.seed)
+    start = time.perf_counter()
+    synthetic.generate(mongo, args.events, matches=args.matches)
+    print()
+    print('{} events generated in {:.1f}s'.format(args.events, time.perf_counter() - start))
+
+    year = synthetic.year
+    event = mongo.tba_events.find_one({'key': str(year) + synthetic.event_code + '1'})
+    event_key = event['key']
+    matches = [m for m in event['matches'] if m['comp_level'] == 'qm']
+    scouted = mongo.scouting_matches_raw(event_key)
+    pit = list(mongo.scouting_pit_teams(event_key).values())
+    choose = random.Random(args.seed).choice
+
+    report_header('reads')
+    reads = [
+        ('events', lambda: mongo.events(year)),
+        ('events_stats', lambda: mongo.events_stats(year)),
+        ('event', lambda: mongo.event(event_key)),
+        ('team', lambda: mongo.team(choose(event['teams']))),
+        ('team_events', lambda: mongo.team_events(choose(event['teams']), year)),
+        ('team_stats', lambda: mongo.team_stats(choose(event['teams']))),
+        ('teams_paged', lambda: mongo.teams_paged(0)),
+        ('teams_stats', lambda: mongo.teams_stats()),
+        ('scouting_matches', lambda: mongo.scouting_matches(event_key)),
+        ('scouting_matches_raw', lambda: mongo.scouting_matches_raw(event_key)),
+        ('scouting_match', lambda: mongo.scouting_match(
+            event_key, *[choose(scouted)[k] for k in ['match_key', 'team_key']])),
+        ('scouting_pit', lambda: mongo.scouting_pit(event_key, choose(pit)['team_key'])),
+        ('scouting_pit_teams', lambda: mongo.scouting_pit_teams(event_key)),
+        ('scouting_stats', lambda: mongo.scouting_stats(event_key))
+    ]
+    for name, read in reads:
+        report(name, timed(read, args.iterations))
+    # scouting_stats' own trend lines and rolling averages, for every team and stat
+    individual = mongo.scouting_stats(event_key)['individual']
+    report('Trends', timed(lambda: sharkscout.Trends.attach(individual), args.iterations))
+
+    # Every write changes one field, like rescouting a match
+    report_header('writes')
+    report('scouting_match_update', timed(lambda: mongo.scouting_match_update(
+        dict(choose(scouted), comments_offense=str(time.perf_counter()))), args.iterations))
+    report('scouting_pit_update', timed(lambda: mongo.scouting_pit_update(
+        dict(choose(pit), common_robot_problems=str(time.perf_counter()))), args.iterations))
+
+    # Local ratings from scratch, then kept up to date as the last qualification match posts (and is taken back)
+    report_header('ratings')
+    full = mongo.event(event_key)
+    report('event_ratings', timed(lambda: mongo.event_ratings(full), args.iterations))
+    report('Ratings (from scratch)', timed(lambda: sharkscout.Ratings().update(full['matches'], scouted).stats(),
+                                           args.iterations))
+    ratings = sharkscout.Ratings().update(full['matches'], scouted)
+    unposted = [dict(m, alliances={c: dict(a, score=-1) for c, a in m['alliances'].items()})
+                if m['key'] == matches[-1]['key'] else m for m in full['matches']]
+    posts = itertools.cycle([unposted, full['matches']])
+    report('Ratings (one match posted)', timed(lambda: ratings.update(next(posts), scouted).stats(), args.iterations))
+
+    # Projecting the remaining half of the qualification schedule, then the cached projection
+    report_header('projection')
+    halfway = dict(full, matches=unposted[:len(unposted) // 2] + [
+        dict(m, alliances={c: dict(a, score=-1) for c, a in m['alliances'].items()}, score_breakdown=None)
+        for m in unposted[len(unposted) // 2:]])
+    halfway_ratings = sharkscout.Ratings().update(halfway['matches'], scouted).stats()
+    stats = mongo.scouting_stats(event_key)['individual']
+    spec = mongo._scouting_stats_spec(year)[2]
+    for iterations in [1000, sharkscout.Projection.iterations]:
+        report('Projection ({} runs)'.format(iterations), timed(lambda: sharkscout.Projection(
+            halfway, halfway_ratings, stats, spec).result(iterations), args.iterations))
+    report('event_projection (cached)', timed(lambda: mongo.event_projection(halfway, halfway_ratings, stats),
+                                              args.iterations))
+
+    # Page handlers with their rendering set aside, then the rendering on its own
+    cherrypy.session = cherrypy.serving.session = {'team_number': '', 'user_name': 'benchmark'}
+    cherrypy.serving.request.path_info = '/'
+    index = sharkscout.Index()
+    display = index.display
+    displayed = []
+    index.display = lambda template, page=None: displayed.append((template, page)) or ''
+    match_key = choose(matches)['key']
+    pages = [
+        ('/events/<year>', lambda: index.events(year)),
+        ('/event/<event_key>', lambda: index.event(event_key)),
+        ('/stats/<event_key>/<match_key>', lambda: index.stats(event_key, match_key)),
+        ('/teams', lambda: index.teams()),
+        ('/team/<team_key>/<year>', lambda: index.team(choose(event['teams']), year))
+    ]
+    report_header('page handlers (without rendering)')
+    for name, handler in pages:
+        report(name, timed(handler, args.iterations))
+    report_header('page renders')
+    for name, handler in pages:
+        handler()
+        template, page = displayed[-1]
+        report(name, timed(lambda: display(template, page), args.iterations))
+
+    # Everything the event page needs before it's first drawn, then each of its sections as its tab is shown
+    report_header('event page sections (with rendering)')
+    index.display = display
+    report('/event/<event_key> (first paint)', timed(lambda: index.event(event_key), args.iterations))
+    for section in sharkscout.Fragment.collections:
+        report('/fragment/event/' + section, timed(lambda: index.fragment.event(section, event_key), args.iterations))
+
+    # Bytes per WebSocket message as JSON, as JSON through a per-message deflate (for reference) and in the compact
+    #  encoding, then the time to encode and decode a match scouting submission
+    submissions = [{k: v for k, v in s.items() if k != '_id'} for s in scouted]
+    dictionary = sharkscout.Compact.dictionary(year)
+    messages = [
+        ('scouting_match submission', lambda s: {'scouting_match': [s]}),
+        ('scouting_match dequeue reply', lambda s: {
+            'dequeue': {'scouting_match': s},
+            'toast': {'message': 'You match scouted ' + s['match_key'] + ' ' + s['team_key'], 'type': 'success'}
+        }),
+        ('ping', lambda s: {'ping': 'ping'}),
+        ('time_team reply', lambda s: {'time_team': {'key': s['team_key'], 'nickname': 'Synthetic Robotics'}})
+    ]
+    def deflated(data):
+        deflate = zlib.compressobj(wbits=-zlib.MAX_WBITS)  # raw, no context carried between messages
+        return deflate.compress(data) + deflate.flush()
+
+    report_bytes_header('websocket bytes per message')
+    for name, message in messages:
+        encoded = [json.dumps(message(s)).encode() for s in submissions]
+        report_bytes(name, [statistics.mean([len(e) for e in encoded]),
+                            statistics.mean([len(deflated(e)) for e in encoded]),
+                            statistics.mean([len(sharkscout.Compact.encode(message(s), dictionary))
+                                             for s in submissions])])
+    report_header('websocket encoding')
+    submission = {'scouting_match': [choose(submissions)]}
+    packed = sharkscout.Compact.encode(submission, dictionary)
+    dumped = json.dumps(submission)
+    report('json.dumps (submission)', timed(lambda: json.dumps(submission), args.iterations * 10))
+    report('json.loads (submission)', timed(lambda: json.loads(dumped), args.iterations * 10))
+    report('Compact.encode (submission)', timed(lambda: sharkscout.Compact.encode(submission, dictionary),
+                                                args.iterations * 10))
+    report('Compact.decode (submission)', timed(lambda: sharkscout.Compact.decode(packed, dictionary),
+                                                args.iterations * 10))
+
+    mongo.client.drop_database(sharkscout.Mongo.database)
+
+
+def _load_client(url, pages, seconds):
+    session = requests.Session()
+    count = 0
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        session.get(url + pages[count % len(pages)])
+        count += 1
+    return count
+
+
+# Peak RSS (MiB) of a fresh process going through every team the way -uti does, before and after it does
+def _updaters_peak(backend, mongo_host, database, keys_only):
+    sharkscout.Mongo.backend = backend
+    sharkscout.Mongo.database = database
+    mongo = sharkscout.Mongo(mongo_host)
+    mongo.tba_count
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def team_update(team_key, update_favicon=False):
+        pass
+
+    if keys_only:
+        team_keys = [t['key'] for t in mongo.teams_iter(['key'])]
+        for _ in sharkscout.Util.map_bounded(team_update, team_keys):
+            pass
+    else:
+        # (how -uti went through the teams before it read only their keys)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+            futures = {pool.submit(team_update, team['key']): team for team in mongo.teams()}
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024  # (bytes on macOS, KiB elsewhere)
+    return before / scale, after / scale
+
+
+# Peak memory of the bulk TBA updaters' team listing, every team document (media and favicon included) held at once
+#  vs just their keys, against a scratch database of that many teams
+def benchmark_updaters(args):
+    if args.backend == 'mongod' and not args.mongo_host:
+        print('the updaters benchmark needs --mongo, or the sqlite backend')
+        sys.exit(1)
+
+    # Don't touch real data
+    sharkscout.Mongo.backend = args.backend
+    sharkscout.Mongo.database = 'shark_scout_benchmark'
+    mongo = sharkscout.Mongo(args.mongo_host)
+    mongo.client.drop_database(sharkscout.Mongo.database)
+    mongo.index()
+
+    # Teams the size of TBA's: an avatar and a favicon each, as base64 data
+    synthetic = sharkscout.Synthetic(args.seed)
+    teams = []
+    for team_number in range(1, args.teams + 1):
+        team = synthetic.team(team_number)
+        team['media'] = [{'type': 'avatar', 'foreign_key': 'avatar_' + str(synthetic.year) + '_' + team['key'],
+                          'details': {'base64Image': base64.b64encode(os.urandom(3 * 1024)).decode()}}]
+        team['favicon'] = 'data:image/png;base64,' + base64.b64encode(os.urandom(1024)).decode()
+        teams.append(team)
+        if len(teams) == 1000:
+            mongo.tba_teams.insert_many(teams)
+            teams = []
+    if teams:
+        mongo.tba_teams.insert_many(teams)
+    del teams
+
+    global section
+    section = 'updaters'
+    print()
+    print('{:<40} {:>12} {:>12} {:>12}'.format('team listing (' + str(args.teams) + ' teams)', 'before MiB',
+                                                'peak MiB', 'growth MiB'))
+    context = multiprocessing.get_context('spawn')  # (a forked process would start with this one's peak)
+    for name, keys_only in [('every team at once', False), ('just the keys', True)]:
+        with context.Pool(1) as pool:
+            before, after = pool.apply(_updaters_peak, (args.backend, args.mongo_host, sharkscout.Mongo.database,
+                                                        keys_only))
+        results.setdefault(section, {})[name] = {'before_mib': before, 'peak_mib': after}
+        print('{:<40} {:>12.1f} {:>12.1f} {:>12.1f}'.format(name, before, after, after - before))
+
+    mongo.client.drop_database(sharkscout.Mongo.database)
+
+
+# Requests per second with 1..N web server processes (--workers), clients in their own processes
+def benchmark_workers(args):
+    shark_scout = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SharkScout.py')
+    pages = ['/', '/events', '/teams', '/api/v1/events/' + str(date.today().year)]
+    print()
+    print('{:<40} {:>9} {:>12} {:>9}'.format('backend', 'workers', 'requests/s', 'speedup'))
+    baseline = None
+    for workers in args.workers:
+        port = sharkscout.Util.open_port()
+        url = 'http://127.0.0.1:' + str(port)
+        proc = subprocess.Popen([sys.executable, shark_scout, '-nb', '-b', args.backend, '-p', str(port), '-w',
+                                 str(workers)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while proc.poll() is None:
+            try:
+                if requests.get(url + '/').status_code == 200:
+                    break
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.1)
+        if proc.poll() is not None:
+            print('{:<40} {:>9} exited with code {}'.format(args.backend, workers, proc.returncode))
+            continue
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.clients) as pool:
+            futures = [pool.submit(_load_client, url, pages, args.seconds) for _ in range(args.clients)]
+            rate = sum([f.result() for f in futures]) / args.seconds
+        proc.terminate()
+        proc.wait()
+
+        baseline = baseline or rate
+        print('{:<40} {:>9} {:>12.1f} {:>8.2f}x'.format(args.backend, workers, rate, rate / baseline))
+
+
+# A minimal WebSocket client, masking what it sends like a browser
+async def _socket_open(port):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(('GET /ws HTTP/1.1\r\n'
+                  'Host: 127.0.0.1:' + str(port) + '\r\n'
+                  'Upgrade: websocket\r\n'
+                  'Connection: Upgrade\r\n'
+                  'Sec-WebSocket-Key: ' + base64.b64encode(os.urandom(16)).decode() + '\r\n'
+                  'Sec-WebSocket-Version: 13\r\n'
+                  '\r\n').encode())
+    response = await reader.readuntil(b'\r\n\r\n')
+    if b' 101 ' not in response.split(b'\r\n')[0]:
+        raise ConnectionError(response.split(b'\r\n')[0].decode())
+    return reader, writer
+
+
+def _socket_send(writer, message):
+    payload = json.dumps(message).encode()
+    mask = os.urandom(4)
+    header = bytearray(sharkscout.GatewayConnection.frame(0x1, b''.ljust(len(payload)))[:-len(payload)])
+    header[1] |= 0x80  # masked
+    writer.write(bytes(header) + mask + sharkscout.GatewayConnection.unmask(payload, mask))
+
+
+async def _socket_receive(reader):
+    head = await reader.readexactly(2)
+    length = head[1] & 0x7f
+    if length == 126:
+        length = int.from_bytes(await reader.readexactly(2), 'big')
+    elif length == 127:
+        length = int.from_bytes(await reader.readexactly(8), 'big')
+    return json.loads(await reader.readexactly(length))
+
+
+# One client process's share of open browser tabs: connect them all, then have each ping every 500ms like
+#  sharkscout.js does, returning (sockets that couldn't connect or lost their connection, every ping's round trip in ms)
+def _socket_client(port, sockets, seconds):
+    async def tab(connecting, round_trips):
+        try:
+            async with connecting:
+                reader, writer = await _socket_open(port)
+        except (OSError, ConnectionError, asyncio.IncompleteReadError):
+            return 1
+        await asyncio.sleep(random.random() * 0.5)
+        deadline = time.perf_counter() + seconds
+        try:
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                _socket_send(writer, {'ping': 'ping'})
+                while 'pong' not in await _socket_receive(reader):
+                    pass
+                round_trips.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(max(0.0, 0.5 - (time.perf_counter() - start)))
+        except (OSError, asyncio.IncompleteReadError):
+            return 1
+        finally:
+            writer.close()
+        return 0
+
+    async def run():
+        connecting = asyncio.Semaphore(20)  # don't overflow the listen backlog
+        round_trips = []
+        failed = await asyncio.gather(*[tab(connecting, round_trips) for _ in range(sockets)])
+        return sum(failed), round_trips
+
+    return asyncio.run(run())
+
+
+# Ping round trips with more and more open tabs, through /ws inside the web server and through --gateway
+def benchmark_gateway(args):
+    shark_scout = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SharkScout.py')
+    for server in ['/ws', 'gateway']:
+        port = sharkscout.Util.open_port()
+        command = [sys.executable, shark_scout, '-nb', '-b', args.backend, '-p', str(port)]
+        socket_port = port
+        if server == 'gateway':
+            socket_port = sharkscout.Util.open_port()
+            command += ['-gw', str(socket_port)]
+        proc = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        while proc.poll() is None:
+            try:
+                if requests.get('http://127.0.0.1:' + str(port) + '/').status_code == 200:
+                    break
+            except requests.exceptions.ConnectionError:
+                time.sleep(0.1)
+        time.sleep(1)  # (the gateway may still be starting)
+        if proc.poll() is not None:
+            print('{} exited with code {}'.format(server, proc.returncode))
+            continue
+
+        # (while --viewers keep the web server busy with pages)
+        report_header(server + ' ping round trips')
+        pages = ['/', '/events', '/teams', '/api/v1/events/' + str(date.today().year)]
+        for sockets in args.sockets:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=args.clients + args.viewers) as pool:
+                viewers = [pool.submit(_load_client, 'http://127.0.0.1:' + str(port), pages, args.seconds + 5)
+                           for _ in range(args.viewers)]
+                shares = [sockets // args.clients + (i < sockets % args.clients) for i in range(args.clients)]
+                futures = [pool.submit(_socket_client, socket_port, share, args.seconds) for share in shares]
+                failed = 0
+                round_trips = []
+                for future in futures:
+                    result = future.result()
+                    failed += result[0]
+                    round_trips += result[1]
+                for viewer in viewers:
+                    viewer.result()
+            name = '{} tabs'.format(sockets) + (' ({} failed)'.format(failed) if failed else '')
+            if round_trips:
+                report(name, round_trips)
+            else:
+                print('{:<40} every tab failed'.format(name))
+        proc.terminate()
+        proc.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog=__file__)
+    parser.add_argument('-i', '--iterations', metavar='count', help='iterations per measurement (default: 50)',
+                        type=int, default=50)
+    parser.add_argument('-m', '--mongo', dest='mongo_host', help='mongo host URL (enables benchmarks that need it)',
+                        type=str)
+    parser.add_argument('-o', '--output', metavar='file', help='save the results as JSON', type=str)
+    parser.add_argument('-cp', '--compare', metavar='file', help='compare to results saved earlier with --output',
+                        type=str)
+    subparsers = parser.add_subparsers(dest='benchmark', metavar='benchmark')
+    subparsers.required = True
+    subparsers.add_parser('render', help='CherryServer.render() time per template')
+    sessions = subparsers.add_parser('sessions', help='session backend requests/s per session under concurrency')
+    sessions.add_argument('-s', '--sessions', metavar='count', help='browser sessions (default: 4)', type=int,
+                          default=4)
+    sessions.add_argument('-c', '--concurrency', metavar='count',
+                          help='concurrent requests per session (default: 4)', type=int, default=4)
+    sessions.add_argument('-t', '--seconds', metavar='seconds', help='duration per backend (default: 10)', type=int,
+                          default=10)
+    scouting = subparsers.add_parser('scouting', help='match scouting write latency and listing queries (needs --mongo)')
+    scouting.add_argument('-ma', '--matches', metavar='count', help='qualification matches (default: 120)', type=int,
+                          default=120)
+    scouting.add_argument('-te', '--teams', metavar='count', help='teams at the event (default: 40)', type=int,
+                          default=40)
+    gateway = subparsers.add_parser('gateway', help='WebSocket ping round trips per open tab count, /ws and --gateway')
+    gateway.add_argument('-so', '--sockets', metavar='counts', help='open tab counts (default: 100,250,500,1000)',
+                         type=pynumparser.NumberSequence(limits=(1, 10000)))
+    gateway.add_argument('-b', '--backend', help='storage backend (default: mongod)',
+                         choices=sorted(sharkscout.Mongo.backends.keys()), default=sharkscout.Mongo.backend)
+    gateway.add_argument('-c', '--clients', metavar='count', help='client processes holding the tabs (default: 2)',
+                         type=int, default=2)
+    gateway.add_argument('-v', '--viewers', metavar='count',
+                         help='client processes requesting pages at the same time (default: 2)', type=int, default=2)
+    gateway.add_argument('-t', '--seconds', metavar='seconds', help='duration per tab count (default: 10)', type=int,
+                         default=10)
+    startup = subparsers.add_parser('startup', help='time to first page and RSS, per storage backend')
+    startup.add_argument('-r', '--runs', metavar='count', help='startups per backend (default: 3)', type=int, default=3)
+    synthetic = subparsers.add_parser('synthetic',
+                                      help='Mongo method, page handler and render times against synthetic data')
+    synthetic.add_argument('-b', '--backend', help='storage backend (default: mongod, needs --mongo)',
+                           choices=sorted(sharkscout.Mongo.backends.keys()), default=sharkscout.Mongo.backend)
+    synthetic.add_argument('-e', '--events', metavar='count', help='events to generate (default: 1)', type=int,
+                           default=1)
+    synthetic.add_argument('-ma', '--matches', metavar='count', help='qualification matches per event (default: 80)',
+                           type=int, default=80)
+    synthetic.add_argument('-s', '--seed', metavar='seed', help='random seed (default: 0)', type=int, default=0)
+    updaters = subparsers.add_parser('updaters', help='peak RSS of the bulk TBA updaters\' team listing')
+    updaters.add_argument('-b', '--backend', help='storage backend (default: mongod, needs --mongo)',
+                          choices=sorted(sharkscout.Mongo.backends.keys()), default=sharkscout.Mongo.backend)
+    updaters.add_argument('-te', '--teams', metavar='count', help='teams (default: 8000)', type=int, default=8000)
+    updaters.add_argument('-s', '--seed', metavar='seed', help='random seed (default: 0)', type=int, default=0)
+    workers = subparsers.add_parser('workers', help='requests/s per number of web server processes (--workers)')
+    workers.add_argument('-w', '--workers', metavar='counts', help='worker counts (default: 1,2,<cores>)',
+                         type=pynumparser.NumberSequence(limits=(1, 64)))
+    workers.add_argument('-b', '--backend', help='storage backend (default: mongod)',
+                         choices=sorted(sharkscout.Mongo.backends.keys()), default=sharkscout.Mongo.backend)
+    workers.add_argument('-c', '--clients', metavar='count',
+                         help='client processes making requests (default: 2 per core)', type=int,
+                         default=2 * (os.cpu_count() or 1))
+    workers.add_argument('-t', '--seconds', metavar='seconds', help='duration per worker count (default: 10)',
+                         type=int, default=10)
+    args = parser.parse_args()
+    if args.benchmark == 'workers':
+        args.workers = sorted(set(args.workers or [1, 2, os.cpu_count() or 1]))
+    if args.benchmark == 'gateway':
+        args.sockets = sorted(set(args.sockets or [100, 250, 500, 1000]))
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            compare.update(json.load(f)['results'])
+
+    {
+        'gateway': benchmark_gateway,
+        'render': benchmark_render,
+        'sessions': benchmark_sessions,
+        'scouting': benchmark_scouting,
+        'startup': benchmark_startup,
+        'synthetic': benchmark_synthetic,
+        'updaters': benchmark_updaters,
+        'workers': benchmark_workers
+    }[args.benchmark](args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'timestamp': datetime.utcnow().isoformat() + 'Z',
+                'benchmark': args.benchmark,
+                'args': {k: v for k, v in vars(args).items() if k not in ['output', 'compare']},
+                'results': results
+            }, f, indent=2, sort_keys=True)
+        print()
+        print('Results saved to "' + args.output + '"')
+
+    sys.exit(0)
@@ -5,17 +5,24 @@ import sys
 import time
 
 import argparse
+import concurrent.futures
 import datetime
+import json
+import math
 import os
 import psutil
 import pynumparser
+import queue
+import random
 import re
 import requests
 import scrapy.crawler
 import scrapy.exceptions
 import scrapy.spiders
 import subprocess
+import threading
 import urllib.parse
+import ws4py.client.threadedclient
 
 import sharkscout
 
@@ -52,6 +59,7 @@ class Spider(scrapy.spiders.Spider):
             raise scrapy.exceptions.CloseSpider(int(response.status))
 
         urls = response.xpath("//*[not(contains(@class,'disabled'))]/@href").extract()
+        urls += response.xpath('//*/@data-fragment').extract()  # event page sections
 
         # Prevent urllib.parse.urlparse() from being dumb...
         urls = [('http://' if 'www' in u else '') + u for u in urls]
@@ -83,10 +91,358 @@ class Spider(scrapy.spiders.Spider):
         self.__class__.closed_reason = reason
 
 
+# WebSocket client that queues every message it receives for whoever is waiting on one
+class LoadSocket(ws4py.client.threadedclient.WebSocketClient):
+    def __init__(self, url):
+        super(self.__class__, self).__init__(url)
+        self.messages = queue.Queue()
+
+    def received_message(self, message):
+        self.messages.put(json.loads(message.data.decode()))
+
+    # Send a message and wait for a number of replies with a given key, ignoring broadcasts in between
+    def request(self, payload, key, replies=1, timeout=30):
+        deadline = time.time() + timeout
+        self.send(json.dumps(payload))
+        while replies > 0:
+            if key in self.messages.get(timeout=max(0, deadline - time.time())):
+                replies -= 1
+
+
+# One simulated person at a competition, recording (route, seconds, ok) for everything they do:
+#  viewers browse event, team and stats pages, scouters load scouting forms and submit them over the WebSocket
+#  (queueing submissions while out of Wi-Fi range, like sharkscout.js), pingers are idle tabs pinging the WebSocket
+class LoadUser(threading.Thread):
+    kinds = ['viewer', 'scouter', 'pinger']
+    ping_interval = 0.5  # seconds, like sharkscout.js
+    timeout = 30  # seconds
+
+    def __init__(self, kind, idx, url, site, options, deadline, samples):
+        super(self.__class__, self).__init__(name=kind + ' ' + str(idx), daemon=True)
+        self.kind = kind
+        self.idx = idx
+        self.url = url
+        self.site = site
+        self.options = options
+        self.deadline = deadline
+        self.samples = samples
+        self.random = random.Random(str(options['seed']) + ' ' + self.name)
+        self.session = requests.Session()
+
+    def run(self):
+        self.think()  # don't all start at once
+        getattr(self, self.kind)()
+
+    def record(self, route, start, ok):
+        self.samples.append((route, time.perf_counter() - start, ok))
+
+    def think(self):
+        if self.options['think']:
+            time.sleep(max(0, min(self.random.expovariate(1 / self.options['think']), self.deadline - time.time())))
+
+    def get(self, path):
+        start = time.perf_counter()
+        try:
+            ok = self.session.get(self.url + path, timeout=self.timeout).status_code < 400
+        except requests.exceptions.RequestException:
+            ok = False
+        self.record(sharkscout.Metrics.family(path), start, ok)
+
+    def socket(self):
+        start = time.perf_counter()
+        try:
+            socket = LoadSocket('ws' + self.url[4:] + '/ws')
+            socket.connect()
+            self.record('ws connect', start, True)
+            return socket
+        except Exception:
+            self.record('ws connect', start, False)
+            time.sleep(1)
+            return None
+
+    def send(self, socket, route, payload, key, replies=1):
+        start = time.perf_counter()
+        try:
+            socket.request(payload, key, replies, self.timeout)
+            self.record(route, start, True)
+            return True
+        except Exception:
+            self.record(route, start, False)
+            socket.close()
+            return False
+
+    def viewer(self):
+        year = str(self.site['year'])
+        while time.time() < self.deadline:
+            event = self.random.choice(self.site['events'])
+            pages = ['/event/' + event['key']] * 3 + ['/events/' + year, '/teams']
+            if event['teams']:
+                pages += ['/team/' + self.random.choice(event['teams']) + '/' + year] * 3
+            if event['matches']:
+                pages += ['/stats/' + event['key'] + '/' + self.random.choice(event['matches'])['key']] * 2
+            page = self.random.choice(pages)
+            self.get(page)
+            # Event pages load their first tab's section, and often another
+            if page.startswith('/event/'):
+                for section in ['matches', self.random.choice(list(sharkscout.Fragment.collections))]:
+                    self.get('/fragment/event/' + section + '/' + event['key'] + '/0')
+            self.think()
+
+    # Six scouters per event, one per driver station, scouting every match in order
+    def scouter(self):
+        event = self.site['events'][(self.idx // 6) % len(self.site['events'])]
+        if not event['matches']:
+            return
+        station = self.idx % 6
+        scouted = 0
+        socket = self.socket()
+        queued = []
+        offline = 0  # matches left to scout without a connection
+        while time.time() < self.deadline:
+            match = event['matches'][scouted % len(event['matches'])]
+            scouted += 1
+            team_key = (match['blue'] + match['red'])[station % len(match['blue'] + match['red'])]
+            self.get('/scout/match/' + event['key'] + '/' + match['key'] + '/' + team_key)
+            self.think()
+
+            data = dict(event['scouting']['match'].get(match['key'] + ' ' + team_key) or {
+                'event_key': event['key'],
+                'match_key': match['key'],
+                'team_key': team_key,
+                'team_color': 'blue' if team_key in match['blue'] else 'red'
+            })
+            data.update({'scouter': 'Load ' + str(self.idx), 'comments_offense': 'Load ' + str(scouted)})
+            queued.append(data)
+
+            if not offline and self.random.random() < self.options['offline']:
+                offline = self.random.randint(2, 8)
+                if socket is not None:
+                    socket.close()
+                    socket = None
+            if offline:
+                offline -= 1
+                continue
+
+            # Back online, the whole queue is sent in one message
+            socket = socket or self.socket()
+            if socket is not None:
+                route = 'ws scouting_match' + (' (queued)' if len(queued) > 1 else '')
+                if not self.send(socket, route, {'scouting_match': queued}, 'dequeue', len(queued)):
+                    socket = None
+                queued = []
+
+            # Now and then, pit scout one of the teams just seen
+            if socket is not None and self.random.random() < 0.1:
+                self.get('/scout/pit/' + event['key'] + '/' + team_key)
+                self.think()
+                data = dict(event['scouting']['pit'].get(team_key) or {
+                    'event_key': event['key'],
+                    'team_key': team_key
+                })
+                data.update({'scouter': 'Load ' + str(self.idx), 'common_robot_problems': 'Load ' + str(scouted)})
+                if not self.send(socket, 'ws scouting_pit', {'scouting_pit': [data]}, 'dequeue'):
+                    socket = None
+        if socket is not None:
+            socket.close()
+
+    def pinger(self):
+        socket = None
+        minute = None
+        while time.time() < self.deadline:
+            socket = socket or self.socket()
+            if socket is None:
+                continue
+            # And the current "time team", once a minute
+            if time.strftime('%H%M') != minute:
+                minute = time.strftime('%H%M')
+                if not self.send(socket, 'ws time_team', {'time_team': 'frc' + str(int(minute))}, 'time_team'):
+                    socket = None
+                    continue
+            if not self.send(socket, 'ws ping', {'ping': 'ping'}, 'pong'):
+                socket = None
+                continue
+            time.sleep(self.ping_interval)
+        if socket is not None:
+            socket.close()
+
+
+# Every (route, seconds, ok) from the simulated users in one client process
+def _load_process(url, site, users, options, deadline):
+    samples = []
+    threads = [LoadUser(kind, idx, url, site, options, deadline, samples) for kind, idx in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+# Events, teams, matches and scouting to load test with, as served by the API
+def load_site(url, year, scouted_events):
+    def get(path):
+        response = requests.get(url + path, timeout=LoadUser.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def paged(path):
+        items = []
+        page = get(path + '?limit=1000')
+        while True:
+            items += page['data']
+            if not page.get('next'):
+                return items
+            page = get(path + '?limit=1000&cursor=' + page['next'])
+
+    events = []
+    for event in paged('/api/v1/events/' + str(year)):
+        event = get('/api/v1/event/' + event['key'] +
+                    '?fields=key,teams.key,matches.key,matches.alliances.blue.teams,matches.alliances.red.teams')['data']
+        scouting = {'match': {}, 'pit': {}}
+        if len(events) < scouted_events:
+            scouting['match'] = {m['match_key'] + ' ' + m['team_key']: m for m in
+                                 paged('/api/v1/scouting/match/' + event['key']) if 'match_key' in m}
+            scouting['pit'] = {t['team_key']: t for t in paged('/api/v1/scouting/pit/' + event['key'])}
+        events.append({
+            'key': event['key'],
+            'teams': [t['key'] for t in event.get('teams', [])],
+            'matches': [{
+                'key': m['key'],
+                'blue': m['alliances']['blue']['teams'],
+                'red': m['alliances']['red']['teams']
+            } for m in event.get('matches', []) if 'blue' in m.get('alliances', {}) and 'red' in m['alliances']],
+            'scouting': scouting
+        })
+    return {'year': year, 'events': events}
+
+
+def percentile(durations, percent):
+    if not durations:
+        return None
+    return durations[max(0, int(math.ceil(percent / 100 * len(durations))) - 1)] * 1000
+
+
+# p50/p95/p99 latency, throughput and error rate per route
+def load_results(samples, seconds):
+    routes = {}
+    for route, duration, ok in samples:
+        routes.setdefault(route, []).append((duration, ok))
+    routes['total'] = [(duration, ok) for route, duration, ok in samples]
+
+    results = {}
+    for route, route_samples in routes.items():
+        durations = sorted([d for d, ok in route_samples if ok])
+        errors = len(route_samples) - len(durations)
+        results[route] = {
+            'requests': len(route_samples),
+            'errors': errors,
+            'error_rate': errors / len(route_samples) if route_samples else 0,
+            'throughput': len(route_samples) / seconds,
+            'mean_ms': sum(durations) / len(durations) * 1000 if durations else None,
+            'p50_ms': percentile(durations, 50),
+            'p95_ms': percentile(durations, 95),
+            'p99_ms': percentile(durations, 99),
+            'max_ms': durations[-1] * 1000 if durations else None
+        }
+    return results
+
+
+def load_report(results, compare=None):
+    def ms(value):
+        return '{:.1f}'.format(value) if value is not None else '-'
+
+    print()
+    print('{:<36} {:>9} {:>7} {:>8} {:>9} {:>9} {:>9} {:>9}'.format(
+        'route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'p95 was' if compare else ''))
+    for route in sorted(results, key=lambda r: (r == 'total', r)):
+        result = results[route]
+        was = compare['routes'].get(route, {}).get('p95_ms') if compare else None
+        print('{:<36} {:>9} {:>7} {:>8.1f} {:>9} {:>9} {:>9} {:>9}'.format(
+            route, result['requests'], result['errors'], result['throughput'], ms(result['p50_ms']),
+            ms(result['p95_ms']), ms(result['p99_ms']), ms(was) if compare else ''))
+
+
+def load_test(url, known, params):
+    print('Loading events from ' + url + ' ...')
+    try:
+        site = load_site(url, known.year, int(math.ceil(known.scouters / 6)))
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(url + ' isn\'t serving the SharkScout API: ' + repr(e))
+        return None
+    if not site['events']:
+        print('No ' + str(known.year) + ' events to load test, generate some with SharkScout.py --synthetic')
+        return 1
+
+    options = {
+        'seconds': known.load,
+        'viewers': known.viewers,
+        'scouters': known.scouters,
+        'pingers': known.pingers,
+        'think': known.think,
+        'offline': known.offline,
+        'seed': known.seed,
+        'processes': known.processes
+    }
+    users = [(kind, idx) for kind in LoadUser.kinds for idx in range(options[kind + 's'])]
+    print('Load testing with {} viewers, {} scouters and {} pingers in {} processes for {}s ...'.format(
+        known.viewers, known.scouters, known.pingers, known.processes, known.load))
+
+    deadline = time.time() + known.load
+    start = time.time()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=known.processes) as pool:
+        futures = [pool.submit(_load_process, url, site, users[idx::known.processes], options, deadline) for idx in
+                   range(known.processes)]
+        samples = [s for f in futures for s in f.result()]
+    results = load_results(samples, max(known.load, time.time() - start))
+
+    compare = None
+    if known.compare:
+        with open(known.compare, 'r') as f:
+            compare = json.load(f)
+    load_report(results, compare)
+
+    if known.output:
+        try:
+            commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+                                             cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        with open(known.output, 'w') as f:
+            json.dump({
+                'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+                'commit': commit,
+                'params': params,
+                'options': options,
+                'routes': results
+            }, f, indent=2, sort_keys=True)
+        print()
+        print('Results saved to "' + known.output + '"')
+
+    return 1 if results['total']['errors'] else 0
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog=__file__)
     parser.add_argument('-l', '--level', metavar='[1-5]', help='testing level (default: 3)',
                         type=pynumparser.Number(limits=(1, 5)), default=3)
+    # Load testing, long options only so they can't be mistaken for SharkScout's own
+    parser.add_argument('--load', metavar='seconds', help='load test for this long instead of crawling', type=int)
+    parser.add_argument('--viewers', metavar='count', help='users browsing pages (default: 20)', type=int, default=20)
+    parser.add_argument('--scouters', metavar='count', help='users submitting scouting, 6 per event (default: 6)',
+                        type=int, default=6)
+    parser.add_argument('--pingers', metavar='count', help='idle tabs pinging the WebSocket (default: 10)', type=int,
+                        default=10)
+    parser.add_argument('--think', metavar='seconds', help='mean time between a user\'s actions (default: 1)',
+                        type=float, default=1)
+    parser.add_argument('--offline', metavar='fraction',
+                        help='chance a scouter loses the connection for a few matches, queueing (default: 0.2)',
+                        type=float, default=0.2)
+    parser.add_argument('--year', metavar='year', help='year of the events to load test (default: {})'.format(
+        sharkscout.Synthetic.year), type=int, default=sharkscout.Synthetic.year)
+    parser.add_argument('--seed', metavar='seed', help='random seed for the users (default: 0)', type=int, default=0)
+    parser.add_argument('--processes', metavar='count', help='client processes (default: 1 per core)', type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument('--output', metavar='file', help='save the load test results as JSON', type=str)
+    parser.add_argument('--compare', metavar='file', help='compare to load test results saved earlier', type=str)
     parser.add_argument('params', nargs='+')
     known, unknown = parser.parse_known_args()
 
@@ -116,17 +472,23 @@ if __name__ == '__main__':
     ports = []
     while server.poll() is None:
         ports = sharkscout.Util.pid_tree_ports(server.pid)
-        if len(ports) > 1:  # both mongod and web server
-            break
+        # The web server opens its port last, after any mongod it started (there's none with --mongo or SQLite)
+        try:
+            procs = [psutil.Process(server.pid)] + psutil.Process(server.pid).children(True)
+            if [p for p in procs if 'mongod' not in p.name() and sharkscout.Util.pid_ports(p.pid)]:
+                break
+        except psutil.NoSuchProcess:
+            pass
         time.sleep(0.1)
     if not ports:
         sys.exit(1)
     print('Found ports:', ports)
 
     # Start twisted crawler process
-    crawler = scrapy.crawler.CrawlerProcess({
-        'USER_AGENT': 'Mozilla/5.0'
-    })
+    if not known.load:
+        crawler = scrapy.crawler.CrawlerProcess({
+            'USER_AGENT': 'Mozilla/5.0'
+        })
 
     port_found = False
     for port in ports:
@@ -138,6 +500,12 @@ if __name__ == '__main__':
         except requests.exceptions.RequestException as e:
             continue
 
+        if known.load:
+            code = load_test(url, known, params)
+            if code is not None:
+                sys.exit(code)
+            continue
+
         # Add scrawler
         year = str(datetime.date.today().year)
         paths = []
@@ -146,6 +514,7 @@ if __name__ == '__main__':
             paths += [
                 r'/events$',
                 r'/event/' + year + '[^/]+$',
+                r'/fragment/event/[a-z]+/' + year + '[^/]+/0$',
                 r'/teams$',
                 r'/teams/[0-9]+$',
                 r'/team/frc[0-9]+$',
@@ -161,6 +530,7 @@ if __name__ == '__main__':
             paths += [
                 r'/events/[0-9]+$',
                 r'/event/[0-9]+[^/]+$',
+                r'/fragment/event/[a-z]+/[0-9]+[^/]+/0$',
                 r'/team/frc[0-9]+/[0-9]+$',
             ]
         if level >= 4:
@@ -175,7 +545,7 @@ if __name__ == '__main__':
             paths += ['/.+']
         crawler.crawl(Spider(start_url=url, url_regex=[url + p for p in paths]))
 
-    if not port_found:
+    if not port_found or known.load:
         sys.exit(1)
 
     crawler.start()
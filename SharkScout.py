@@ -10,7 +10,8 @@ import logging
 import os
 import psutil
 import pynumparser
-import subprocess
+import shutil
+import socket
 import webbrowser
 from datetime import date
 from tqdm import tqdm
@@ -31,6 +32,12 @@ if __name__ == '__main__':
     # Parse arguments
     parser = argparse.ArgumentParser(prog=__file__)
     parser.add_argument('-p', '--port', metavar='port', help='webserver port (default: 2260)', type=int, default=2260)
+    parser.add_argument('-w', '--workers', metavar='count',
+                        help='web server processes sharing the port, needs SO_REUSEPORT (default: 1)', type=int,
+                        default=1)
+    parser.add_argument('-gw', '--gateway', metavar='port',
+                        help='hold every WebSocket in an asyncio process of its own on this port, needs fork',
+                        type=int)
     parser.add_argument('-nb', '--no-browser', dest='browser', help='don\'t automatically open the web browser',
                         action='store_false', default=True)
     parser.add_argument('-ut', '--update-teams', dest='update_teams', help='update TBA team list', action='store_true',
@@ -50,9 +57,41 @@ if __name__ == '__main__':
                         help='update event website\'s favicon when updating event info', action='store_true',
                         default=False)
     parser.add_argument('-m', '--mongo', dest='mongo_host', help='mongo host URL', type=str)
-    parser.add_argument('-d', '--dump', metavar='file', help='run mongodump after any update(s)', type=str)
-    parser.add_argument('-r', '--restore', metavar='file', help='run mongorestore before any update(s)',
-                        type=argparse.FileType('r'))
+    parser.add_argument('-sy', '--synthetic', metavar='events',
+                        help='fill the database with made-up events, teams and scouting (for load testing)',
+                        type=pynumparser.Number(limits=(1, 500)))
+    parser.add_argument('-sys', '--synthetic-seed', metavar='seed', dest='synthetic_seed',
+                        help='random seed for --synthetic (default: 0)', type=int, default=0)
+    parser.add_argument('-syt', '--synthetic-teams', metavar='count', dest='synthetic_teams',
+                        help='teams per --synthetic event, or a range of them (default: 40-60)',
+                        type=pynumparser.NumberSequence(limits=(6, 100)))
+    parser.add_argument('-sym', '--synthetic-matches', metavar='count', dest='synthetic_matches',
+                        help='qualification matches per --synthetic event (default: 80)',
+                        type=pynumparser.Number(limits=(1, 200)), default=80)
+    parser.add_argument('-syc', '--synthetic-scouters', metavar='count', dest='synthetic_scouters',
+                        help='scouters per --synthetic event, one per driver station (default: 6)',
+                        type=pynumparser.Number(limits=(0, 6)), default=6)
+    parser.add_argument('-sq', '--slow-query', metavar='ms', dest='slow_query',
+                        help='log mongod commands slower than this, with their plan (default: 100)', type=int,
+                        default=sharkscout.QueryProfiler.slow_ms)
+    parser.add_argument('-pr', '--profile', help='allow per-request profiling with ?profile=timing|report|flame',
+                        action='store_true', default=False)
+    parser.add_argument('-b', '--backend', help='storage backend (default: mongod)',
+                        choices=sorted(sharkscout.Mongo.backends.keys()), default=sharkscout.Mongo.backend)
+    parser.add_argument('-s', '--sync', metavar='url', action='append', default=[],
+                        help='sync scouting data with another SharkScout instance (repeatable)')
+    parser.add_argument('-si', '--sync-interval', metavar='minutes', dest='sync_interval',
+                        help='minutes between syncs while running, 0 to sync once (default: 5)', type=int, default=5)
+    parser.add_argument('-d', '--dump', metavar='dir', help='snapshot the database after any update(s)', type=str)
+    parser.add_argument('-r', '--restore', metavar='dir',
+                        help='restore a snapshot (or the newest in a directory of snapshots) before any update(s)',
+                        type=str)
+    parser.add_argument('-bk', '--backup', metavar='dir', help='snapshot the database periodically while running',
+                        type=str)
+    parser.add_argument('-bki', '--backup-interval', metavar='minutes', dest='backup_interval',
+                        help='minutes between incremental snapshots (default: 1)', type=int, default=1)
+    parser.add_argument('-sf', '--snapshot-format', dest='snapshot_format', help='snapshot format (default: bson)',
+                        choices=sorted(sharkscout.Snapshot.formats.keys()), default='bson')
     args = parser.parse_args()
     # Massage arguments
     args.update_events = list(args.update_events or [])
@@ -61,31 +100,57 @@ if __name__ == '__main__':
     # Logging
     logging.getLogger('backoff').addHandler(logging.StreamHandler())
 
+    if args.backend != 'mongod' and args.mongo_host:
+        print('--mongo needs the mongod backend')
+        print()
+        sys.exit(1)
+    if args.workers > 1 and not hasattr(socket, 'SO_REUSEPORT'):
+        print('--workers needs SO_REUSEPORT, which this OS doesn\'t have')
+        print()
+        sys.exit(1)
+    if args.gateway and not hasattr(os, 'fork'):
+        print('--gateway needs fork, which this OS doesn\'t have')
+        print()
+        sys.exit(1)
+
     # Start MongoDB
+    sharkscout.Mongo.backend = args.backend
+    sharkscout.QueryProfiler.slow_ms = args.slow_query
+    sharkscout.RequestProfiler.enabled = args.profile
     mongo = sharkscout.Mongo(args.mongo_host)
     mongo.index()
     mongo.migrate()
 
-    # mongorestore
+    # Restore
     build_restored = False
-    build_dump = os.path.join(os.path.dirname(__file__), 'mongodump.gz')
-    if os.path.exists(build_dump):
+    build_snapshot = os.path.join(os.path.dirname(__file__), 'snapshot')
+    if os.path.exists(build_snapshot):
         if not args.restore and not mongo.tba_count:
-            args.restore = build_dump
+            args.restore = build_snapshot
             build_restored = True
     if args.restore:
         print('Importing database from "' + args.restore + '" ...')
-        null = open(os.devnull, 'w')
-        subprocess.Popen([
-            sharkscout.Util.which('mongorestore'),
-            '/port', str(sharkscout.Mongo.port),
-            '/gzip',
-            '/archive:"' + args.restore + '"',
-            '/objcheck'
-        ], stdout=null, stderr=subprocess.STDOUT).wait()
-        null.close()
+        snapshot = sharkscout.Snapshot.latest(args.restore)
+        if snapshot is None:
+            print('no snapshot found in "' + args.restore + '"')
+            print()
+            sys.exit(1)
+        for name, count in sorted(snapshot.restore(mongo.shark_scout).items()):
+            print('Left out ' + str(count) + ' ' + name + ' document(s) with the same key as one already stored')
         if build_restored:
-            os.remove(args.restore)
+            shutil.rmtree(args.restore)
+        mongo.migrate()  # snapshots can be from older versions
+        sharkscout.ChangeLog(mongo).renew()  # the snapshot's node ID belongs to the instance it came from
+        print()
+
+    # Synthetic data
+    if args.synthetic:
+        print('Generating ' + str(args.synthetic) + ' synthetic event(s) ...')
+        with tqdm(total=args.synthetic, unit='event', leave=True) as progress:
+            teams = args.synthetic_teams or (40, 60)
+            sharkscout.Synthetic(args.synthetic_seed).generate(mongo, args.synthetic, (min(teams), max(teams)),
+                                                               args.synthetic_matches, args.synthetic_scouters,
+                                                               progress=lambda e: progress.update())
         print()
 
     # Team updates
@@ -95,11 +160,11 @@ if __name__ == '__main__':
         print()
     if args.update_teams_info:
         print('Updating teams ...')
-        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
-            futures = {pool.submit(mongo.team_update, team['key'], args.update_teams_favicon): team for team in
-                       mongo.teams()}
-            for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), unit='team', leave=True):
-                future.result()
+        # (just the keys, read up front: a cursor left open while TBA is slow would time out, or pin SQLite's WAL)
+        team_keys = [t['key'] for t in mongo.teams_iter(['key'])]
+        updated = sharkscout.Util.map_bounded(lambda key: mongo.team_update(key, args.update_teams_favicon), team_keys)
+        for _ in tqdm(updated, total=len(team_keys), unit='team', leave=True):
+            pass
         print()
 
     # Event updates
@@ -112,40 +177,44 @@ if __name__ == '__main__':
         print()
     if args.update_events_info:
         for year in sorted(args.update_events_info):
-            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
-                futures = {pool.submit(mongo.event_update, event['key'], args.update_events_favicon): event for event in
-                           mongo.events(year)}
-                if futures:
-                    print('Updating ' + str(year) + ' events ...')
-                    for future in tqdm(concurrent.futures.as_completed(futures), total=len(futures), unit='event',
-                                       leave=True):
-                        future.result()
-                    print()
-
-    # mongodump
+            event_keys = [e['key'] for e in mongo.events_iter(year, ['key'])]
+            if event_keys:
+                print('Updating ' + str(year) + ' events ...')
+                updated = sharkscout.Util.map_bounded(
+                    lambda key: mongo.event_update(key, args.update_events_favicon), event_keys)
+                for _ in tqdm(updated, total=len(event_keys), unit='event', leave=True):
+                    pass
+                print()
+
+    # Snapshot
     if args.dump:
         print('Dumping database to "' + args.dump + '" ...')
-        null = open(os.devnull, 'w')
-        subprocess.Popen([
-            sharkscout.Util.which('mongodump'),
-            '/port', str(sharkscout.Mongo.port),
-            '/db', 'shark_scout',
-            '/gzip',
-            '/archive:"' + args.dump + '"'
-        ], stdout=null, stderr=subprocess.STDOUT).wait()
-        null.close()
+        sharkscout.Snapshot(args.dump).dump(mongo.shark_scout, format=args.snapshot_format)
         print()
 
     # Exit if updated anything
     if [a for a in dir(args) if a.startswith('update_') and getattr(args, a)]:
         sys.exit(0)
 
-    # Open web server and run indefinitely
-    web_server = sharkscout.WebServer(args.port)
+    # Open web server and run indefinitely (the gateway is forked first, before the web server's threads start)
+    web_server = sharkscout.WebServer(args.port, args.workers, args.gateway)
+    if args.gateway:
+        sharkscout.Gateway(args.gateway, web_server.nudges).start()
     web_server.start()
 
+    # Back up in the background
+    if args.backup:
+        sharkscout.SnapshotBackup(args.backup, args.backup_interval, args.snapshot_format).start()
+
+    # Sync with other instances in the background
+    if args.sync:
+        sharkscout.ChangeLogSync(args.sync, args.sync_interval).start()
+
     # Open the web browser
     if args.browser:
         while not web_server.running:
             time.sleep(0.1)
         webbrowser.open('http://127.0.0.1:' + str(web_server.port))
+
+    # Serve until stopped
+    web_server.join()
@@ -38,7 +38,7 @@ copy README* dist\
 echo .rar\ > exclude
 xcopy www dist\www /S /V /I /Y /EXCLUDE:exclude
 del /F exclude
-copy /Y build-mongodump.gz dist\mongodump.gz
+if exist build-snapshot xcopy build-snapshot dist\snapshot /S /V /I /Y
 cd dist
 
 :: Run the test script (fast check before TBA update)
@@ -61,7 +61,7 @@ for /f "skip=1 tokens=1-6" %%A in ('WMIC Path Win32_LocalTime Get Day^,Hour^,Min
 set YEAR_CURR=%FDATE:~0,4%
 set /A YEAR_PREV=%YEAR_CURR%-1
 set /A YEAR_NEXT=%YEAR_CURR%+1
-SharkScout.exe --update-teams --update-teams-info --update-events "1992-%YEAR_NEXT%" --update-events-info "%YEAR_PREV%-%YEAR_NEXT%" --dump mongodump.gz
+SharkScout.exe --update-teams --update-teams-info --update-events "1992-%YEAR_NEXT%" --update-events-info "%YEAR_PREV%-%YEAR_NEXT%" --dump snapshot
 if %errorlevel% neq 0 (
 	cd ..
 	rmdir /S /Q dist
@@ -88,6 +88,7 @@ for /f %%i in ('git rev-parse HEAD') do set HASH=%%i
 del /F SharkScout-%HASH:~0,7%-x86.zip
 powershell -nologo -noprofile -command "& { Add-Type -A 'System.IO.Compression.FileSystem'; [IO.Compression.ZipFile]::CreateFromDirectory('dist', 'SharkScout-%HASH:~0,7%-x86.zip'); }"
 if %errorlevel% equ 0 (
-	copy /Y dist\mongodump.gz build-mongodump.gz
+	if exist build-snapshot rmdir /S /Q build-snapshot
+	xcopy dist\snapshot build-snapshot /S /V /I /Y
 	rmdir /S /Q dist
 )
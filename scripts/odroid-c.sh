@@ -97,13 +97,7 @@ cd "$(dirname "$0")"
 		sed --in-place 's/\r//g' "${FILE}"
 	done
 	while [ "" == "" ]; do
-		sudo ./SharkScout.py --port 80 --no-browser &> /dev/null
-	done
-) &
-(
-	while [ "" == "" ]; do
-		sleep 5m
-		mongodump --out mongodump-$(date +'%Y%m%d_%H%M%S%z') --db shark_scout --collection scouting --gzip &> /dev/null
+		sudo ./SharkScout.py --port 80 --no-browser --backup backups &> /dev/null
 	done
 ) &
 
@@ -113,6 +107,17 @@ info() {
 	uname -a
 	ps -Afw | grep "python.\+SharkScout\|mongod" | grep -v grep | awk '{printf "%s  ",$2;for(i=8;i<=NF;i++)printf "%s ",$i;printf "\n"}'
 	echo ""
+	curl --silent --max-time 1 "http://127.0.0.1/metrics?format=json" | python3 -c '
+import json, sys
+m = json.load(sys.stdin)
+total = lambda name, key: sum([v[key] for v in m.get(name, [])])
+requests = total("sharkscout_http_request_duration_seconds", "count")
+print("sockets", total("sharkscout_websocket_sockets", "value"),
+      " requests", requests,
+      " mean ms", round(1000 * total("sharkscout_http_request_duration_seconds", "sum") / (requests or 1), 1),
+      " ws messages", total("sharkscout_websocket_messages_total", "value"),
+      " tba", total("sharkscout_tba_requests_total", "value"))
+' 2> /dev/null && echo ""
 	ip addr | grep -A 2 "^\w" | grep -v "\-\-" | awk '{print $2}' | sed 'N;N;s/\n/\t/g' | grep -v "lo\|bnep" | sort
 	echo ""
 	for HCI in $(hciconfig | grep "^\w" | awk '{print $1}' | sed 's/://' | sort); do
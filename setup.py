@@ -9,7 +9,7 @@ except:
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(prog=__file__)
-    parser.add_argument('command', type=str, choices=['install'], help='command')
+    parser.add_argument('command', type=str, choices=['install', 'assets'], help='command')
     args = parser.parse_args()
 
     if args.command == 'install':
@@ -19,6 +19,7 @@ if __name__ == '__main__':
             'cherrypy',
             'genshi',
             'hjson',
+            'numpy',
             'psutil',
             'pymongo',
             'pynumparser',
@@ -26,3 +27,8 @@ if __name__ == '__main__':
             'tqdm',
             'ws4py'
         ])
+
+    if args.command == 'assets':
+        import sharkscout
+
+        sharkscout.Assets().build()
@@ -1,4 +1,22 @@
+from sharkscout.admission import *
+from sharkscout.aggregation import *
+from sharkscout.assets import *
+from sharkscout.changelog import *
+from sharkscout.compact import *
+from sharkscout.gateway import *
+from sharkscout.jobs import *
+from sharkscout.metrics import *
 from sharkscout.mongo import *
+from sharkscout.profiler import *
+from sharkscout.projection import *
+from sharkscout.query import *
+from sharkscout.ratings import *
+from sharkscout.sessions import *
+from sharkscout.snapshot import *
+from sharkscout.sqlite import *
+from sharkscout.synthetic import *
 from sharkscout.thebluealliance import *
+from sharkscout.trends import *
 from sharkscout.util import *
+from sharkscout.watcher import *
 from sharkscout.webserver import *
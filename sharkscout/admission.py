@@ -0,0 +1,98 @@
+import time
+
+import cherrypy
+import threading
+
+import sharkscout
+
+
+# Admission control: every request is put in a class by its path, and the heavy classes (page views, the event page's
+#  sections and the API, peer syncs, exports, TBA updates) may only hold so many of CherryPy's threads at once and
+#  keep so many more waiting for their turn, leaving threads free for scouting and scouting forms however busy the
+#  stands get. Anything past that gets a 503.
+class Admission(object):
+    thread_pool = 24  # CherryPy request threads
+    paths = [('/ws', 'scouting'), ('/scout', 'form'), ('/fragment', 'fragment'), ('/api', 'fragment'),
+             ('/sync', 'sync'), ('/download', 'export'),
+             ('/update', 'update')]  # (path prefix, class), anything else is a page view
+    classes = ['scouting', 'form', 'page', 'fragment', 'sync', 'export', 'update']
+    limits = {  # {class: (running at once, waiting, seconds to wait)}, classes not listed aren't limited
+        'page': (6, 2, 5),
+        'fragment': (6, 12, 5),  # (one event page asks for several at once)
+        'sync': (2, 4, 10),  # (a peer that's turned away tries again at its next interval)
+        'export': (1, 1, 10),
+        'update': (1, 1, 2)
+    }
+    retry_after = 10  # seconds
+
+    # Class-level, shared by every request. Don't rebind these!
+    lock = threading.Lock()
+    slots = {c: threading.BoundedSemaphore(l[0]) for c, l in limits.items()}
+    running = {c: 0 for c in classes}
+    waiting = {c: 0 for c in classes}
+
+    @classmethod
+    def classify(cls, path):
+        for prefix, name in cls.paths:
+            if path == prefix or path.startswith(prefix + '/'):
+                return name
+        return 'page'
+
+    # Running and waiting requests per class, in /metrics
+    @classmethod
+    def gauges(cls):
+        for name in cls.classes:
+            labels = (('class', name),)
+            sharkscout.Metrics.gauge('sharkscout_admission_running', lambda n=name: cls.running[n], labels)
+            if name in cls.limits:
+                sharkscout.Metrics.gauge('sharkscout_admission_waiting', lambda n=name: cls.waiting[n], labels)
+
+    # CherryPy 'on_start_resource' hook
+    @classmethod
+    def request_start(cls):
+        request = cherrypy.serving.request
+        name = cls.classify(request.path_info)
+        limit = cls.limits.get(name)
+        if limit is not None and not cls.slots[name].acquire(False):
+            start = time.perf_counter()
+            with cls.lock:
+                full = cls.waiting[name] >= limit[1]
+                if not full:
+                    cls.waiting[name] += 1
+            if full:
+                cls.reject(name)
+            try:
+                admitted = cls.slots[name].acquire(timeout=limit[2])
+            finally:
+                with cls.lock:
+                    cls.waiting[name] -= 1
+            sharkscout.Metrics.observe('sharkscout_admission_wait_seconds', time.perf_counter() - start,
+                                       (('class', name),))
+            if not admitted:
+                cls.reject(name)
+
+        with cls.lock:
+            cls.running[name] += 1
+        request.admission = name
+        request.hooks.attach('on_end_request', cls.request_end)
+
+    @classmethod
+    def request_end(cls):
+        name = cherrypy.serving.request.admission
+        with cls.lock:
+            cls.running[name] -= 1
+        if name in cls.limits:
+            cls.slots[name].release()
+
+    @classmethod
+    def reject(cls, name):
+        sharkscout.Metrics.inc('sharkscout_admission_rejected_total', (('class', name),))
+        cls.unavailable('The server is busy, try again in a few seconds', cls.retry_after)
+
+    # A 503 with a Retry-After (set once the error page is, HTTPError's own headers cleanup would drop it otherwise)
+    @staticmethod
+    def unavailable(message, retry_after):
+        def header():
+            cherrypy.serving.response.headers['Retry-After'] = str(retry_after)
+        cherrypy.serving.request.hooks.attach('before_finalize', header)
+        raise cherrypy.HTTPError(503, message)
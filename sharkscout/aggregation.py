@@ -0,0 +1,688 @@
+import copy
+import functools
+import pymongo.errors
+from datetime import datetime, timedelta
+
+import sharkscout
+
+
+# In-process MongoDB aggregation pipeline evaluator
+#  (the stages and expressions used by Mongo and stats/*.json, for the embedded storage backend)
+class Aggregation(object):
+    def __init__(self, database):
+        self.database = database
+
+    def run(self, pipeline, documents):
+        for stage in pipeline:
+            if len(stage) != 1:
+                raise pymongo.errors.OperationFailure('A pipeline stage specification object must contain exactly '
+                                                      'one field: ' + str(list(stage)))
+            name, spec = list(stage.items())[0]
+            handler = getattr(self, '_stage_' + name.lstrip('$'), None)
+            if not name.startswith('$') or handler is None:
+                raise pymongo.errors.OperationFailure('Unrecognized pipeline stage name: ' + name)
+            documents = handler(documents, spec)
+        return documents
+
+    # ----- Stages -----
+
+    @staticmethod
+    def _stage_match(documents, spec):
+        return (d for d in documents if sharkscout.Query.match(d, spec))
+
+    @staticmethod
+    def _stage_project(documents, spec):
+        exclusions = [k for k, v in spec.items() if v in [0, False] and k != '_id']
+        if exclusions or all(v in [0, False] for v in spec.values()):
+            for doc in documents:
+                yield sharkscout.Query.project(doc, {k: 0 for k in spec})
+            return
+
+        for doc in documents:
+            projected = {}
+            if spec.get('_id', 1) in [1, True] and '_id' in doc:
+                projected['_id'] = doc['_id']
+            for path, expression in spec.items():
+                if path == '_id' and expression in [0, False, 1, True]:
+                    continue
+                if expression is True or (isinstance(expression, (int, float)) and not isinstance(expression, bool)
+                                          and expression):
+                    value = sharkscout.Query.get(doc, path)
+                else:
+                    value = Aggregation.evaluate(expression, doc)
+                if value is not sharkscout.Query.MISSING:
+                    sharkscout.Query.set(projected, path, value)
+            yield projected
+
+    @staticmethod
+    def _stage_addFields(documents, spec):
+        for doc in documents:
+            added = dict(doc)
+            for path, expression in spec.items():
+                existing = sharkscout.Query.get(doc, path)
+                Aggregation._add_field(added, path, Aggregation._evaluate_fields(expression, doc, existing))
+            yield added
+
+    _stage_set = _stage_addFields
+
+    # Embedded documents in $addFields merge into existing embedded documents
+    @staticmethod
+    def _evaluate_fields(expression, doc, existing):
+        if isinstance(expression, dict) and expression and not list(expression)[0].startswith('$'):
+            merged = dict(existing) if isinstance(existing, dict) else {}
+            for key, value in expression.items():
+                value = Aggregation._evaluate_fields(value, doc, merged.get(key))
+                if value is not sharkscout.Query.MISSING:
+                    merged[key] = value
+            return merged
+        return Aggregation.evaluate(expression, doc)
+
+    # Set a dotted field without modifying documents shared with other pipeline documents
+    @staticmethod
+    def _add_field(doc, path, value):
+        parts = path.split('.', 1)
+        if len(parts) == 1:
+            if value is sharkscout.Query.MISSING:
+                doc.pop(path, None)
+            else:
+                doc[path] = value
+            return
+        child = doc.get(parts[0])
+        if isinstance(child, list):
+            # Dotted paths into arrays set the field on every embedded document
+            children = []
+            for item in child:
+                item = dict(item) if isinstance(item, dict) else {}
+                Aggregation._add_field(item, parts[1], value)
+                children.append(item)
+            doc[parts[0]] = children
+        else:
+            child = dict(child) if isinstance(child, dict) else {}
+            Aggregation._add_field(child, parts[1], value)
+            doc[parts[0]] = child
+
+    @staticmethod
+    def _stage_unset(documents, spec):
+        return Aggregation._stage_project(documents, {k: 0 for k in ([spec] if isinstance(spec, str) else spec)})
+
+    @staticmethod
+    def _stage_unwind(documents, spec):
+        if isinstance(spec, str):
+            spec = {'path': spec}
+        path = spec['path'][1:]
+        preserve = spec.get('preserveNullAndEmptyArrays', False)
+        index_field = spec.get('includeArrayIndex')
+        for doc in documents:
+            value = sharkscout.Query.get(doc, path)
+            if isinstance(value, list) and value:
+                for idx, item in enumerate(value):
+                    unwound = dict(doc)
+                    Aggregation._add_field(unwound, path, item)
+                    if index_field:
+                        unwound[index_field] = idx
+                    yield unwound
+            elif isinstance(value, list) or value is None or value is sharkscout.Query.MISSING:
+                if preserve:
+                    unwound = dict(doc)
+                    if isinstance(value, list):
+                        Aggregation._add_field(unwound, path, sharkscout.Query.MISSING)
+                    if index_field:
+                        unwound[index_field] = None
+                    yield unwound
+            else:
+                unwound = dict(doc)
+                if index_field:
+                    unwound[index_field] = None
+                yield unwound
+
+    @staticmethod
+    def _stage_replaceRoot(documents, spec):
+        for doc in documents:
+            root = Aggregation.evaluate(spec['newRoot'], doc)
+            if not isinstance(root, dict):
+                raise pymongo.errors.OperationFailure('\'newRoot\' expression must evaluate to an object, but '
+                                                      'resulting value was: ' + repr(root))
+            yield root
+
+    @staticmethod
+    def _stage_replaceWith(documents, spec):
+        return Aggregation._stage_replaceRoot(documents, {'newRoot': spec})
+
+    @staticmethod
+    def _stage_group(documents, spec):
+        groups = {}
+        order = []
+        for doc in documents:
+            _id = Aggregation.evaluate(spec['_id'], doc)
+            _id = None if _id is sharkscout.Query.MISSING else _id
+            key = repr(Aggregation._hashable(_id))
+            if key not in groups:
+                groups[key] = {'_id': _id}
+                order.append(key)
+            group = groups[key]
+            for field, accumulator in spec.items():
+                if field == '_id':
+                    continue
+                (operator, expression), = accumulator.items()
+                Aggregation._accumulate(group, field, operator, Aggregation.evaluate(expression, doc))
+
+        for key in order:
+            group = groups[key]
+            for field, accumulator in spec.items():
+                if field == '_id':
+                    continue
+                operator = list(accumulator)[0]
+                if operator == '$avg':
+                    total, count = group[field]
+                    group[field] = total / count if count else None
+                elif operator in ['$first', '$last', '$min', '$max'] and group[field] is sharkscout.Query.MISSING:
+                    group[field] = None
+            yield group
+
+    @staticmethod
+    def _accumulate(group, field, operator, value):
+        missing = sharkscout.Query.MISSING
+        numeric = isinstance(value, (int, float)) and not isinstance(value, bool)
+        if field not in group:
+            group[field] = {
+                '$sum': 0,
+                '$avg': (0, 0),
+                '$push': [],
+                '$addToSet': [],
+                '$first': value,
+                '$last': value,
+                '$min': missing,
+                '$max': missing
+            }.get(operator, missing)
+            if operator in ['$first', '$last']:
+                return
+        if operator == '$sum':
+            if numeric:
+                group[field] += value
+            elif isinstance(value, list):
+                group[field] += sum([v for v in value if isinstance(v, (int, float)) and not isinstance(v, bool)])
+        elif operator == '$avg':
+            if numeric:
+                group[field] = (group[field][0] + value, group[field][1] + 1)
+        elif operator == '$push':
+            if value is not missing:
+                group[field].append(value)
+        elif operator == '$addToSet':
+            if value is not missing and not [v for v in group[field] if sharkscout.Query.equal(v, value)]:
+                group[field].append(value)
+        elif operator == '$last':
+            group[field] = value
+        elif operator in ['$min', '$max']:
+            if value is not missing and value is not None:
+                current = group[field]
+                if current is missing or (sharkscout.Query.compare(value, current) < 0) == (operator == '$min'):
+                    group[field] = value
+        elif operator != '$first':
+            raise pymongo.errors.OperationFailure('unknown group operator \'' + operator + '\'')
+
+    @staticmethod
+    def _hashable(value):
+        if isinstance(value, dict):
+            return tuple((k, Aggregation._hashable(v)) for k, v in value.items())
+        if isinstance(value, list):
+            return ('__list__',) + tuple(Aggregation._hashable(v) for v in value)
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return sharkscout.Query.bracket(value), value
+
+    @staticmethod
+    def _stage_sort(documents, spec):
+        return iter(sorted(documents, key=sharkscout.Query.sort_key(list(spec.items()))))
+
+    @staticmethod
+    def _stage_limit(documents, spec):
+        for idx, doc in enumerate(documents):
+            if idx >= spec:
+                break
+            yield doc
+
+    @staticmethod
+    def _stage_skip(documents, spec):
+        for idx, doc in enumerate(documents):
+            if idx >= spec:
+                yield doc
+
+    @staticmethod
+    def _stage_count(documents, spec):
+        count = sum(1 for _ in documents)
+        return iter([{spec: count}] if count else [])
+
+    def _stage_lookup(self, documents, spec):
+        foreign = self.database[spec['from']]
+        for doc in documents:
+            local = sharkscout.Query.get(doc, spec['localField'])
+            local = local if isinstance(local, list) else [None if local is sharkscout.Query.MISSING else local]
+            joined = dict(doc)
+            sharkscout.Query.set(joined, spec['as'], list(foreign.find({spec['foreignField']: {'$in': local}})))
+            yield joined
+
+    # ----- Expressions -----
+
+    # Aggregation truthiness: only false, null, missing, and 0 are false
+    @staticmethod
+    def truthy(value):
+        if value is None or value is sharkscout.Query.MISSING or value is False:
+            return False
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            return value != 0
+        return True
+
+    @staticmethod
+    def evaluate(expression, doc, variables=None):
+        if variables is None:
+            variables = {'ROOT': doc, 'CURRENT': doc}
+
+        if isinstance(expression, str) and expression.startswith('$$'):
+            name, _, path = expression[2:].partition('.')
+            if name not in variables:
+                raise pymongo.errors.OperationFailure('Use of undefined variable: ' + name)
+            return Aggregation._path(variables[name], path) if path else variables[name]
+        if isinstance(expression, str) and expression.startswith('$'):
+            return Aggregation._path(variables['CURRENT'], expression[1:])
+        if isinstance(expression, list):
+            return [Aggregation._null(Aggregation.evaluate(e, doc, variables)) for e in expression]
+        if isinstance(expression, dict):
+            if len(expression) == 1 and list(expression)[0].startswith('$'):
+                (operator, args), = expression.items()
+                handler = Aggregation._operators.get(operator)
+                if handler is None:
+                    raise pymongo.errors.OperationFailure('Unrecognized expression \'' + operator + '\'')
+                return handler(args, doc, variables)
+            evaluated = {}
+            for key, value in expression.items():
+                value = Aggregation.evaluate(value, doc, variables)
+                if value is not sharkscout.Query.MISSING:
+                    evaluated[key] = value
+            return evaluated
+        return expression
+
+    # Field paths traverse arrays of embedded documents
+    @staticmethod
+    def _path(value, path):
+        for idx, part in enumerate(path.split('.')):
+            if isinstance(value, list):
+                rest = '.'.join(path.split('.')[idx:])
+                values = [Aggregation._path(v, rest) for v in value if isinstance(v, (dict, list))]
+                return [v for v in values if v is not sharkscout.Query.MISSING]
+            if not isinstance(value, dict) or part not in value:
+                return sharkscout.Query.MISSING
+            value = value[part]
+        return value
+
+    @staticmethod
+    def _null(value):
+        return None if value is sharkscout.Query.MISSING else value
+
+    @staticmethod
+    def _nullish(value):
+        return value is None or value is sharkscout.Query.MISSING
+
+    @staticmethod
+    def _args(args, doc, variables, count=None):
+        if not isinstance(args, list):
+            args = [args]
+        if count is not None and len(args) != count:
+            raise pymongo.errors.OperationFailure('Expression takes exactly ' + str(count) + ' arguments. ' +
+                                                  str(len(args)) + ' were passed in.')
+        return [Aggregation.evaluate(a, doc, variables) for a in args]
+
+    @staticmethod
+    def _number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    @staticmethod
+    def _string(value):
+        if Aggregation._nullish(value):
+            return ''
+        if isinstance(value, str):
+            return value
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (value.microsecond // 1000)
+        if isinstance(value, (int, float)):
+            return str(value)
+        raise pymongo.errors.OperationFailure('can\'t convert from BSON type ' + type(value).__name__ + ' to String')
+
+    @staticmethod
+    def _array(value, operator):
+        if not isinstance(value, list):
+            raise pymongo.errors.OperationFailure(operator + ' requires an array, found: ' + type(value).__name__)
+        return value
+
+    # Operators
+
+    @staticmethod
+    def _op_literal(args, doc, variables):
+        return copy.deepcopy(args)
+
+    @staticmethod
+    def _op_cond(args, doc, variables):
+        if isinstance(args, dict):
+            args = [args['if'], args['then'], args['else']]
+        condition = Aggregation.evaluate(args[0], doc, variables)
+        return Aggregation.evaluate(args[1] if Aggregation.truthy(condition) else args[2], doc, variables)
+
+    @staticmethod
+    def _op_ifNull(args, doc, variables):
+        for arg in args[:-1]:
+            value = Aggregation.evaluate(arg, doc, variables)
+            if not Aggregation._nullish(value):
+                return value
+        return Aggregation.evaluate(args[-1], doc, variables)
+
+    @staticmethod
+    def _comparison(test):
+        def operator(args, doc, variables):
+            a, b = Aggregation._args(args, doc, variables, 2)
+            return test(sharkscout.Query.compare(a, b))
+
+        return operator
+
+    @staticmethod
+    def _op_and(args, doc, variables):
+        return all(Aggregation.truthy(Aggregation.evaluate(a, doc, variables)) for a in args)
+
+    @staticmethod
+    def _op_or(args, doc, variables):
+        return any(Aggregation.truthy(Aggregation.evaluate(a, doc, variables)) for a in args)
+
+    @staticmethod
+    def _op_not(args, doc, variables):
+        return not Aggregation.truthy(Aggregation._args(args, doc, variables, 1)[0])
+
+    @staticmethod
+    def _op_in(args, doc, variables):
+        value, array = Aggregation._args(args, doc, variables, 2)
+        return any(sharkscout.Query.equal(value, v) for v in Aggregation._array(array, '$in'))
+
+    @staticmethod
+    def _op_concat(args, doc, variables):
+        values = Aggregation._args(args, doc, variables)
+        if any(Aggregation._nullish(v) for v in values):
+            return None
+        for value in values:
+            if not isinstance(value, str):
+                raise pymongo.errors.OperationFailure('$concat only supports strings, not ' + type(value).__name__)
+        return ''.join(values)
+
+    @staticmethod
+    def _op_substr(args, doc, variables):
+        value, start, length = Aggregation._args(args, doc, variables, 3)
+        value = Aggregation._string(value)
+        start = int(start)
+        return value[start:] if length < 0 else value[start:start + int(length)]
+
+    @staticmethod
+    def _op_toUpper(args, doc, variables):
+        return Aggregation._string(Aggregation._args(args, doc, variables, 1)[0]).upper()
+
+    @staticmethod
+    def _op_toLower(args, doc, variables):
+        return Aggregation._string(Aggregation._args(args, doc, variables, 1)[0]).lower()
+
+    @staticmethod
+    def _op_toString(args, doc, variables):
+        value = Aggregation._args(args, doc, variables, 1)[0]
+        return None if Aggregation._nullish(value) else Aggregation._string(value)
+
+    @staticmethod
+    def _op_strLenCP(args, doc, variables):
+        value = Aggregation._args(args, doc, variables, 1)[0]
+        if not isinstance(value, str):
+            raise pymongo.errors.OperationFailure('$strLenCP requires a string argument')
+        return len(value)
+
+    @staticmethod
+    def _op_add(args, doc, variables):
+        values = Aggregation._args(args, doc, variables)
+        if any(Aggregation._nullish(v) for v in values):
+            return None
+        dates = [v for v in values if isinstance(v, datetime)]
+        numbers = [v for v in values if not isinstance(v, datetime)]
+        for value in numbers:
+            if not Aggregation._number(value):
+                raise pymongo.errors.OperationFailure('$add only supports numeric or date types, not ' +
+                                                      type(value).__name__)
+        if len(dates) > 1:
+            raise pymongo.errors.OperationFailure('only one date allowed in an $add expression')
+        if dates:
+            return dates[0] + timedelta(milliseconds=sum(numbers))
+        return sum(numbers)
+
+    @staticmethod
+    def _arithmetic(calculate, name):
+        def operator(args, doc, variables):
+            a, b = Aggregation._args(args, doc, variables, 2)
+            if Aggregation._nullish(a) or Aggregation._nullish(b):
+                return None
+            if isinstance(a, datetime) and name == '$subtract':
+                if isinstance(b, datetime):
+                    return int((a - b).total_seconds() * 1000)
+                return a - timedelta(milliseconds=b)
+            if not Aggregation._number(a) or not Aggregation._number(b):
+                raise pymongo.errors.OperationFailure(name + ' only supports numeric types')
+            if name in ['$divide', '$mod'] and b == 0:
+                raise pymongo.errors.OperationFailure('can\'t ' + name[1:] + ' by zero')
+            return calculate(a, b)
+
+        return operator
+
+    @staticmethod
+    def _op_multiply(args, doc, variables):
+        values = Aggregation._args(args, doc, variables)
+        if any(Aggregation._nullish(v) for v in values):
+            return None
+        return functools.reduce(lambda a, b: a * b, values, 1)
+
+    @staticmethod
+    def _op_abs(args, doc, variables):
+        value = Aggregation._args(args, doc, variables, 1)[0]
+        return None if Aggregation._nullish(value) else abs(value)
+
+    # $sum/$avg/$min/$max as expressions, over one array or several arguments
+    @staticmethod
+    def _summary(summarize):
+        def operator(args, doc, variables):
+            values = Aggregation._args(args, doc, variables)
+            if len(values) == 1 and isinstance(values[0], list):
+                values = values[0]
+            return summarize(values)
+
+        return operator
+
+    @staticmethod
+    def _summarize_sum(values):
+        return sum([v for v in values if Aggregation._number(v)])
+
+    @staticmethod
+    def _summarize_avg(values):
+        numbers = [v for v in values if Aggregation._number(v)]
+        return sum(numbers) / len(numbers) if numbers else None
+
+    @staticmethod
+    def _summarize_min(values):
+        values = [v for v in values if not Aggregation._nullish(v)]
+        return min(values, key=functools.cmp_to_key(sharkscout.Query.compare)) if values else None
+
+    @staticmethod
+    def _summarize_max(values):
+        values = [v for v in values if not Aggregation._nullish(v)]
+        return max(values, key=functools.cmp_to_key(sharkscout.Query.compare)) if values else None
+
+    @staticmethod
+    def _op_size(args, doc, variables):
+        return len(Aggregation._array(Aggregation._args(args, doc, variables, 1)[0], '$size'))
+
+    @staticmethod
+    def _op_arrayElemAt(args, doc, variables):
+        array, idx = Aggregation._args(args, doc, variables, 2)
+        if Aggregation._nullish(array) or Aggregation._nullish(idx):
+            return None
+        array = Aggregation._array(array, '$arrayElemAt')
+        idx = int(idx)
+        if -len(array) <= idx < len(array):
+            return array[idx]
+        return sharkscout.Query.MISSING
+
+    @staticmethod
+    def _op_concatArrays(args, doc, variables):
+        values = Aggregation._args(args, doc, variables)
+        if any(Aggregation._nullish(v) for v in values):
+            return None
+        return [item for value in values for item in Aggregation._array(value, '$concatArrays')]
+
+    @staticmethod
+    def _op_slice(args, doc, variables):
+        values = Aggregation._args(args, doc, variables)
+        if Aggregation._nullish(values[0]):
+            return None
+        array = Aggregation._array(values[0], '$slice')
+        if len(values) == 2:
+            n = int(values[1])
+            return array[:n] if n >= 0 else array[n:]
+        position, n = int(values[1]), int(values[2])
+        if position < 0:
+            position = max(len(array) + position, 0)
+        return array[position:position + n]
+
+    @staticmethod
+    def _op_filter(args, doc, variables):
+        array = Aggregation.evaluate(args['input'], doc, variables)
+        if Aggregation._nullish(array):
+            return None
+        name = args.get('as', 'this')
+        return [item for item in Aggregation._array(array, '$filter') if Aggregation.truthy(
+            Aggregation.evaluate(args['cond'], doc, dict(variables, **{name: item})))]
+
+    @staticmethod
+    def _op_map(args, doc, variables):
+        array = Aggregation.evaluate(args['input'], doc, variables)
+        if Aggregation._nullish(array):
+            return None
+        name = args.get('as', 'this')
+        return [Aggregation._null(Aggregation.evaluate(args['in'], doc, dict(variables, **{name: item})))
+                for item in Aggregation._array(array, '$map')]
+
+    @staticmethod
+    def _op_reduce(args, doc, variables):
+        array = Aggregation.evaluate(args['input'], doc, variables)
+        if Aggregation._nullish(array):
+            return None
+        value = Aggregation.evaluate(args['initialValue'], doc, variables)
+        for item in Aggregation._array(array, '$reduce'):
+            value = Aggregation.evaluate(args['in'], doc, dict(variables, value=value, this=item))
+        return value
+
+    @staticmethod
+    def _op_let(args, doc, variables):
+        scoped = dict(variables)
+        for name, expression in args['vars'].items():
+            scoped[name] = Aggregation.evaluate(expression, doc, variables)
+        return Aggregation.evaluate(args['in'], doc, scoped)
+
+    @staticmethod
+    def _unique(values):
+        unique = []
+        for value in values:
+            if not [u for u in unique if sharkscout.Query.equal(u, value)]:
+                unique.append(value)
+        return unique
+
+    @staticmethod
+    def _op_setUnion(args, doc, variables):
+        values = Aggregation._args(args, doc, variables)
+        if any(Aggregation._nullish(v) for v in values):
+            return None
+        return Aggregation._unique([i for v in values for i in Aggregation._array(v, '$setUnion')])
+
+    @staticmethod
+    def _op_setIntersection(args, doc, variables):
+        values = Aggregation._args(args, doc, variables)
+        if any(Aggregation._nullish(v) for v in values):
+            return None
+        common = Aggregation._unique(Aggregation._array(values[0], '$setIntersection'))
+        for value in values[1:]:
+            common = [c for c in common if [i for i in Aggregation._array(value, '$setIntersection')
+                                            if sharkscout.Query.equal(c, i)]]
+        return common
+
+    @staticmethod
+    def _op_setDifference(args, doc, variables):
+        a, b = Aggregation._args(args, doc, variables, 2)
+        if Aggregation._nullish(a) or Aggregation._nullish(b):
+            return None
+        b = Aggregation._array(b, '$setDifference')
+        return Aggregation._unique([i for i in Aggregation._array(a, '$setDifference')
+                                    if not [j for j in b if sharkscout.Query.equal(i, j)]])
+
+    @staticmethod
+    def _op_objectToArray(args, doc, variables):
+        value = Aggregation._args(args, doc, variables, 1)[0]
+        if Aggregation._nullish(value):
+            return None
+        if not isinstance(value, dict):
+            raise pymongo.errors.OperationFailure('$objectToArray requires a document input')
+        return [{'k': k, 'v': v} for k, v in value.items()]
+
+    @staticmethod
+    def _op_arrayToObject(args, doc, variables):
+        value = Aggregation._args(args, doc, variables, 1)[0]
+        if Aggregation._nullish(value):
+            return None
+        return {(i['k'] if isinstance(i, dict) else i[0]): (i['v'] if isinstance(i, dict) else i[1])
+                for i in Aggregation._array(value, '$arrayToObject')}
+
+
+Aggregation._operators = {
+    '$literal': Aggregation._op_literal,
+    '$cond': Aggregation._op_cond,
+    '$ifNull': Aggregation._op_ifNull,
+    '$eq': Aggregation._comparison(lambda c: c == 0),
+    '$ne': Aggregation._comparison(lambda c: c != 0),
+    '$gt': Aggregation._comparison(lambda c: c > 0),
+    '$gte': Aggregation._comparison(lambda c: c >= 0),
+    '$lt': Aggregation._comparison(lambda c: c < 0),
+    '$lte': Aggregation._comparison(lambda c: c <= 0),
+    '$cmp': Aggregation._comparison(lambda c: c),
+    '$and': Aggregation._op_and,
+    '$or': Aggregation._op_or,
+    '$not': Aggregation._op_not,
+    '$in': Aggregation._op_in,
+    '$concat': Aggregation._op_concat,
+    '$substr': Aggregation._op_substr,
+    '$substrBytes': Aggregation._op_substr,
+    '$substrCP': Aggregation._op_substr,
+    '$toUpper': Aggregation._op_toUpper,
+    '$toLower': Aggregation._op_toLower,
+    '$toString': Aggregation._op_toString,
+    '$strLenCP': Aggregation._op_strLenCP,
+    '$add': Aggregation._op_add,
+    '$subtract': Aggregation._arithmetic(lambda a, b: a - b, '$subtract'),
+    '$multiply': Aggregation._op_multiply,
+    '$divide': Aggregation._arithmetic(lambda a, b: a / b, '$divide'),
+    '$mod': Aggregation._arithmetic(lambda a, b: a % b, '$mod'),
+    '$abs': Aggregation._op_abs,
+    '$sum': Aggregation._summary(Aggregation._summarize_sum),
+    '$avg': Aggregation._summary(Aggregation._summarize_avg),
+    '$min': Aggregation._summary(Aggregation._summarize_min),
+    '$max': Aggregation._summary(Aggregation._summarize_max),
+    '$size': Aggregation._op_size,
+    '$arrayElemAt': Aggregation._op_arrayElemAt,
+    '$concatArrays': Aggregation._op_concatArrays,
+    '$slice': Aggregation._op_slice,
+    '$filter': Aggregation._op_filter,
+    '$map': Aggregation._op_map,
+    '$reduce': Aggregation._op_reduce,
+    '$let': Aggregation._op_let,
+    '$setUnion': Aggregation._op_setUnion,
+    '$setIntersection': Aggregation._op_setIntersection,
+    '$setDifference': Aggregation._op_setDifference,
+    '$objectToArray': Aggregation._op_objectToArray,
+    '$arrayToObject': Aggregation._op_arrayToObject
+}
@@ -0,0 +1,159 @@
+import sys
+
+import gzip
+import hashlib
+import json
+import os
+import re
+
+
+class Assets(object):
+    manifest = None
+
+    # Extensions worth keeping a precompressed .gz sibling for
+    compressible = ['.css', '.eot', '.js', '.json', '.svg', '.ttf']
+
+    def __init__(self, www=None):
+        self.www = www or os.path.normpath(os.path.join(os.path.dirname(sys.argv[0]), 'www'))
+        self.static = os.path.join(self.www, 'static')
+        self.manifest_path = os.path.join(self.www, 'assets.json')
+
+    # Load the URL manifest, building it if it doesn't exist yet
+    def load(self):
+        if self.__class__.manifest is None:
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path, 'r') as f:
+                    self.__class__.manifest = json.load(f)
+            else:
+                self.build()
+        return self.__class__.manifest
+
+    # Rewrite a template <link href=""> or <script src=""> URL
+    #  (returns None if the URL is bundled into an earlier URL)
+    def url(self, url):
+        manifest = self.load()
+        path = url.split('?')[0]
+        if path in manifest:
+            return manifest[path]
+        return url
+
+    # Bundle, minify, hash, and precompress everything referenced by the templates
+    def build(self):
+        manifest = {}
+
+        # Group local <link>/<script> files by extension and directory, in first-seen order
+        bundles = {}
+        for url in self._template_urls():
+            path = self._path(url)
+            if path is None:
+                continue
+            extension = os.path.splitext(path)[1]
+            if extension in ['.css', '.js']:
+                group = (extension, os.path.dirname(path))
+                if group not in bundles:
+                    bundles[group] = []
+                if url not in bundles[group]:
+                    bundles[group].append(url)
+            else:
+                manifest[url] = url + '?' + self._hash(self._read(path))
+
+        # Write the bundles
+        for (extension, directory), urls in sorted(bundles.items()):
+            contents = b''
+            for url in urls:
+                contents += self._minify(self._path(url), self._read(self._path(url))).strip() + b'\n'
+            packed = 'packed.' + self._hash(contents) + extension
+            self._clean(directory, packed)
+            packed_path = os.path.join(directory, packed)
+            if not os.path.exists(packed_path):
+                print('Packing "' + packed_path + '"')
+                with open(packed_path, 'wb') as f:
+                    f.write(contents)
+            packed_url = os.path.dirname(urls[0]).rstrip('/') + '/' + packed
+            manifest[urls[0]] = packed_url
+            for url in urls[1:]:
+                manifest[url] = None
+
+        # Write .gz siblings for everything compressible
+        for root, dirs, files in os.walk(self.static):
+            for file in files:
+                if os.path.splitext(file)[1] in self.compressible:
+                    self._gzip(os.path.join(root, file))
+
+        with open(self.manifest_path, 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        self.__class__.manifest = manifest
+        return manifest
+
+    # Whether a static URL is content-addressed and therefore never changes
+    @staticmethod
+    def immutable(path, query_string=''):
+        return bool(re.search(r'/packed\.[0-9a-f]{8}\.[a-z]+$', path) or re.match(r'^[0-9a-f]{8}$', query_string))
+
+    def _template_urls(self):
+        urls = []
+        templates = []
+        for root, dirs, files in os.walk(self.www):
+            if os.path.normpath(root).startswith(os.path.normpath(self.static)):
+                continue
+            templates += [os.path.join(root, f) for f in files if f.endswith('.html')]
+        # www.html first so that its ordering wins
+        for template in sorted(templates, key=lambda t: (os.path.basename(t) != 'www.html', t)):
+            with open(template, 'r', encoding='utf-8') as f:
+                for tag in re.findall(r'<(?:link|script)\b[^>]*>', f.read()):
+                    for attr in re.findall(r'\b(?:href|src)="([^"]+)"', tag):
+                        if '$' not in attr and attr not in urls:
+                            urls.append(attr)
+        return urls
+
+    def _path(self, url):
+        if '//' in url:
+            return None
+        path = os.path.normpath(os.path.join(self.www, url.split('?')[0].lstrip('/')))
+        if not path.startswith(self.static) or not os.path.isfile(path):
+            return None
+        return path
+
+    @staticmethod
+    def _read(path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    @staticmethod
+    def _hash(contents):
+        return hashlib.sha1(contents).hexdigest()[:8]
+
+    @staticmethod
+    def _minify(path, contents):
+        # Already minified by upstream
+        if re.search(r'[.-]min\.[a-z]+$', path):
+            return contents
+        if path.endswith('.css'):
+            contents = re.sub(rb'/\*.*?\*/', b'', contents, flags=re.DOTALL)
+            contents = re.sub(rb'\s+', b' ', contents)
+            contents = re.sub(rb'\s*([{};,>])\s*', rb'\1', contents)
+            return contents.replace(b';}', b'}')
+        # JavaScript is only concatenated: without a real parser, stripping comments or whitespace can break strings,
+        #  regex literals and automatic semicolon insertion, and gzip gets most of the size back anyway
+        return contents
+
+    # Remove stale bundles of the same type from previous builds (a directory can have both a .css and a .js bundle)
+    @staticmethod
+    def _clean(directory, keep):
+        extension = os.path.splitext(keep)[1]
+        for file in os.listdir(directory):
+            match = re.match(r'^packed\.(?:[0-9a-f]{8}\.)?([a-z]+)(?:\.gz)?$', file)
+            if match and '.' + match.group(1) == extension and file not in [keep, keep + '.gz']:
+                os.remove(os.path.join(directory, file))
+
+    @staticmethod
+    def _gzip(path):
+        gz_path = path + '.gz'
+        if os.path.exists(gz_path) and os.path.getmtime(gz_path) >= os.path.getmtime(path):
+            return
+        with open(path, 'rb') as f:
+            contents = f.read()
+        with open(gz_path, 'wb') as f:
+            # mtime=0 keeps the output byte-identical between builds
+            with gzip.GzipFile(filename='', mode='wb', fileobj=f, compresslevel=9, mtime=0) as gz:
+                gz.write(contents)
@@ -0,0 +1,271 @@
+import time
+
+import gzip
+import pymongo
+import pymongo.errors
+import requests
+import threading
+import uuid
+from datetime import datetime
+
+import sharkscout
+
+
+# Append-only log of scouting writes, so SharkScout instances can sync by exchanging only the entries the other
+#  is missing. Every entry is identified by the node that wrote it and that node's sequence number, and holds only
+#  the fields that write changed; scouting documents are rebuilt from their entries, newest timestamp per field wins.
+class ChangeLog(object):
+    lock = threading.Lock()  # serializes appends and rebuilds, so a rebuild never overwrites a newer one
+    keys = {
+        'match': ['event_key', 'match_key', 'team_key'],
+        'pit': ['event_key', 'team_key']
+    }
+    ignored = ['_id', 'modified_timestamp', 'changed_timestamp']  # never part of entries
+    limit = 1000  # entries per sync request
+
+    def __init__(self, mongo):
+        self.mongo = mongo
+        self.log = mongo.shark_scout.scouting_changes
+        self.state = mongo.shark_scout.sync_state  # {_id: 'node', node: node ID, seq: a recent sequence number}
+
+    def index(self):
+        self.log.create_index([
+            ('node', pymongo.ASCENDING),
+            ('seq', pymongo.ASCENDING)
+        ], unique=True)
+        self.log.create_index([
+            ('kind', pymongo.ASCENDING),
+            ('event_key', pymongo.ASCENDING),
+            ('team_key', pymongo.ASCENDING)
+        ])
+
+    # This instance's node ID
+    @property
+    def node(self):
+        state = self.state.find_one({'_id': 'node'})
+        if state is None:
+            self.state.update_one({'_id': 'node'}, {'$setOnInsert': {
+                'node': uuid.uuid4().hex,
+                'seq': 0
+            }}, upsert=True)
+            state = self.state.find_one({'_id': 'node'})
+        return state['node']
+
+    # New node ID, needed whenever the database was copied from another instance (restores)
+    def renew(self):
+        self.state.replace_one({'_id': 'node'}, {'node': uuid.uuid4().hex, 'seq': 0}, upsert=True)
+
+    # Highest sequence number known from every node
+    def vector(self):
+        return {v['_id']: v['seq'] for v in self.log.aggregate([{'$group': {
+            '_id': '$node',
+            'seq': {'$max': '$seq'}
+        }}])}
+
+    def _key(self, kind, data):
+        return {k: data[k] for k in self.keys[kind]}
+
+    def _entries(self, kind, key):
+        return list(self.log.find(dict(key, kind=kind)).sort([
+            ('timestamp', pymongo.ASCENDING),
+            ('node', pymongo.ASCENDING),
+            ('seq', pymongo.ASCENDING)
+        ]))
+
+    # The scouting document currently stored, outside of the change log
+    def _stored(self, kind, key):
+        if kind == 'match':
+            return self.mongo.match_scouting.find_one(key, {'_id': 0, 'modified_timestamp': 0, 'changed_timestamp': 0})
+        scouting = self.mongo.scouting.find_one(key, {'pit': 1})
+        return scouting.get('pit') if scouting else None
+
+    # The insert itself claims the sequence number (the unique node + seq index turns away one another process took
+    #  first), so there's never a gap a peer could sync past while the entry before it is still being written
+    #  (ChangeLog.lock is per process, --workers and --gateway write from several)
+    def _append(self, kind, key, changes, removed, timestamp=None):
+        node = self.node
+        seq = self.state.find_one({'_id': 'node'}).get('seq', 0)
+        while True:
+            seq += 1
+            try:
+                self.log.insert_one(dict(key, **{
+                    'kind': kind,
+                    'node': node,
+                    'seq': seq,
+                    'timestamp': timestamp or datetime.utcnow(),
+                    'set': changes,
+                    'unset': removed
+                }))
+                break
+            except pymongo.errors.DuplicateKeyError:
+                continue
+        self.state.update_one({'_id': 'node'}, {'$max': {'seq': seq}})
+
+    # Replay a document's entries in (timestamp, node, seq) order and store the result
+    #  (modified_timestamp is when it was stored here, which snapshots and the Watcher go by: a peer's entry can be older
+    #  than either's last look. changed_timestamp is the newest entry's, the one last-writer-wins goes by)
+    def _rebuild(self, kind, key):
+        entries = self._entries(kind, key)
+        document = {}
+        for entry in entries:
+            document.update(entry['set'])
+            for field in entry['unset']:
+                document.pop(field, None)
+
+        timestamps = {
+            'modified_timestamp': datetime.utcnow(),
+            'changed_timestamp': max([e['timestamp'] for e in entries])
+        }
+        if kind == 'match':
+            result = self.mongo.match_scouting.replace_one(key, dict(document, **timestamps), upsert=True)
+        else:
+            result = self.mongo.scouting.update_one(key, {'$set': dict(timestamps, pit=document)}, upsert=True)
+        return result.upserted_id or result.matched_count or result.modified_count
+
+    # Log a local write, then store the resulting document
+    def record(self, kind, data):
+        key = self._key(kind, data)
+        with self.lock:
+            entries = self._entries(kind, key)
+            current = {}
+            for entry in entries:
+                current.update(entry['set'])
+                for field in entry['unset']:
+                    current.pop(field, None)
+            # Data from before the change log existed becomes its first entry
+            stored = self._stored(kind, key)
+            if not entries and stored:
+                self._append(kind, key, stored, [], datetime.utcfromtimestamp(0))
+                current = stored
+
+            changes = {k: v for k, v in data.items() if k not in self.ignored and (k not in current or current[k] != v)}
+            removed = [k for k in current if k not in data and k not in self.ignored]
+            if changes or removed or not current:
+                self._append(kind, key, changes, removed)
+            return self._rebuild(kind, key)
+
+    # Give every scouting document without entries a first entry, so peers can receive it
+    def migrate(self):
+        logged = set()
+        for entry in self.log.find({}, {'kind': 1, 'event_key': 1, 'match_key': 1, 'team_key': 1}):
+            logged.add(tuple([entry['kind']] + [entry.get(k) for k in self.keys[entry['kind']]]))
+
+        with self.lock:
+            for match in self.mongo.match_scouting.find({}, {'_id': 0}):
+                key = self._key('match', match)
+                if ('match',) + tuple(key.values()) not in logged:
+                    timestamp = match.pop('changed_timestamp', None) or match.pop('modified_timestamp', None) or \
+                        datetime.utcfromtimestamp(0)
+                    match.pop('modified_timestamp', None)
+                    self._append('match', key, match, [], timestamp)
+            for scouting in self.mongo.scouting.find({'pit': {'$exists': True}}, {'_id': 0}):
+                key = self._key('pit', scouting)
+                if ('pit',) + tuple(key.values()) not in logged:
+                    self._append('pit', key, scouting['pit'], [], datetime.utcfromtimestamp(0))
+
+    # Entries newer than a vector of {node: seq}, in (node, seq) order so a partial response never leaves gaps
+    def changes(self, since=None, limit=None):
+        since = since or {}
+        return list(self.log.find({'$or': [{
+            'node': node,
+            'seq': {'$gt': seq}
+        } for node, seq in since.items()] + [{
+            'node': {'$nin': list(since.keys())}
+        }]}, {'_id': 0}).sort([
+            ('node', pymongo.ASCENDING),
+            ('seq', pymongo.ASCENDING)
+        ]).limit(limit or self.limit))
+
+    # Entries from a peer (as JSON), returning how many were new
+    def apply(self, entries):
+        entries = [self._parse(e) for e in entries]
+        if not entries:
+            return 0
+        with self.lock:
+            result = self.log.bulk_write([pymongo.UpdateOne({
+                'node': e['node'],
+                'seq': e['seq']
+            }, {
+                '$setOnInsert': e
+            }, upsert=True) for e in entries], ordered=False)
+            rebuild = []
+            for idx in sorted(result.upserted_ids):
+                kind = entries[idx]['kind']
+                key = self._key(kind, entries[idx])
+                if (kind, key) not in rebuild:
+                    rebuild.append((kind, key))
+            for kind, key in rebuild:
+                self._rebuild(kind, key)
+        return len(result.upserted_ids)
+
+    def _parse(self, entry):
+        try:
+            kind = entry['kind']
+            parsed = dict(self._key(kind, entry), **{
+                'kind': kind,
+                'node': str(entry['node']),
+                'seq': int(entry['seq']),
+                'timestamp': datetime.fromisoformat(entry['timestamp'].rstrip('Z')),
+                'set': dict(entry['set']),
+                'unset': [str(f) for f in entry['unset']]
+            })
+        except (KeyError, TypeError, ValueError, AttributeError) as e:
+            raise ValueError('invalid change log entry: ' + repr(entry) + ' (' + repr(e) + ')')
+        if [k for k in self.keys[kind] if not isinstance(parsed[k], str)]:
+            raise ValueError('invalid change log entry: ' + repr(entry))
+        return parsed
+
+    # Two-way sync with a peer's /sync/, only sending and receiving missing entries
+    def sync(self, peer):
+        peer = peer.rstrip('/') + '/sync/'
+        received = 0
+        while True:
+            response = requests.get(peer + 'changes', params={
+                'since': sharkscout.Util.json(self.vector()),
+                'limit': self.limit
+            },
+                                    timeout=30)
+            response.raise_for_status()
+            entries = response.json()['changes']
+            received += self.apply(entries)
+            if len(entries) < self.limit:
+                break
+
+        sent = 0
+        vector = requests.get(peer, timeout=30).json()['vector']
+        while True:
+            entries = self.changes(vector)
+            if not entries:
+                break
+            response = requests.post(peer + 'changes', data=gzip.compress(
+                sharkscout.Util.json({'changes': entries}).encode('utf-8')), headers={
+                'Content-Type': 'application/json',
+                'Content-Encoding': 'gzip'
+            }, timeout=30)
+            response.raise_for_status()
+            sent += len(entries)
+            for entry in entries:
+                vector[entry['node']] = max(vector.get(entry['node'], 0), entry['seq'])
+        return received, sent
+
+
+# Sync with peers on an interval, in the background
+class ChangeLogSync(threading.Thread):
+    def __init__(self, peers, interval):
+        super().__init__(daemon=True)
+        self.peers = peers
+        self.interval = interval  # minutes
+
+    def run(self):
+        while True:
+            changelog = sharkscout.ChangeLog(sharkscout.Mongo())
+            for peer in self.peers:
+                try:
+                    received, sent = changelog.sync(peer)
+                    if received or sent:
+                        print('Synced with ' + peer + ': ' + str(received) + ' received, ' + str(sent) + ' sent')
+                except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+                    print('Couldn\'t sync with ' + peer + ': ' + repr(e))
+            if not self.interval:
+                return
+            time.sleep(self.interval * 60)
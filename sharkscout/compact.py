@@ -0,0 +1,185 @@
+import sys
+
+import hashlib
+import os
+import re
+import struct
+import threading
+
+
+# The compact WebSocket encoding, for clients that negotiate the 'sharkscout.compact' subprotocol: MessagePack, with
+#  every map key found in a per-year dictionary (the WebSocket messages' own keys, then every field name on the year's
+#  scouting forms) sent as its index in it. www/static/js/sharkscout.js has the same encoder and decoder.
+class Compact(object):
+    protocol = 'sharkscout.compact'
+    keys = ['dequeue', 'dictionary', 'key', 'keys', 'message', 'mobile', 'nickname', 'ping', 'pong', 'scouting_match',
+            'scouting_pit', 'show', 'time_team', 'toast', 'type', 'version', 'year']  # (never reorder, only append)
+    forms = ['scout_match.html', 'scout_pit.html', os.path.join('scouting', 'match.html'),
+             os.path.join('scouting', 'pit.html')]
+
+    integers = [(0xcc, 'B'), (0xcd, 'H'), (0xce, 'I'), (0xcf, 'Q'), (0xd0, 'b'), (0xd1, 'h'), (0xd2, 'i'), (0xd3, 'q')]
+    ranges = {fmt: (-(1 << (bits - 1)), 1 << (bits - 1)) if fmt.islower() else (0, 1 << bits) for fmt, bits in
+              [('B', 8), ('H', 16), ('I', 32), ('Q', 64), ('b', 8), ('h', 16), ('i', 32), ('q', 64)]}
+    scalars = dict([(0xca, 'f'), (0xcb, 'd')] + integers)  # {type: struct format}
+    lengths = {0xd9: 'B', 0xda: 'H', 0xdb: 'I', 0xdc: 'H', 0xdd: 'I', 0xde: 'H', 0xdf: 'I'}  # str, array, map
+    depth = 32  # arrays and maps nested deeper than this aren't decoded (scouting needs 3)
+
+    # Class-level, shared by every socket. Don't rebind these!
+    dictionaries = {}  # {year: {'year': year, 'version': hash, 'keys': [...], 'index': {key: index}}}
+    dictionaries_lock = threading.Lock()
+
+    # A year's dictionary
+    @classmethod
+    def dictionary(cls, year):
+        try:
+            year = int(year)
+        except (TypeError, ValueError):
+            year = None
+        with cls.dictionaries_lock:
+            if year not in cls.dictionaries:
+                www = os.path.join(os.path.dirname(sys.argv[0]), 'www')
+                forms = cls.forms + ([os.path.join('scouting', str(year), f) for f in ['match.html', 'pit.html']]
+                                     if year else [])
+                fields = set()
+                for form in [os.path.join(www, f) for f in forms]:
+                    if os.path.exists(form):
+                        with open(form, 'r') as f:
+                            fields.update(re.findall(r'name="([A-Za-z0-9_]+)(?:\[\])?"', f.read()))
+                keys = cls.keys + sorted(fields - set(cls.keys))
+                cls.dictionaries[year] = {
+                    'year': year,
+                    'version': hashlib.md5('\n'.join(keys).encode()).hexdigest()[:8],
+                    'keys': keys,
+                    'index': {k: i for i, k in enumerate(keys)}
+                }
+            return cls.dictionaries[year]
+
+    @classmethod
+    def encode(cls, value, dictionary):
+        packed = bytearray()
+        cls._pack(value, dictionary['index'], packed)
+        return bytes(packed)
+
+    @classmethod
+    def decode(cls, data, dictionary):
+        try:
+            value, offset = cls._unpack(memoryview(data), 0, dictionary['keys'], cls.depth)
+        except (IndexError, struct.error) as e:
+            raise ValueError('Truncated MessagePack: ' + str(e))
+        if offset != len(data):
+            raise ValueError('Trailing bytes after MessagePack')
+        return value
+
+    @classmethod
+    def _pack(cls, value, index, packed):
+        if value is None:
+            packed.append(0xc0)
+        elif value is True or value is False:
+            packed.append(0xc3 if value else 0xc2)
+        elif isinstance(value, int):
+            if -0x20 <= value < 0x80:
+                packed += struct.pack('>b', value)
+            else:
+                for kind, fmt in cls.integers:
+                    low, high = cls.ranges[fmt]
+                    if low <= value < high:
+                        packed += struct.pack('>B' + fmt, kind, value)
+                        break
+                else:
+                    cls._pack(float(value), index, packed)
+        elif isinstance(value, float):
+            packed += struct.pack('>Bd', 0xcb, value)
+        elif isinstance(value, str):
+            encoded = value.encode('utf-8')
+            cls._header(len(encoded), 0xa0, 0x20, 0xd9, 0xda, 0xdb, packed)
+            packed += encoded
+        elif isinstance(value, (list, tuple)):
+            cls._header(len(value), 0x90, 0x10, None, 0xdc, 0xdd, packed)
+            for item in value:
+                cls._pack(item, index, packed)
+        elif isinstance(value, dict):
+            cls._header(len(value), 0x80, 0x10, None, 0xde, 0xdf, packed)
+            for key, item in value.items():
+                key = str(key)
+                cls._pack(index[key] if key in index else key, index, packed)
+                cls._pack(item, index, packed)
+        else:
+            cls._pack(str(value), index, packed)
+
+    @staticmethod
+    def _header(length, fix, fix_limit, type_8, type_16, type_32, packed):
+        if length < fix_limit:
+            packed.append(fix | length)
+        elif type_8 is not None and length < 0x100:
+            packed += struct.pack('>BB', type_8, length)
+        elif length < 0x10000:
+            packed += struct.pack('>BH', type_16, length)
+        else:
+            packed += struct.pack('>BI', type_32, length)
+
+    # (value, offset after it)
+    @classmethod
+    def _unpack(cls, data, offset, keys, depth):
+        kind = data[offset]
+        offset += 1
+        if kind < 0x80:
+            return kind, offset
+        if kind >= 0xe0:
+            return kind - 0x100, offset
+        if kind < 0x90:
+            return cls._unpack_map(data, offset, kind & 0x0f, keys, depth)
+        if kind < 0xa0:
+            return cls._unpack_array(data, offset, kind & 0x0f, keys, depth)
+        if kind < 0xc0:
+            return cls._unpack_str(data, offset, kind & 0x1f)
+        if kind in [0xc0, 0xc2, 0xc3]:
+            return {0xc0: None, 0xc2: False, 0xc3: True}[kind], offset
+        if kind in cls.scalars:
+            fmt = '>' + cls.scalars[kind]
+            return struct.unpack_from(fmt, data, offset)[0], offset + struct.calcsize(fmt)
+        if kind in cls.lengths:
+            fmt = '>' + cls.lengths[kind]
+            length = struct.unpack_from(fmt, data, offset)[0]
+            offset += struct.calcsize(fmt)
+            if kind <= 0xdb:
+                return cls._unpack_str(data, offset, length)
+            if kind <= 0xdd:
+                return cls._unpack_array(data, offset, length, keys, depth)
+            return cls._unpack_map(data, offset, length, keys, depth)
+        raise ValueError('Unsupported MessagePack type 0x{:02x}'.format(kind))
+
+    @staticmethod
+    def _unpack_str(data, offset, length):
+        if offset + length > len(data):
+            raise IndexError('string past the end')
+        return bytes(data[offset:offset + length]).decode('utf-8'), offset + length
+
+    @staticmethod
+    def _nest(depth):
+        if depth <= 0:
+            raise ValueError('MessagePack nested too deeply')
+        return depth - 1
+
+    @classmethod
+    def _unpack_array(cls, data, offset, length, keys, depth):
+        depth = cls._nest(depth)
+        items = []
+        for _ in range(length):
+            item, offset = cls._unpack(data, offset, keys, depth)
+            items.append(item)
+        return items, offset
+
+    @classmethod
+    def _unpack_map(cls, data, offset, length, keys, depth):
+        depth = cls._nest(depth)
+        items = {}
+        for _ in range(length):
+            key, offset = cls._unpack(data, offset, keys, depth)
+            if isinstance(key, int) and not isinstance(key, bool):
+                if not 0 <= key < len(keys):
+                    raise ValueError('Unknown dictionary key ' + str(key))
+                key = keys[key]
+            if not isinstance(key, str):
+                raise ValueError('Map key is neither a string nor a dictionary index')
+            items[key], offset = cls._unpack(data, offset, keys, depth)
+        return items, offset
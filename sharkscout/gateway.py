@@ -0,0 +1,244 @@
+import asyncio
+import base64
+import cherrypy
+import cherrypy.process.wspbus
+import concurrent.futures
+import hashlib
+import multiprocessing
+import struct
+
+import sharkscout
+from sharkscout.webserver import WebSocketProtocol  # (a base class, needed before sharkscout's own import gets to it)
+
+
+# Every WebSocket in an asyncio process of its own (--gateway) instead of inside the web server: the same messages as
+#  /ws, with the Mongo reads and writes they need handed to a few threads so the event loop never waits on them. Web
+#  server processes are nudged to look for the writes right away (see Watcher.nudge), and scouting written anywhere
+#  else reaches the gateway's sockets through its own Watcher.
+class Gateway(object):
+    magic = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'  # RFC 6455's handshake GUID
+    max_message = 4 * 1024 * 1024  # bytes, enough for a tablet's whole offline queue
+    writers = 4  # threads making Mongo reads and writes
+    backlog = 1024  # connections waiting to be accepted
+    idle = 60  # seconds to wait on a handshake or frame, a silent socket is pinged once and dropped after another
+
+    def __init__(self, port, nudges=None):
+        self.port = port
+        self.nudges = nudges or []  # the web server processes' Watcher.nudge events
+        self.process = None
+        self.loop = None
+        self.executor = None
+
+    def start(self):
+        context = multiprocessing.get_context('fork')
+        self.process = context.Process(target=self.run, name='Gateway')
+        self.process.start()
+
+    def join(self, timeout=None):
+        if self.process is not None:
+            self.process.join(timeout)
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join()
+
+    def run(self):
+        sharkscout.Mongo.fork()
+        bus = cherrypy.process.wspbus.Bus()
+        sharkscout.Watcher(bus).subscribe()
+        bus.subscribe(sharkscout.Watcher.channel, GatewaySocket.changed)
+        bus.start()
+        sharkscout.Metrics.gauge('sharkscout_websocket_sockets', lambda: len(GatewaySocket.sockets))
+        try:
+            asyncio.run(self.serve())
+        finally:
+            bus.stop()
+
+    async def serve(self):
+        self.loop = asyncio.get_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.writers, thread_name_prefix='Gateway')
+        server = await asyncio.start_server(self.connection, '0.0.0.0', self.port, backlog=self.backlog)
+        cherrypy.log('Gateway serving WebSockets on port ' + str(self.port))
+        async with server:
+            await server.serve_forever()
+
+    async def connection(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.idle)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        lines = request.decode('latin-1').split('\r\n')
+        path = (lines[0].split(' ') + [''])[1]
+        headers = {k.strip().lower(): v.strip() for k, v in [l.split(':', 1) for l in lines[1:] if ':' in l]}
+
+        # The gateway's own /metrics, everything else has to be a WebSocket
+        if path == '/metrics':
+            self.respond(writer, '200 OK', 'text/plain; version=0.0.4', sharkscout.Metrics.prometheus())
+            return
+        key = headers.get('sec-websocket-key')
+        if 'websocket' not in headers.get('upgrade', '').lower() or not key:
+            self.respond(writer, '426 Upgrade Required', 'text/plain', 'WebSockets only')
+            return
+
+        offered = [p.strip() for p in headers.get('sec-websocket-protocol', '').split(',')]
+        protocols = [p for p in offered if p == sharkscout.Compact.protocol]
+        accept = base64.b64encode(hashlib.sha1(key.encode() + self.magic).digest()).decode()
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\n'
+                      'Upgrade: websocket\r\n'
+                      'Connection: Upgrade\r\n'
+                      'Sec-WebSocket-Accept: ' + accept + '\r\n' +
+                      ''.join(['Sec-WebSocket-Protocol: ' + p + '\r\n' for p in protocols]) +
+                      '\r\n').encode())
+
+        socket = GatewaySocket(self.loop, writer, protocols)
+        socket.opened()
+        try:
+            async for data, binary in socket.messages(reader, self.max_message, self.idle):
+                message = socket.decode(data, binary)
+                if message is None:
+                    continue
+                if isinstance(message, dict) and set(message) & set(socket.blocking):
+                    await self.loop.run_in_executor(self.executor, socket.handle, message)
+                    if 'scouting_match' in message or 'scouting_pit' in message:
+                        self.nudge()
+                else:
+                    socket.handle(message)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            socket.code = 1006  # gone without a close frame, or silent past the ping
+        except Exception as e:
+            cherrypy.log(str(socket) + ' ' + repr(e), traceback=True)
+            socket.close(1011)
+        finally:
+            socket.closed(socket.code)
+            writer.close()
+
+    @staticmethod
+    def respond(writer, status, content_type, body):
+        body = body.encode()
+        writer.write(('HTTP/1.1 ' + status + '\r\n'
+                      'Content-Type: ' + content_type + '\r\n'
+                      'Content-Length: ' + str(len(body)) + '\r\n'
+                      'Connection: close\r\n'
+                      '\r\n').encode() + body)
+        writer.close()
+
+    # Have every web server process look for the write now, rather than at its next poll
+    def nudge(self):
+        for nudge in self.nudges:
+            nudge.set()
+
+
+# One WebSocket's frames (RFC 6455) on an asyncio stream
+class GatewayConnection(object):
+    codes = [1000, 1001, 1002, 1003, 1007, 1008, 1009, 1010, 1011, 1012, 1013, 1014]  # close codes a peer may send
+
+    def __init__(self, loop, writer, protocols):
+        self.loop = loop
+        self.writer = writer
+        self.protocols = protocols
+        self.code = None  # close code, once closed
+
+    # Thread-safe: messages are also sent from the Mongo threads and by the Watcher
+    def send(self, payload, binary=False):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self.loop.call_soon_threadsafe(self.write, self.frame(0x2 if binary else 0x1, payload))
+
+    def write(self, frame):
+        if not self.writer.is_closing():
+            self.writer.write(frame)
+
+    def close(self, code=1000):
+        if self.code is None:
+            self.code = code
+            self.write(self.frame(0x8, struct.pack('>H', code)))
+
+    @staticmethod
+    def frame(opcode, payload):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack('>BB', 0x80 | opcode, length)
+        elif length < 0x10000:
+            header = struct.pack('>BBH', 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+        return header + payload
+
+    # (Masking and unmasking are the same XOR)
+    @staticmethod
+    def unmask(payload, mask):
+        if not payload:
+            return payload
+        mask = (mask * (len(payload) // 4 + 1))[:len(payload)]
+        return (int.from_bytes(payload, 'big') ^ int.from_bytes(mask, 'big')).to_bytes(len(payload), 'big')
+
+    # The code to answer a close frame with: the peer's own, if it's one a peer may send (RFC 6455 7.4)
+    @classmethod
+    def close_code(cls, payload):
+        if not payload:
+            return 1000
+        if len(payload) < 2:
+            return 1002
+        code = struct.unpack('>H', payload[:2])[0]
+        if code not in cls.codes and not 3000 <= code < 5000:
+            return 1002
+        try:
+            payload[2:].decode('utf-8')
+        except UnicodeDecodeError:
+            return 1007
+        return code
+
+    # (data, binary) of every message, until either side closes; asyncio.TimeoutError if the peer goes quiet for
+    #  `idle` seconds, then doesn't answer a ping (or finish a frame) within another `idle`
+    async def messages(self, reader, max_message, idle):
+        fragments = []
+        binary = False
+        while self.code is None:
+            try:
+                head = await asyncio.wait_for(reader.readexactly(2), idle)
+            except asyncio.TimeoutError:
+                self.write(self.frame(0x9, b''))
+                head = await asyncio.wait_for(reader.readexactly(2), idle)
+            final, opcode = head[0] & 0x80, head[0] & 0x0f
+            masked, length = head[1] & 0x80, head[1] & 0x7f
+            if length == 126:
+                length = struct.unpack('>H', await asyncio.wait_for(reader.readexactly(2), idle))[0]
+            elif length == 127:
+                length = struct.unpack('>Q', await asyncio.wait_for(reader.readexactly(8), idle))[0]
+            if not masked:
+                self.close(1002)  # clients have to mask
+                return
+            if length + sum([len(f) for f in fragments]) > max_message:
+                self.close(1009)
+                return
+            mask = await asyncio.wait_for(reader.readexactly(4), idle)
+            payload = self.unmask(await asyncio.wait_for(reader.readexactly(length), idle), mask)
+
+            if opcode == 0x8:
+                self.close(self.close_code(payload))
+                return
+            elif opcode == 0x9:
+                self.write(self.frame(0xa, payload))
+                continue
+            elif opcode == 0xa:
+                continue
+            elif opcode in [0x1, 0x2] and not fragments:
+                binary = opcode == 0x2
+                fragments = [payload]
+            elif opcode == 0x0 and fragments:
+                fragments.append(payload)
+            else:
+                self.close(1002)
+                return
+
+            if final:
+                yield b''.join(fragments), binary
+                fragments = []
+
+
+# WebSockets held by the gateway
+class GatewaySocket(WebSocketProtocol, GatewayConnection):
+    sockets = {}
+    written = {}  # {scouting key: time} of writes made through the gateway, already broadcast
@@ -0,0 +1,98 @@
+import time
+
+import cherrypy
+import concurrent.futures
+import pymongo
+import pymongo.errors
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+import sharkscout
+
+
+# TBA updates, run in the background instead of on a request thread: at most `workers` at once and `limit` waiting,
+#  one per key (asking for an update that's already queued or running gets that job instead). Jobs are documents in
+#  the jobs collection, so their progress reaches every WebSocket through the Watcher, whichever process runs them.
+class Jobs(object):
+    collection = 'jobs'  # {_id: key, run, description, redirect, state, requests, error, modified_timestamp}
+    workers = 2
+    limit = 20  # jobs waiting for a worker, per process
+    progress_interval = 1  # seconds between progress writes
+    stale = 10 * 60  # seconds without progress before a queued or running job is presumed lost (e.g. a restart)
+    ttl = 60 * 60  # seconds finished jobs are kept
+
+    # Class-level, shared by every request. Don't rebind these!
+    pool = None  # (created on first use, so forked processes get their own threads)
+    pending = []  # keys queued or running in this process
+    lock = threading.Lock()
+
+    @classmethod
+    def _collection(cls):
+        return sharkscout.Mongo().shark_scout[cls.collection]
+
+    # Queue function(mongo, *args), its TBA requests counted as progress. The job, or None if too many are waiting
+    @classmethod
+    def submit(cls, key, description, redirect, function, *args):
+        now = datetime.utcnow()
+        with cls.lock:
+            if cls.pool is None:
+                cls.pool = concurrent.futures.ThreadPoolExecutor(cls.workers, thread_name_prefix='Jobs')
+            if len(cls.pending) >= cls.workers + cls.limit:
+                return None
+            try:
+                job = cls._collection().find_one_and_update({
+                    '_id': key,
+                    '$or': [
+                        {'state': {'$nin': ['queued', 'running']}},
+                        {'modified_timestamp': {'$lt': now - timedelta(seconds=cls.stale)}}
+                    ]
+                }, {
+                    '$set': {
+                        'run': uuid.uuid4().hex,
+                        'description': description,
+                        'redirect': redirect,
+                        'state': 'queued',
+                        'requests': 0,
+                        'error': None,
+                        'modified_timestamp': now
+                    },
+                    '$setOnInsert': {'created_timestamp': now}
+                }, upsert=True, return_document=pymongo.ReturnDocument.AFTER)
+            except pymongo.errors.DuplicateKeyError:
+                return cls._collection().find_one({'_id': key})  # already queued or running
+            cls.pending.append(key)
+            cls.pool.submit(cls._run, job, function, args)
+
+        cls._collection().delete_many({
+            'state': {'$in': ['done', 'failed']},
+            'modified_timestamp': {'$lt': now - timedelta(seconds=cls.ttl)}
+        })
+        return job
+
+    @classmethod
+    def _run(cls, job, function, args):
+        written = [0]
+
+        def progress(requests):
+            if time.time() - written[0] >= cls.progress_interval:
+                written[0] = time.time()
+                cls._update(job, requests=requests)
+
+        try:
+            cls._update(job, state='running')
+            mongo = sharkscout.Mongo()
+            mongo.tba_api.progress = progress
+            function(mongo, *args)
+            cls._update(job, state='done', requests=mongo.tba_api.requests)
+        except Exception as e:
+            cherrypy.log('Job ' + job['_id'] + ' failed', traceback=True)
+            cls._update(job, state='failed', error=repr(e))
+        finally:
+            with cls.lock:
+                cls.pending.remove(job['_id'])
+
+    @classmethod
+    def _update(cls, job, **fields):
+        fields['modified_timestamp'] = datetime.utcnow()
+        cls._collection().update_one({'_id': job['_id'], 'run': job['run']}, {'$set': fields})
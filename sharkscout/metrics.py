@@ -0,0 +1,150 @@
+import time
+
+import bisect
+import cherrypy
+import re
+import threading
+
+
+# In-process counters, gauges and fixed-bucket histograms, exported at /metrics in the Prometheus text format (or as
+#  JSON for the Odroid status display). Recording is a dict lookup and a few additions under one lock.
+class Metrics(object):
+    seconds = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]  # default histogram buckets
+    commands = [0, 1, 2, 5, 10, 20, 50, 100, 200]  # buckets for Mongo commands per request
+    described = {
+        'sharkscout_http_request_duration_seconds': ('histogram', 'HTTP request handling time by handler'),
+        'sharkscout_http_responses_total': ('counter', 'HTTP responses by handler and status code'),
+        'sharkscout_mongo_commands_per_request': ('histogram', 'Mongo round trips per HTTP request by handler'),
+        'sharkscout_admission_running': ('gauge', 'HTTP requests being handled by admission class'),
+        'sharkscout_admission_waiting': ('gauge', 'HTTP requests waiting for their admission class\'s turn'),
+        'sharkscout_admission_wait_seconds': ('histogram', 'Time HTTP requests waited for admission by class'),
+        'sharkscout_admission_rejected_total': ('counter', 'HTTP requests turned away with a 503 by admission class'),
+        'sharkscout_websocket_messages_total': ('counter', 'WebSocket messages received by type'),
+        'sharkscout_websocket_message_duration_seconds': ('histogram', 'WebSocket message handling time by type'),
+        'sharkscout_websocket_sent_total': ('counter', 'WebSocket messages sent'),
+        'sharkscout_websocket_received_bytes_total': ('counter', 'WebSocket bytes received by type and encoding'),
+        'sharkscout_websocket_sent_bytes_total': ('counter', 'WebSocket bytes sent by encoding'),
+        'sharkscout_websocket_sockets': ('gauge', 'Open WebSockets'),
+        'sharkscout_tba_requests_total': ('counter', 'TBA API requests by endpoint family and status code'),
+        'sharkscout_tba_request_duration_seconds': ('histogram', 'TBA API request time by endpoint family'),
+        'sharkscout_tba_retries_total': ('counter', 'TBA API request retries by endpoint family')
+    }
+
+    # Class-level, shared by every thread. Don't rebind these!
+    lock = threading.Lock()
+    counters = {}  # {(name, labels): value}
+    histograms = {}  # {(name, labels): [buckets, [count per bucket..., +Inf], sum]}
+    gauges = {}  # {(name, labels): function}, read when exported
+
+    @classmethod
+    def inc(cls, name, labels=(), value=1):
+        key = (name, labels)
+        with cls.lock:
+            cls.counters[key] = cls.counters.get(key, 0) + value
+
+    @classmethod
+    def observe(cls, name, value, labels=(), buckets=None):
+        key = (name, labels)
+        with cls.lock:
+            histogram = cls.histograms.get(key)
+            if histogram is None:
+                buckets = buckets or cls.seconds
+                histogram = cls.histograms[key] = [buckets, [0] * (len(buckets) + 1), 0]
+            histogram[1][bisect.bisect_left(histogram[0], value)] += 1
+            histogram[2] += value
+
+    @classmethod
+    def gauge(cls, name, function, labels=()):
+        cls.gauges[(name, labels)] = function
+
+    # "event/2018vahay/matches" -> "event/*/matches", so there's one family per kind of endpoint
+    @staticmethod
+    def family(endpoint):
+        return '/'.join(['*' if re.search(r'\d', s) else s for s in endpoint.split('/')])
+
+    # ----- HTTP -----
+
+    # CherryPy 'on_start_resource' hook
+    @classmethod
+    def request_start(cls):
+        cherrypy.serving.request.metrics_start = time.perf_counter()
+        cherrypy.serving.request.hooks.attach('on_end_request', cls.request_end)
+
+    @classmethod
+    def request_end(cls):
+        request = cherrypy.serving.request
+        labels = (('handler', cls.handler(request)),)
+        cls.observe('sharkscout_http_request_duration_seconds', time.perf_counter() - request.metrics_start, labels)
+        cls.inc('sharkscout_http_responses_total',
+                labels + (('code', str(cherrypy.serving.response.status or 200).split(' ')[0]),))
+        if hasattr(request, 'mongo_commands'):
+            cls.observe('sharkscout_mongo_commands_per_request', len(request.mongo_commands), labels, cls.commands)
+
+    @staticmethod
+    def handler(request):
+        handler = request.handler
+        while hasattr(handler, 'oldhandler'):  # tools.encode
+            handler = handler.oldhandler
+        function = getattr(handler, 'callable', None)
+        if function is None:
+            return 'none'  # not found, redirected, etc.
+        return getattr(function, '__qualname__', function.__class__.__name__)
+
+    # ----- Export -----
+
+    @classmethod
+    def _snapshot(cls):
+        with cls.lock:
+            counters = dict(cls.counters)
+            histograms = {k: [h[0], list(h[1]), h[2]] for k, h in cls.histograms.items()}
+        gauges = {}
+        for key, function in list(cls.gauges.items()):
+            try:
+                gauges[key] = function()
+            except Exception as e:
+                cherrypy.log('Couldn\'t read gauge ' + key[0] + ': ' + repr(e))
+        return counters, histograms, gauges
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        labels = labels + extra
+        if not labels:
+            return ''
+        return '{' + ','.join([k + '="' + str(v).replace('\\', '\\\\').replace('"', '\\"') + '"' for k, v in
+                               labels]) + '}'
+
+    @classmethod
+    def prometheus(cls):
+        counters, histograms, gauges = cls._snapshot()
+        lines = []
+        for name in sorted(set([k[0] for k in list(counters) + list(histograms) + list(gauges)])):
+            kind, description = cls.described.get(name, ('untyped', name))
+            lines += ['# HELP ' + name + ' ' + description, '# TYPE ' + name + ' ' + kind]
+            for (_, labels), value in sorted([i for i in counters.items() if i[0][0] == name]) + sorted(
+                    [i for i in gauges.items() if i[0][0] == name]):
+                lines.append(name + cls._labels(labels) + ' ' + str(value))
+            for (_, labels), (buckets, counts, total) in sorted([i for i in histograms.items() if i[0][0] == name]):
+                cumulative = 0
+                for bucket, count in zip(buckets + ['+Inf'], counts):
+                    cumulative += count
+                    lines.append(name + '_bucket' + cls._labels(labels, (('le', bucket),)) + ' ' + str(cumulative))
+                lines.append(name + '_sum' + cls._labels(labels) + ' ' + str(total))
+                lines.append(name + '_count' + cls._labels(labels) + ' ' + str(cumulative))
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def json(cls):
+        counters, histograms, gauges = cls._snapshot()
+        metrics = {}
+        for (name, labels), value in list(counters.items()) + list(gauges.items()):
+            metrics.setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), (buckets, counts, total) in histograms.items():
+            count = sum(counts)
+            metrics.setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else 0,
+                'buckets': {str(b): c for b, c in zip(buckets + ['+Inf'], counts)}
+            })
+        return metrics
@@ -4,7 +4,6 @@ import argparse
 import hjson
 import os
 import pymongo
-import pymongo.errors
 import re
 import subprocess
 from datetime import datetime, date
@@ -17,7 +16,10 @@ class TBACache(object):
         self.collection = collection
 
     def __getitem__(self, key):
-        return list(self.collection.find({'endpoint': key}))[0]['modified']
+        cached = self.collection.find_one({'endpoint': key}, {'modified': 1})
+        if cached is None:
+            raise KeyError(key)
+        return cached['modified']
 
     def __setitem__(self, key, value):
         self.collection.update_one({'endpoint': key}, {'$set': {
@@ -26,14 +28,19 @@ class TBACache(object):
         }}, upsert=True)
 
     def __delitem__(self, key):
-        self.collection.remove({'endpoint': key})
+        self.collection.delete_many({'endpoint': key})
 
     def __contains__(self, key):
-        return len(list(self.collection.find({'endpoint': key})))
+        return self.collection.find_one({'endpoint': key}, {'_id': 1}) is not None
 
 
 class Mongo(object):
     client = None
+    connection = None  # (args, kwargs) the client was made with, to make another one the same way after a fork
+    database = 'shark_scout'
+    backend = 'mongod'  # or 'sqlite', embedded storage for devices without the memory for mongod
+    backends = {'mongod': 'MongoDB', 'sqlite': 'SQLite'}
+    batch_size = 500  # documents per round trip when streaming a whole collection
 
     def __init__(self, host=None):
         self.host = host
@@ -42,16 +49,39 @@ class Mongo(object):
             self.start()
         self.client = self.__class__.client
 
-        self.shark_scout = self.client.shark_scout
+        self.shark_scout = self.client[self.database]
         self.tba_events = self.shark_scout.tba_events
         self.tba_teams = self.shark_scout.tba_teams
         self.tba_cache = self.shark_scout.tba_cache
         self.scouting = self.shark_scout.scouting
+        self.match_scouting = self.shark_scout.scouting_matches  # one document per (event, match, team)
 
         cache = TBACache(self.tba_cache)
         self.tba_api = sharkscout.TheBlueAlliance(cache)
 
+    # New client in a forked process (--workers), connections can't be shared between processes
+    @classmethod
+    def fork(cls):
+        if isinstance(cls.client, sharkscout.SQLiteClient):
+            cls.client = sharkscout.SQLiteClient(cls.client.path)
+        elif cls.client is not None:
+            args, kwargs = cls.connection
+            cls._connect(*args, **kwargs)
+
+    @classmethod
+    def _connect(cls, *args, **kwargs):
+        cls.connection = (args, kwargs)
+        cls.client = pymongo.MongoClient(*args, event_listeners=[sharkscout.QueryProfiler()], **kwargs)
+
     def start(self):
+        # Embedded storage, no mongod process at all
+        if self.backend == 'sqlite':
+            sqlite_dir = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), 'sqlite')
+            self.__class__.client = sharkscout.SQLiteClient(sqlite_dir)
+            print('SQLite storage in ' + sqlite_dir)
+            print()
+            return
+
         # Build and create database path
         mongo_dir = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), 'mongo')
         if not os.path.exists(mongo_dir):
@@ -64,8 +94,11 @@ class Mongo(object):
                 print('invalid mongod host: ' + self.host)
                 print()
                 sys.exit(1)
-            self.__class__.client = pymongo.MongoClient(host.hostname, host.port or 27017)
-            print('mongod already running remotely at ' + self.host)
+            if host.scheme in ['mongodb', 'mongodb+srv']:
+                self._connect(self.host)  # (credentials and options included)
+            else:
+                self._connect(host.hostname, host.port or 27017)
+            print('mongod already running remotely at ' + host.hostname + ':' + str(host.port or 27017))
             print()
             return
 
@@ -78,7 +111,7 @@ class Mongo(object):
             if known.dbpath and not os.path.isabs(known.dbpath):
                 known.dbpath = os.path.join(sharkscout.Util.pid_to_cwd(pid), known.dbpath)
             if known.dbpath is not None and os.path.normpath(known.dbpath) == os.path.normpath(mongo_dir):
-                self.__class__.client = pymongo.MongoClient('localhost', known.port)
+                self._connect('localhost', known.port)
                 print('mongod already running on local port ' + str(known.port))
                 print()
                 return
@@ -98,7 +131,7 @@ class Mongo(object):
                 '--dbpath', mongo_dir,
                 '--smallfiles'
             ], stdout=null, stderr=subprocess.STDOUT)
-            self.__class__.client = pymongo.MongoClient('localhost', port)
+            self._connect('localhost', port)
             print('mongod started on local port ' + str(port))
             print()
             return
@@ -114,6 +147,15 @@ class Mongo(object):
             ('event_key', pymongo.ASCENDING),
             ('team_key', pymongo.ASCENDING)
         ], unique=True)
+        self.match_scouting.create_index([
+            ('event_key', pymongo.ASCENDING),
+            ('match_key', pymongo.ASCENDING),
+            ('team_key', pymongo.ASCENDING)
+        ], unique=True)
+        self.match_scouting.create_index([
+            ('event_key', pymongo.ASCENDING),
+            ('team_key', pymongo.ASCENDING)
+        ])
         self.tba_events.create_index('event_code')
         self.tba_events.create_index('key', unique=True)
         self.tba_events.create_index('teams')
@@ -126,59 +168,76 @@ class Mongo(object):
         self.tba_teams.create_index('key', unique=True)
         self.tba_teams.create_index('team_number', unique=True)
         self.tba_cache.create_index('endpoint', unique=True)
+        # Polled by the Watcher when change streams aren't available
+        for collection in [self.scouting, self.match_scouting, self.tba_events, self.tba_teams,
+                           self.shark_scout[sharkscout.Jobs.collection]]:
+            collection.create_index('modified_timestamp')
+        sharkscout.ChangeLog(self).index()
 
     # Perform database migrations
     def migrate(self):
         # ----- Addition of created_timestamp and modified_timestamp -----
-        # TBA events
-        self.tba_events.update({
-            'modified_timestamp': {'$exists': False}
-        }, {
-            '$set': {'modified_timestamp': datetime.utcfromtimestamp(0)}
-        }, multi=True)
-        bulk = self.tba_events.initialize_unordered_bulk_op()
-        for event in self.tba_events.find({'created_timestamp': {'$exists': False}}):
-            bulk.find({'_id': event['_id']}).update({
-                '$set': {'created_timestamp': event['modified_timestamp']}
-            })
-        try:
-            bulk.execute()
-        except pymongo.errors.InvalidOperation:
-            pass  # "No operations to execute"
-        # TBA teams
-        self.tba_teams.update({
-            'modified_timestamp': {'$exists': False}
-        }, {
-            '$set': {'modified_timestamp': datetime.utcfromtimestamp(0)}
-        }, multi=True)
-        bulk = self.tba_teams.initialize_unordered_bulk_op()
-        for event in self.tba_teams.find({'created_timestamp': {'$exists': False}}):
-            bulk.find({'_id': event['_id']}).update({
-                '$set': {'created_timestamp': event['modified_timestamp']}
+        for collection in [self.tba_events, self.tba_teams]:
+            collection.update_many({
+                'modified_timestamp': {'$exists': False}
+            }, {
+                '$set': {'modified_timestamp': datetime.utcfromtimestamp(0)}
             })
-        try:
-            bulk.execute()
-        except pymongo.errors.InvalidOperation:
-            pass  # "No operations to execute"
+            requests = [pymongo.UpdateOne({'_id': document['_id']}, {
+                '$set': {'created_timestamp': document['modified_timestamp']}
+            }) for document in collection.find({'created_timestamp': {'$exists': False}})]
+            if requests:
+                collection.bulk_write(requests, ordered=False)
+
+        # ----- Last full TBA update out of modified_timestamp (now any write) into updated_timestamp -----
+        for collection in [self.tba_events, self.tba_teams]:
+            requests = [pymongo.UpdateOne({'_id': document['_id']}, {
+                '$set': {'updated_timestamp': document['modified_timestamp']}
+            }) for document in collection.find({'updated_timestamp': {'$exists': False}}, {'modified_timestamp': 1})]
+            if requests:
+                collection.bulk_write(requests, ordered=False)
+
+        # ----- Embedded scouting.matches array to one scouting_matches document per match -----
+        # (safe to run while serving: copied matches never overwrite newer writes, and each team's
+        #  array is only removed after all of its matches were copied)
+        for scouting in self.scouting.find({'matches': {'$exists': True}}, {'matches': 1}):
+            requests = [pymongo.UpdateOne({
+                'event_key': match['event_key'],
+                'match_key': match['match_key'],
+                'team_key': match['team_key']
+            }, {
+                '$setOnInsert': dict(match, modified_timestamp=datetime.utcfromtimestamp(0))
+            }, upsert=True) for match in scouting['matches'] or []
+                if match.get('event_key') and match.get('match_key') and match.get('team_key')]
+            if requests:
+                self.match_scouting.bulk_write(requests, ordered=False)
+            self.scouting.update_one({'_id': scouting['_id']}, {'$unset': {'matches': ''}})
+        self.scouting.delete_many({'pit': {'$exists': False}, 'matches': {'$exists': False}})
+
+        # ----- Change log entries for scouting data from before the change log -----
+        sharkscout.ChangeLog(self).migrate()
 
     @property
     def version(self):
-        return self.shark_scout.command('serverStatus')['version']
+        return self.backends[self.backend] + ' ' + self.shark_scout.command('serverStatus')['version']
 
     @property
     def tba_count(self):
-        # (not using collection.count() because it can incorrectly return 0)
-        return len(list(self.tba_events.find())) + len(list(self.tba_teams.find()))
+        return self.tba_events.estimated_document_count() + self.tba_teams.estimated_document_count()
 
     # List of all events in a given year
     def events(self, year):
-        return list(self.tba_events.find({
+        return list(self.events_iter(year))
+
+    # Cursor of all events in a given year (only the given fields, if any), for streaming
+    def events_iter(self, year, fields=None):
+        return self.tba_events.find({
             'year': int(year)
-        }).sort([
+        }, self._projection(fields)).sort([
             ('start_date', pymongo.ASCENDING),
             ('district.abbreviation', pymongo.ASCENDING),
             ('name', pymongo.ASCENDING)
-        ]))
+        ]).batch_size(self.batch_size)
 
     # List of all years with events, and all weeks in a given year
     def events_stats(self, year):
@@ -189,9 +248,8 @@ class Mongo(object):
 
     # Event information
     def event(self, event_key):
-        event = list(self.tba_events.find({'key': event_key}))
+        event = self.tba_events.find_one({'key': event_key})
         if event:
-            event = event[0]
             if 'teams' not in event:
                 event['teams'] = []
 
@@ -234,6 +292,80 @@ class Mongo(object):
         else:
             return {}
 
+    # An event without its matches, teams, alliances, awards, rankings and stats, with counts of them instead (and of
+    #  qualification matches left to play, and of match scouting), for the event page before its sections load
+    def event_summary(self, event_key):
+        sections = ['matches', 'teams', 'alliances', 'awards']
+        event = list(self.tba_events.aggregate([
+            {'$match': {'key': event_key}},
+            {'$addFields': {'counts': dict({s: {'$size': {'$ifNull': ['$' + s, []]}} for s in sections}, remaining={
+                '$size': {'$filter': {
+                    'input': {'$ifNull': ['$matches', []]},
+                    'as': 'match',
+                    'cond': {'$and': [{'$eq': ['$$match.comp_level', 'qm']},
+                                      {'$lt': ['$$match.alliances.red.score', 0]}]}
+                }}
+            })}},
+            {'$project': {s: 0 for s in sections + ['rankings', 'stats']}}
+        ]))
+        if not event:
+            return {}
+        event = event[0]
+        counts = event['counts']
+        counts['scouting'] = self.match_scouting.count_documents({'event_key': event_key})
+
+        # The event page's sections with anything to show, in order
+        year_stats = self._scouting_stats_spec(event.get('year'))
+        event['sections'] = [s for s, shown in [
+            ('matches', True),
+            ('teams', True),
+            ('alliances', counts['alliances']),
+            ('stats', counts['scouting'] and year_stats is not None),
+            ('ratings', counts['matches']),
+            ('projection', counts['remaining']),
+            ('comparison', counts['scouting'] and year_stats is not None and year_stats[1]),
+            ('awards', counts['awards'])
+        ] if shown]
+        return event
+
+    # Only some of an event's fields (and its key, year and event type), with its own team list resolved to full team
+    #  information if asked for, for the event page's sections that don't need everything Mongo.event() adds
+    def event_section(self, event_key, fields):
+        event = self.tba_events.find_one({'key': event_key}, dict({
+            'key': 1,
+            'year': 1,
+            'event_type': 1
+        }, **{f: 1 for f in fields}))
+        if not event:
+            return {}
+        if 'teams' in fields:
+            event['teams'] = self.teams_list(event.get('teams') or [])
+        return event
+
+    # Local OPR/DPR/CCWM and component ratings of an event (from Mongo.event()), updated with what changed since the
+    #  last time they were asked for
+    def event_ratings(self, event):
+        if not event:
+            return {}
+        fields = []
+        year_stats = self._scouting_stats_spec(event.get('year'))
+        if year_stats is not None:
+            fields = sharkscout.Ratings.fields(year_stats[0])
+        scouting = self.match_scouting.find({'event_key': event['key']}, dict({
+            '_id': 0,
+            'match_key': 1,
+            'team_key': 1
+        }, **{f: 1 for f in fields})) if fields else []
+        return sharkscout.Ratings.event(event['key']).update(event.get('matches', []), scouting).stats()
+
+    # Projected final qualification rankings and remaining match outcomes of an event (from Mongo.event()), given its
+    #  ratings (from Mongo.event_ratings()) and individual scouting stats
+    def event_projection(self, event, ratings, stats):
+        if not event:
+            return {}
+        year_stats = self._scouting_stats_spec(event.get('year'))
+        return sharkscout.Projection.project(event, ratings, stats, year_stats[2] if year_stats is not None else None)
+
     # List of all events (years) with a given event code
     def event_years(self, event_code):
         return list(self.tba_events.find({'event_code': event_code}).sort('year', pymongo.DESCENDING))
@@ -241,29 +373,26 @@ class Mongo(object):
     # TBA update the event listing for a year
     def events_update(self, year):
         events = self.tba_api.events(year)
-        bulk = self.tba_events.initialize_unordered_bulk_op()
         # Upsert events
-        for event in events:
-            bulk.find({'key': event['key']}).upsert().update({
-                '$set': event,
-                '$setOnInsert': {
-                    'modified_timestamp': datetime.utcfromtimestamp(0),
-                    'created_timestamp': datetime.utcnow()
-                }
-            })
+        now = datetime.utcnow()
+        requests = [pymongo.UpdateOne({'key': event['key']}, {
+            '$set': dict(event, modified_timestamp=now),
+            '$setOnInsert': {
+                'updated_timestamp': datetime.utcfromtimestamp(0),  # never fully updated
+                'created_timestamp': now
+            }
+        }, upsert=True) for event in events]
         # Delete events that no longer exist
         if events:
             missing = [e['key'] for e in self.tba_events.find({
                 'year': int(year),
                 'key': {'$nin': [e['key'] for e in events]}
-            })]
+            }, {'key': 1})]
             if missing:
-                bulk.find({'key': {'$in': missing}}).remove()
+                requests.append(pymongo.DeleteMany({'key': {'$in': missing}}))
         # Execute
-        try:
-            bulk.execute()
-        except pymongo.errors.InvalidOperation:
-            pass  # "No operations to execute"
+        if requests:
+            self.tba_events.bulk_write(requests, ordered=False)
 
     # TBA update an individual event
     def event_update(self, event_key, update_favicon=False):
@@ -284,7 +413,7 @@ class Mongo(object):
                     'awards': self.tba_api.event_awards(event_key),
                     'alliances': self.tba_api.event_alliances(event_key)
                 }.items() if v})
-            event['modified_timestamp'] = datetime.utcnow()
+            event['modified_timestamp'] = event['updated_timestamp'] = datetime.utcnow()
             self.tba_events.update_one({
                 'key': event_key
             }, {
@@ -294,19 +423,16 @@ class Mongo(object):
 
     # List of matches with scouting data
     def scouting_matches(self, event_key):
-        matches = list(self.scouting.aggregate([{'$match': {
-            'event_key': event_key
-        }}, {'$unwind': {
-            'path': '$matches'
-        }}, {'$match': {  # sanity check
-            'matches.match_key': {'$ne': ''}
+        matches = list(self.match_scouting.aggregate([{'$match': {
+            'event_key': event_key,
+            'match_key': {'$ne': ''}  # sanity check
         }}, {'$group': {
-            '_id': '$matches.match_key',
+            '_id': '$match_key',
             'team_keys': {'$addToSet': '$team_key'},
             'blue': {
                 '$addToSet': {
                     '$cond': {
-                        'if': {'$eq': ['$matches.team_color', 'blue']},
+                        'if': {'$eq': ['$team_color', 'blue']},
                         'then': '$team_key',
                         'else': None
                     }
@@ -315,7 +441,7 @@ class Mongo(object):
             'red': {
                 '$addToSet': {
                     '$cond': {
-                        'if': {'$eq': ['$matches.team_color', 'red']},
+                        'if': {'$eq': ['$team_color', 'red']},
                         'then': '$team_key',
                         'else': None
                     }
@@ -373,64 +499,59 @@ class Mongo(object):
         return {m['key']: m['team_keys'] for m in self.scouting_matches(event_key)}
 
     def scouting_matches_raw(self, event_key):
-        return list(self.scouting.aggregate([{'$match': {
-            'event_key': event_key
-        }}, {'$unwind': {
-            'path': '$matches'
-        }}, {'$replaceRoot': {
-            'newRoot': '$matches'
-        }}, {'$sort': {
+        return list(self.scouting_matches_raw_iter(event_key))
+
+    # Cursor of raw match scouting data, for streaming
+    def scouting_matches_raw_iter(self, event_key):
+        return self.match_scouting.aggregate(self._scouting_matches_raw_pipeline(event_key) + [{'$sort': {
             'match_key': 1,
             'team_key': 1
-        }}]))
+        }}], allowDiskUse=True)
+
+    # All keys used by raw match scouting data, without fetching the data
+    def scouting_matches_raw_keys(self, event_key):
+        return self._keys(self.match_scouting, self._scouting_matches_raw_pipeline(event_key))
+
+    def _scouting_matches_raw_pipeline(self, event_key):
+        return [{'$match': {
+            'event_key': event_key
+        }}, {'$project': {
+            '_id': 0,
+            'modified_timestamp': 0,
+            'changed_timestamp': 0
+        }}]
+
+    # Distinct top-level keys of an aggregation's output documents
+    @staticmethod
+    def _keys(collection, pipeline):
+        return sorted([k['_id'] for k in collection.aggregate(pipeline + [{'$project': {
+            'keys': {'$objectToArray': '$$ROOT'}
+        }}, {'$unwind': {
+            'path': '$keys'
+        }}, {'$group': {
+            '_id': '$keys.k'
+        }}])])
+
+    # A find() projection of only the given fields, or None for whole documents
+    @staticmethod
+    def _projection(fields):
+        return {f: 1 for f in fields} if fields else None
 
     # Return scouting data given an event key, match key, and team key
     def scouting_match(self, event_key, match_key, team_key):
-        scouting = list(self.scouting.aggregate([{'$match': {
+        return self.match_scouting.find_one({
             'event_key': event_key,
+            'match_key': match_key,
             'team_key': team_key
-        }}, {'$project': {
-            'matches': {
-                '$filter': {
-                    'input': '$matches',
-                    'as': 'match',
-                    'cond': {
-                        '$eq': ['$$match.match_key', match_key]
-                    }
-                }
-            }
-        }}, {'$project': {
-            'match': {
-                '$arrayElemAt': ['$matches', 0]
-            }
-        }}, {'$match': {
-            'match': {'$exists': True}
-        }}]))
-        if scouting:
-            scouting = scouting[0]['match']
-            return scouting
-        else:
-            return {}
+        }, {
+            '_id': 0,
+            'modified_timestamp': 0,
+            'changed_timestamp': 0
+        }) or {}
 
-    # Upsert scouted data
+    # Upsert scouted data (through the change log, so it syncs to other instances)
     def scouting_match_update(self, data):
-        # Update if existing
-        result = self.scouting.update_one({
-            'event_key': data['event_key'],
-            'team_key': data['team_key'],
-            'matches.match_key': data['match_key']
-        }, {'$set': {
-            'matches.$': data
-        }})
-        if not result.matched_count:
-            # Insert otherwise
-            result = self.scouting.update_one({
-                'event_key': data['event_key'],
-                'team_key': data['team_key'],
-            }, {'$push': {
-                'matches': data
-            }}, upsert=True)
-        return result.upserted_id or result.matched_count or result.modified_count
+        return sharkscout.ChangeLog(self).record('match', data)
 
     def scouting_pit(self, event_key, team_key):
         scouting = list(self.scouting.aggregate([{'$match': {
@@ -448,45 +569,101 @@ class Mongo(object):
             return {}
 
     def scouting_pit_teams(self, event_key):
-        scouting = list(self.scouting.aggregate([{'$match': {
+        scouting = {t['team_key']: t for t in self.scouting_pit_teams_iter(event_key)}
+        return scouting
+
+    # Cursor of pit scouting data, for streaming
+    def scouting_pit_teams_iter(self, event_key):
+        return self.scouting.aggregate(self._scouting_pit_teams_pipeline(event_key) + [{'$sort': {
+            'team_key': 1
+        }}])
+
+    # All keys used by pit scouting data, without fetching the data
+    def scouting_pit_teams_keys(self, event_key):
+        return self._keys(self.scouting, self._scouting_pit_teams_pipeline(event_key))
+
+    def _scouting_pit_teams_pipeline(self, event_key):
+        return [{'$match': {
             'event_key': event_key
         }}, {'$match': {
             'pit': {'$exists': True}
         }}, {'$replaceRoot': {
             'newRoot': '$pit'
-        }}, {'$sort': {
-            'team_key': 1
-        }}]))
-        scouting = {t['team_key']: t for t in scouting}
-        return scouting
+        }}]
 
     def scouting_pit_update(self, data):
-        result = self.scouting.update_one({
-            'event_key': data['event_key'],
-            'team_key': data['team_key'],
-        }, {'$set': {
-            'pit': data
-        }}, upsert=True)
-        return result.upserted_id or result.matched_count or result.modified_count
+        return sharkscout.ChangeLog(self).record('pit', data)
 
-    def scouting_stats(self, event_key, matches=0):
-        event = self.event(event_key)
-        year_json = os.path.join(os.path.dirname(sys.argv[0]), 'stats', str(event['year']) + '.json')
-        if not os.path.exists(year_json):
+    # (trends: each row's chart trend lines and rolling averages as '_trends', only rendered pages show them)
+    def scouting_stats(self, event_key, matches=0, trends=False):
+        year_stats = self._scouting_stats_spec(self._event_year(event_key))
+        if year_stats is None:
             return {
                 'individual': [],
                 'scatter': []
             }
+        year_individual, year_scatter, _ = year_stats
+
+        individual = list(self.tba_events.aggregate(self._scouting_stats_pipeline(event_key, matches, year_individual)))
+        if trends:
+            sharkscout.Trends.attach(individual)
+        return {
+            'individual': individual,
+            'scatter': {
+                'axes': year_scatter['axes'],
+                'dataset': {t['_team_number']: {k: t[year_scatter['dataset'][k]] for k in year_scatter['dataset']} for t
+                            in individual}
+            } if year_scatter else year_scatter
+        }
+
+    # Cursor of individual scouting stats, for streaming
+    def scouting_stats_iter(self, event_key, matches=0):
+        year_stats = self._scouting_stats_spec(self._event_year(event_key))
+        if year_stats is None:
+            return iter([])
+        return self.tba_events.aggregate(self._scouting_stats_pipeline(event_key, matches, year_stats[0]),
+                                         allowDiskUse=True)
+
+    # Individual scouting stats keys, as declared by the year's stats spec
+    def scouting_stats_keys(self, event_key):
+        year_stats = self._scouting_stats_spec(self._event_year(event_key))
+        if year_stats is None:
+            return []
+        keys = []
+        for stage in year_stats[0]:
+            for operator, fields in stage.items():
+                if operator in ['$group', '$project', '$replaceRoot']:
+                    keys = []
+                if operator in ['$group', '$project', '$addFields', '$set'] and isinstance(fields, dict):
+                    keys += [k for k in fields if '.' not in k and fields[k] not in [0, False] and k not in keys]
+        return sorted(keys)
+
+    def _event_year(self, event_key):
+        event = self.tba_events.find_one({'key': event_key}, {'year': 1})
+        return event['year'] if event else None
+
+    # The year's stats spec from stats/<year>.json, as (individual, scatter, projection)
+    @staticmethod
+    def _scouting_stats_spec(year):
+        year_json = os.path.join(os.path.dirname(sys.argv[0]), 'stats', str(year) + '.json')
+        if year is None or not os.path.exists(year_json):
+            return None
         with open(year_json, 'r') as f:
             year_stats = hjson.load(f)
             year_individual = year_stats
             year_scatter = {}
+            year_projection = {}
             if isinstance(year_stats, dict):
                 if 'individual' in year_stats:
                     year_individual = year_stats['individual']
                 if 'scatter' in year_stats:
                     year_scatter = year_stats['scatter']
+                if 'projection' in year_stats:
+                    year_projection = year_stats['projection']
+        return year_individual, year_scatter, year_projection
 
+    @staticmethod
+    def _scouting_stats_pipeline(event_key, matches, year_individual):
         aggregation = [
             # Get matches from TBA data (so they're in order)
             {'$match': {'key': event_key}},
@@ -508,36 +685,68 @@ class Mongo(object):
                 'key': {'$concat': ['$key', '_p' + str(match_number)]},
                 'event_key': '$key'
             } for match_number in range(50)]]}}},
-            {'$unwind': '$matches'},
-            {'$replaceRoot': {'newRoot': '$matches'}},
-            # Match to scouting information, return scouting data
+            # Attach all of the event's scouting information
+            {'$lookup': {
+                'from': 'scouting_matches',
+                'localField': 'key',
+                'foreignField': 'event_key',
+                'as': 'scouted'
+            }},
             {'$lookup': {
                 'from': 'scouting',
-                'localField': 'event_key',
+                'localField': 'key',
                 'foreignField': 'event_key',
-                'as': 'scouting'
+                'as': 'pits'
+            }},
+            # One document per scouted team
+            {'$project': {
+                'key': 1,
+                'matches': 1,
+                'scouted': 1,
+                'pits': 1,
+                'team_key': {'$setUnion': ['$scouted.team_key', '$pits.team_key']}
+            }},
+            {'$unwind': '$team_key'},
+            {'$addFields': {
+                'scouted': {'$filter': {
+                    'input': '$scouted',
+                    'as': 'scouted',
+                    'cond': {'$eq': ['$$scouted.team_key', '$team_key']}
+                }},
+                'pit': {'$let': {
+                    'vars': {'pit': {'$arrayElemAt': [{'$filter': {
+                        'input': '$pits',
+                        'as': 'pit',
+                        'cond': {'$eq': ['$$pit.team_key', '$team_key']}
+                    }}, 0]}},
+                    'in': '$$pit.pit'
+                }}
             }},
-            {'$match': {'scouting': {'$ne': []}}},  # any scouting data exists at all
-            {'$unwind': '$scouting'},
-            {'$addFields': {'scouting.matches': {'$ifNull': ['$scouting.matches', [{
-                'match_key': {'$concat': ['$event_key', '_p1']},
-                'event_key': '$event_key'
-            }]]}}},  # to allow $unwind
-            {'$unwind': '$scouting.matches'},
-            {'$redact': {'$cond': {
-                'if': {'$eq': ['$key', '$scouting.matches.match_key']},
-                'then': '$$DESCEND',
-                'else': '$$PRUNE'
-            }}},
+            # Scouted matches in TBA match order (pit-only teams get a placeholder match to allow $unwind)
             {'$project': {
-                'team_key': '$scouting.team_key',
-                'pit': '$scouting.pit',
-                'match': '$scouting.matches'
+                'team_key': 1,
+                'pit': 1,
+                'matches': {'$cond': {
+                    'if': {'$eq': [{'$size': '$scouted'}, 0]},
+                    'then': [{
+                        'match_key': {'$concat': ['$key', '_p1']},
+                        'event_key': '$key'
+                    }],
+                    'else': {'$reduce': {
+                        'input': '$matches',
+                        'initialValue': [],
+                        'in': {'$concatArrays': ['$$value', {'$filter': {
+                            'input': '$scouted',
+                            'as': 'scouted',
+                            'cond': {'$eq': ['$$scouted.match_key', '$$this.key']}
+                        }}]}
+                    }}
+                }}
             }},
-            {'$group': {
+            {'$project': {
                 '_id': '$team_key',
-                'pit': {'$first': '$pit'},
-                'matches': {'$push': '$match'}
+                'pit': 1,
+                'matches': 1
             }},
             # Add in team information
             {'$lookup': {
@@ -549,12 +758,6 @@ class Mongo(object):
             {'$addFields': {
                 'team': {'$arrayElemAt': ['$team', 0]}
             }},
-            {'$group': {
-                '_id': '$_id',
-                'team': {'$first': '$team'},
-                'pit': {'$first': '$pit'},
-                'matches': {'$first': '$matches'}
-            }},
             # Run statistics groupings
             {'$addFields': {
                 'matches': {'$slice': [
@@ -575,20 +778,15 @@ class Mongo(object):
                 '_id': 1
             }}
         ])
-
-        individual = list(self.tba_events.aggregate(aggregation))
-        return {
-            'individual': individual,
-            'scatter': {
-                'axes': year_scatter['axes'],
-                'dataset': {t['_team_number']: {k: t[year_scatter['dataset'][k]] for k in year_scatter['dataset']} for t
-                            in individual}
-            } if year_scatter else year_scatter
-        }
+        return aggregation
 
     # List of all teams
     def teams(self):
-        return list(self.tba_teams.find())
+        return list(self.teams_iter())
+
+    # Cursor of all teams (only the given fields, if any), for streaming
+    def teams_iter(self, fields=None):
+        return self.tba_teams.find({}, self._projection(fields)).batch_size(self.batch_size)
 
     # List of all teams, paged
     def teams_paged(self, page, limit=500):
@@ -596,6 +794,10 @@ class Mongo(object):
         max_num = (int(page) + 1) * limit - 1
         return list(self.tba_teams.find({'team_number': {'$gte': min_num, '$lte': max_num}}))
 
+    # List of teams after a given team number, in team number order
+    def teams_after(self, team_number=0, limit=500):
+        return list(self.tba_teams.find({'team_number': {'$gt': int(team_number)}}).sort('team_number').limit(limit))
+
     # List of teams, given a set of team keys
     def teams_list(self, team_keys):
         return list(self.tba_teams.find({'key': {'$in': team_keys}}).sort('team_number'))
@@ -620,34 +822,30 @@ class Mongo(object):
     # TBA update the team listing
     def teams_update(self):
         teams = self.tba_api.teams_all(True)
-        bulk = self.tba_teams.initialize_unordered_bulk_op()
 
         # Upsert teams
-        for team in teams:
-            bulk.find({'key': team['key']}).upsert().update({
-                '$set': team,
-                '$setOnInsert': {
-                    'modified_timestamp': datetime.utcfromtimestamp(0),
-                    'created_timestamp': datetime.utcnow()
-                }
-            })
+        now = datetime.utcnow()
+        requests = [pymongo.UpdateOne({'key': team['key']}, {
+            '$set': dict(team, modified_timestamp=now),
+            '$setOnInsert': {
+                'updated_timestamp': datetime.utcfromtimestamp(0),  # never fully updated
+                'created_timestamp': now
+            }
+        }, upsert=True) for team in teams]
         # Delete teams that no longer exist
         if teams:
             missing = [t['key'] for t in self.tba_teams.find({
                 'key': {'$nin': [t['key'] for t in teams]}
-            })]
+            }, {'key': 1})]
             if missing:
-                bulk.find({'key': {'$in': missing}}).remove()
-        try:
-            bulk.execute()
-        except pymongo.errors.InvalidOperation:
-            pass  # "No operations to execute"
+                requests.append(pymongo.DeleteMany({'key': {'$in': missing}}))
+        if requests:
+            self.tba_teams.bulk_write(requests, ordered=False)
 
     # Team information
     def team(self, team_key, year=None):
-        team = list(self.tba_teams.find({'key': team_key}))
+        team = self.tba_teams.find_one({'key': team_key})
         if team:
-            team = team[0]
             if year is not None:
                 team['events'] = self.team_events(team_key, year)
             return team
@@ -665,7 +863,7 @@ class Mongo(object):
                     team['website'] if 'website' in team else '') if update_favicon else None,
                 'media': self.tba_api.team_media(team_key)
             }.items() if v})
-            team['modified_timestamp'] = datetime.utcnow()
+            team['modified_timestamp'] = team['updated_timestamp'] = datetime.utcnow()
             self.tba_teams.update_one({
                 'key': team_key
             }, {
@@ -0,0 +1,291 @@
+import sys
+import time
+
+import cProfile
+import cherrypy
+import collections
+import contextlib
+import html
+import io
+import os
+import pstats
+import pymongo.errors
+import pymongo.monitoring
+import queue
+import threading
+from datetime import datetime
+
+import sharkscout
+
+
+# Mongo command monitoring: every command's duration, documents returned and the SharkScout method that issued it,
+#  summed per HTTP request (Server-Timing header) and kept in a rolling report (/queries). Slow commands are logged
+#  with their explain plan, which is fetched in the background so the slow request isn't made any slower.
+class QueryProfiler(pymongo.monitoring.CommandListener):
+    slow_ms = 100
+    explained = ['aggregate', 'count', 'delete', 'distinct', 'find', 'findAndModify', 'update']
+    ignored = ['buildInfo', 'endSessions', 'explain', 'hello', 'isMaster', 'ismaster', 'ping', 'saslContinue',
+               'saslStart', 'serverStatus']
+
+    # Class-level, shared by every client and request. Don't rebind these!
+    methods = {}  # {caller: [commands, total ms, max ms, documents]}
+    requests = collections.deque(maxlen=100)  # recent HTTP requests
+    slow = collections.deque(maxlen=50)  # recent slow commands, with their explain plans
+    lock = threading.Lock()
+    explain_queue = queue.Queue(maxsize=100)
+    explain_thread = None
+
+    def __init__(self):
+        self.pending = {}  # {request_id: (caller, command_name, database_name, command)}
+
+    def started(self, event):
+        if event.command_name in self.ignored:
+            return
+        command = dict(event.command) if event.command_name in self.explained else None
+        self.pending[event.request_id] = (self.caller(), event.command_name, event.database_name, command)
+
+    def succeeded(self, event):
+        pending = self.pending.pop(event.request_id, None)
+        if pending is not None:
+            self.record(pending, event.duration_micros / 1000, self.documents(event.reply))
+
+    def failed(self, event):
+        pending = self.pending.pop(event.request_id, None)
+        if pending is not None:
+            self.record(pending, event.duration_micros / 1000, 0)
+
+    # The innermost SharkScout method (outside of this module) on the stack
+    @staticmethod
+    def caller():
+        frame = sys._getframe(2)
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if module.startswith('sharkscout.') and module != __name__:
+                instance = frame.f_locals.get('self')
+                return (type(instance).__name__ + '.' if instance is not None else '') + frame.f_code.co_name
+            frame = frame.f_back
+        return '?'
+
+    @staticmethod
+    def documents(reply):
+        if 'cursor' in reply:
+            return len(reply['cursor'].get('firstBatch', reply['cursor'].get('nextBatch', [])))
+        if 'values' in reply:  # distinct
+            return len(reply['values'])
+        if 'value' in reply:  # findAndModify
+            return 1 if reply['value'] is not None else 0
+        return reply.get('n', 0)
+
+    def record(self, pending, ms, documents):
+        caller, command_name, database_name, command = pending
+        with self.lock:
+            method = self.methods.setdefault(caller, [0, 0.0, 0.0, 0])
+            method[0] += 1
+            method[1] += ms
+            method[2] = max(method[2], ms)
+            method[3] += documents
+
+        # Only real HTTP requests have an app, background threads have a placeholder request
+        request = cherrypy.serving.request
+        if request.app is not None:
+            if not hasattr(request, 'mongo_commands'):
+                request.mongo_commands = []
+            request.mongo_commands.append((caller, command_name, ms, documents))
+            if getattr(request, 'profiler', None) is not None:
+                request.profiler.add('db', ms / 1000)
+
+        if ms >= self.slow_ms:
+            if self.__class__.explain_thread is None:
+                self.__class__.explain_thread = threading.Thread(target=self.explain, name='QueryProfiler',
+                                                                 daemon=True)
+                self.__class__.explain_thread.start()
+            try:
+                self.explain_queue.put_nowait((caller, command_name, database_name, command, ms, documents))
+            except queue.Full:
+                pass
+
+    @classmethod
+    def explain(cls):
+        while True:
+            caller, command_name, database_name, command, ms, documents = cls.explain_queue.get()
+            plan = None
+            if command is not None:
+                # Session and cluster fields can't be sent again
+                command = {k: v for k, v in command.items() if not k.startswith('$') and k not in ['lsid', 'txnNumber']}
+                try:
+                    plan = cls.summary(sharkscout.Mongo.client[database_name].command('explain', command,
+                                                                                       verbosity='queryPlanner'))
+                except pymongo.errors.PyMongoError as e:
+                    plan = repr(e)
+            collection = command.get(command_name) if command else None
+            cls.slow.append({
+                'timestamp': datetime.utcnow(),
+                'caller': caller,
+                'command': command_name,
+                'collection': collection if isinstance(collection, str) else None,
+                'ms': ms,
+                'documents': documents,
+                'plan': plan
+            })
+            cherrypy.log('Slow mongo ' + command_name + ' from ' + caller + ': ' + '{:.1f}'.format(ms) + ' ms, ' +
+                         str(documents) + ' documents' + (', plan: ' + plan if plan else ''))
+
+    # Winning plan as "FETCH <- IXSCAN event_key_1"
+    @staticmethod
+    def summary(explain):
+        if 'stages' in explain:  # aggregations that couldn't be entirely pushed down to the query layer
+            explain = explain['stages'][0].get('$cursor', {})
+        plan = explain.get('queryPlanner', {}).get('winningPlan', {})
+        plan = plan.get('queryPlan', plan)  # slot-based execution engine
+        stages = []
+        while plan:
+            stages.append(plan.get('stage', '?') + (' ' + plan['indexName'] if 'indexName' in plan else ''))
+            plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+        return ' <- '.join(stages)
+
+    # CherryPy 'before_finalize' hook: summarize the request's commands
+    @classmethod
+    def finalize(cls):
+        request = cherrypy.serving.request
+        commands = getattr(request, 'mongo_commands', [])
+        ms = sum([c[2] for c in commands])
+        cherrypy.serving.response.headers['Server-Timing'] = 'mongo;dur={:.1f};desc="{} commands"'.format(
+            ms, len(commands))
+        slowest = max(commands, key=lambda c: c[2]) if commands else None
+        cls.requests.append({
+            'timestamp': datetime.utcnow(),
+            'path': request.path_info,
+            'commands': len(commands),
+            'ms': ms,
+            'documents': sum([c[3] for c in commands]),
+            'slowest': slowest[0] + ' (' + slowest[1] + ')' if slowest else None
+        })
+
+    @classmethod
+    def report(cls):
+        with cls.lock:
+            methods = [{
+                'caller': caller,
+                'commands': m[0],
+                'ms': m[1],
+                'mean_ms': m[1] / m[0],
+                'max_ms': m[2],
+                'documents': m[3]
+            } for caller, m in cls.methods.items()]
+        return {
+            'methods': sorted(methods, key=lambda m: -m['ms']),
+            'requests': list(reversed(cls.requests)),
+            'slow': list(reversed(cls.slow)),
+            'slow_ms': cls.slow_ms
+        }
+
+
+# Debug-only (--profile) timing of one request, asked for with ?profile=<mode> or an X-SharkScout-Profile header:
+#  "timing" adds a Server-Timing breakdown (handler, db, template generate, filters, serialize, compress), "report"
+#  returns a cProfile report instead of the page, "flame" returns sampled stacks in the collapsed format that
+#  flamegraph.pl and speedscope read.
+class RequestProfiler(object):
+    enabled = False
+    modes = ['timing', 'report', 'flame']
+    sample_interval = 0.001  # seconds, flame mode
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.phases = {}  # {phase: seconds}, exclusive of nested phases
+        self.stack = [['handler', time.perf_counter()]]  # [[phase, running since]], innermost last
+        self.profile = None
+        self.samples = collections.Counter()
+
+    @staticmethod
+    def active():
+        return getattr(cherrypy.serving.request, 'profiler', None)
+
+    # CherryPy 'before_handler' hook
+    @classmethod
+    def request_start(cls):
+        request = cherrypy.serving.request
+        mode = request.params.pop('profile', None) or request.headers.get('X-SharkScout-Profile')
+        if not cls.enabled or not mode:
+            return
+        request.profiler = cls(mode if mode in cls.modes else 'timing')
+        if request.profiler.mode != 'timing' and request.handler is not None:
+            request.handler = request.profiler.wrap(request.handler)
+        request.hooks.attach('before_finalize', request.profiler.report, priority=70)  # before gzip
+        request.hooks.attach('before_finalize', request.profiler.finish, priority=90)  # after gzip
+
+    def _credit(self, now):
+        name, since = self.stack[-1]
+        self.phases[name] = self.phases.get(name, 0) + now - since
+        self.stack[-1][1] = now
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._credit(time.perf_counter())
+        self.stack.append([name, time.perf_counter()])
+        try:
+            yield
+        finally:
+            self._credit(time.perf_counter())
+            self.stack.pop()
+            self.stack[-1][1] = time.perf_counter()
+
+    # Time spent elsewhere (e.g. reported by the QueryProfiler), taken out of the running phase
+    def add(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0) + seconds
+        self.stack[-1][1] += seconds
+
+    def wrap(self, handler):
+        def profiled():
+            if self.mode == 'report':
+                self.profile = cProfile.Profile()
+                return self.profile.runcall(handler)
+
+            thread = threading.get_ident()
+            stopped = threading.Event()
+
+            def sample():
+                while not stopped.wait(self.sample_interval):
+                    frame = sys._current_frames().get(thread)
+                    stack = []
+                    while frame is not None:
+                        stack.append(os.path.basename(frame.f_code.co_filename) + ':' + frame.f_code.co_name)
+                        frame = frame.f_back
+                    self.samples[';'.join(reversed(stack))] += 1
+
+            # The sampler can't run any more often than threads switch (default: every 5ms)
+            switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(switch_interval, self.sample_interval))
+            sampler = threading.Thread(target=sample, name='RequestProfiler', daemon=True)
+            sampler.start()
+            try:
+                return handler()
+            finally:
+                stopped.set()
+                sampler.join()
+                sys.setswitchinterval(switch_interval)
+
+        profiled.oldhandler = handler
+        return profiled
+
+    # Replace the page with the report
+    def report(self):
+        response = cherrypy.serving.response
+        if self.mode == 'report' and self.profile is not None:
+            stats = io.StringIO()
+            pstats.Stats(self.profile, stream=stats).sort_stats('cumulative').print_stats(80)
+            response.body = ('<!DOCTYPE html><html><body><pre>' + html.escape(stats.getvalue()) +
+                             '</pre></body></html>').encode('utf-8')
+            response.headers['Content-Type'] = 'text/html;charset=utf-8'
+        elif self.mode == 'flame':
+            response.body = '\n'.join([s + ' ' + str(c) for s, c in sorted(self.samples.items())]).encode('utf-8')
+            response.headers['Content-Type'] = 'text/plain;charset=utf-8'
+        response.headers.pop('ETag', None)
+
+    def finish(self):
+        response = cherrypy.serving.response
+        # Bodies are encoded and compressed lazily, do it now so it's timed
+        with self.phase('compress'):
+            response.collapse_body()
+        self._credit(time.perf_counter())
+        timing = ', '.join([n + ';dur={:.1f}'.format(s * 1000) for n, s in self.phases.items()])
+        response.headers['Server-Timing'] = ', '.join([t for t in [response.headers.get('Server-Timing'), timing] if t])
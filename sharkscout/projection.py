@@ -0,0 +1,252 @@
+import collections
+import hashlib
+import numpy
+import re
+import threading
+
+
+# Monte Carlo projection of the rest of an event's qualification schedule: every remaining match is played thousands
+#  of times at once as NumPy arrays, alliance scores drawn from their teams' score distributions (OPR, blended with
+#  points from scouting stats while a team has played few matches), ranking points tallied with the year's bonuses and
+#  tiebreakers from its stats spec, and every team's final rank counted across all runs.
+class Projection(object):
+    iterations = 10000
+    seed = 0  # the same inputs always give the same projection
+    captains = 8
+    prior_matches = 6  # matches played before a team's OPR counts as much as its scouting stats
+    max_inflation = 3  # of the residual variance, early in an event
+    defaults = {'win': 2, 'tie': 1, 'bonus': [], 'tiebreakers': [], 'points': {}}
+    limit = 32  # events kept, least recently asked for dropped first
+
+    # Class-level, shared by every request. Don't rebind these!
+    cache = collections.OrderedDict()  # {event_key: (version, projection)}
+    lock = threading.Lock()
+
+    def __init__(self, event, ratings, stats, spec=None):
+        self.event = event
+        self.spec = dict(self.defaults, **(spec or {}))
+
+        matches = [m for m in event.get('matches', []) if m.get('comp_level') == 'qm' and
+                   all(['team_keys' in a for a in m.get('alliances', {}).values()])]
+        self.played = [m for m in matches if self.scored(m)]
+        self.remaining = [m for m in matches if not self.scored(m)]
+        self.teams = sorted(set([t for m in matches for a in m['alliances'].values() for t in a['team_keys']]),
+                                key=lambda t: int(re.sub(r'[^0-9]', '', t) or 0))
+        self.columns = {t: i for i, t in enumerate(self.teams)}
+
+        self.tally()
+        self.distributions(ratings, stats)
+        self.schedule()
+
+    @staticmethod
+    def scored(match):
+        scores = [a.get('score') for a in match['alliances'].values()]
+        return len(scores) == 2 and None not in scores and min(scores) >= 0
+
+    @staticmethod
+    def playing(alliance):
+        return [t for t in alliance['team_keys'] if t not in (alliance.get('surrogate_team_keys') or [])]
+
+    # Ranking points, matches and tiebreakers so far
+    def tally(self):
+        teams = len(self.teams)
+        self.rp = numpy.zeros(teams)
+        self.matches = numpy.zeros(teams)
+        self.tiebreakers = numpy.zeros((len(self.spec['tiebreakers']), teams))
+        for match in self.played:
+            for color, alliance in match['alliances'].items():
+                opponent = [a for c, a in match['alliances'].items() if c != color][0]
+                breakdown = (match.get('score_breakdown') or {}).get(color) or {}
+                if 'rp' in breakdown:
+                    rp = breakdown['rp']
+                else:
+                    rp = self.spec['win'] if alliance['score'] > opponent['score'] else \
+                        self.spec['tie'] if alliance['score'] == opponent['score'] else 0
+                    rp += sum([int(bool(breakdown.get(b))) for b in self.spec['bonus']])
+                index = [self.columns[t] for t in self.playing(alliance)]
+                self.rp[index] += rp
+                self.matches[index] += 1
+                for idx, fields in enumerate(self.spec['tiebreakers']):
+                    self.tiebreakers[idx][index] += sum([breakdown.get(f) or 0 for f in fields])
+
+        # TBA's rankings know about DQs and adjustments that the matches don't show
+        rankings = self.event.get('rankings') or {}
+        self.ranks = {}
+        for team_key, column in self.columns.items():
+            ranking = rankings.get(team_key) or rankings.get(re.sub(r'[^0-9]', '', team_key))
+            if ranking:
+                self.ranks[team_key] = ranking.get('rank')
+                if 'ranking_score' in ranking and ranking.get('played'):
+                    self.rp[column] = ranking['ranking_score'] * ranking['played']
+                    self.matches[column] = ranking['played']
+
+    # Every team's score contribution (mean and variance), bonus ranking point and tiebreaker contributions
+    def distributions(self, ratings, stats):
+        teams = len(self.teams)
+        components = ratings.get('components', {})
+        oprs = ratings.get('oprs', {})
+        opr = numpy.array([oprs.get(t, numpy.nan) for t in self.teams])
+
+        points = numpy.full(teams, numpy.nan)
+        for row in stats:
+            if row.get('_id') in self.columns and self.spec['points']:
+                values = [row.get(k) for k in self.spec['points']]
+                if [v for v in values if isinstance(v, (int, float))]:
+                    points[self.columns[row['_id']]] = sum([w * (v or 0) for w, v in
+                                                            zip(self.spec['points'].values(), values)])
+
+        # OPR, pulled toward scouting points (or the average team) by how few matches it's from
+        known = numpy.concatenate([opr[~numpy.isnan(opr)], points[~numpy.isnan(points)]])
+        scores = [a['score'] for m in self.played for a in m['alliances'].values()]
+        average = known.mean() if len(known) else (numpy.mean(scores) / 3 if scores else 0)
+        prior = numpy.where(numpy.isnan(points), average, points)
+        weight = self.matches / (self.matches + self.prior_matches)
+        self.mean = numpy.where(numpy.isnan(opr), prior, weight * opr + (1 - weight) * prior)
+
+        # Variance from how far played alliances were from their teams' means, shrunk toward the event's
+        squares = numpy.zeros(teams)
+        counts = numpy.zeros(teams)
+        for match in self.played:
+            for alliance in match['alliances'].values():
+                index = [self.columns[t] for t in alliance['team_keys']]
+                squares[index] += (alliance['score'] - self.mean[index].sum()) ** 2 / 3
+                counts[index] += 1
+        overall = squares.sum() / counts.sum() if counts.sum() else (0.35 * max(average, 1)) ** 2
+        # OPRs were fit to those same alliances, so their residuals understate how far the next ones will be
+        rows = counts.sum() / 3
+        rated = len([t for t in self.teams if t in oprs])
+        inflation = min(rows / (rows - rated), self.max_inflation) if rows > rated else self.max_inflation
+        squares *= inflation
+        overall *= inflation
+        self.variance = (squares + self.prior_matches * overall) / (counts + self.prior_matches)
+        # How far off the mean itself might be, with few matches it's most of the uncertainty
+        self.uncertainty = 3 * self.variance / (self.matches + self.prior_matches)
+
+        self.bonus = numpy.array([[components.get('breakdown.' + b, {}).get(t, 0) for t in self.teams]
+                                  for b in self.spec['bonus']]).reshape(len(self.spec['bonus']), teams)
+        self.expected_tiebreakers = numpy.array([[sum([components.get('breakdown.' + f, {}).get(t, 0) for f in fields])
+                                                  for t in self.teams] for fields in self.spec['tiebreakers']]).reshape(
+            len(self.spec['tiebreakers']), teams)
+
+    # Remaining matches as team index arrays (padded with an empty team) and team membership matrices
+    def schedule(self):
+        teams = len(self.teams)
+        size = max([len(a['team_keys']) for m in self.remaining for a in m['alliances'].values()] or [0])
+        self.alliances = {}
+        self.members = {}
+        for color in ['red', 'blue']:
+            self.alliances[color] = numpy.full((len(self.remaining), size), teams)
+            self.members[color] = numpy.zeros((len(self.remaining), teams), dtype=numpy.float32)
+            for idx, match in enumerate(self.remaining):
+                alliance = match['alliances'].get(color, {'team_keys': []})
+                self.alliances[color][idx, :len(alliance['team_keys'])] = [self.columns[t] for t in
+                                                                           alliance['team_keys']]
+                self.members[color][idx, [self.columns[t] for t in self.playing(alliance)]] = 1
+
+    # Changes whenever anything the projection depends on does
+    def version(self, iterations):
+        digest = hashlib.md5(str((iterations, self.teams, [m['key'] for m in self.remaining],
+                                  self.members['red'].shape, self.spec)).encode('utf-8'))
+        for array in [self.rp, self.matches, self.tiebreakers, self.mean, self.variance, self.bonus,
+                      self.expected_tiebreakers, self.uncertainty, self.alliances['red'], self.alliances['blue']]:
+            digest.update(numpy.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def run(self, iterations):
+        random = numpy.random.default_rng(self.seed)
+        teams = len(self.teams)
+        mean = numpy.append(self.mean, 0)
+        variance = numpy.append(self.variance, 0)
+        bonus = numpy.append(self.bonus, numpy.zeros((len(self.bonus), 1)), axis=1)
+        expected_tiebreakers = numpy.append(self.expected_tiebreakers,
+                                            numpy.zeros((len(self.expected_tiebreakers), 1)), axis=1)
+
+        scores = {}
+        rp = numpy.tile(self.rp.astype(numpy.float32), (iterations, 1))
+        tiebreakers = numpy.tile(self.tiebreakers.astype(numpy.float32)[:, None, :], (1, iterations, 1))
+        # Every run draws how good each team really is, then how well each of its alliances did
+        strength = mean + numpy.append(numpy.sqrt(self.uncertainty), 0) * random.standard_normal((iterations,
+                                                                                                  teams + 1))
+        for color in ['red', 'blue']:
+            alliance_sd = numpy.sqrt(variance[self.alliances[color]].sum(axis=1))
+            scores[color] = numpy.maximum(0, numpy.rint(strength[:, self.alliances[color]].sum(axis=2) + random.normal(
+                0, alliance_sd, (iterations, len(self.remaining)))))
+        for color, opponent in [('red', 'blue'), ('blue', 'red')]:
+            alliance_rp = self.spec['win'] * (scores[color] > scores[opponent]) + \
+                self.spec['tie'] * (scores[color] == scores[opponent])
+            for idx in range(len(self.bonus)):
+                chance = numpy.clip(bonus[idx][self.alliances[color]].sum(axis=1), 0, 1)
+                alliance_rp = alliance_rp + (random.random((iterations, len(self.remaining))) < chance)
+            rp += alliance_rp.astype(numpy.float32) @ self.members[color]
+            # Tiebreakers follow the alliance's score
+            alliance_mean = mean[self.alliances[color]].sum(axis=1)
+            ratio = (scores[color] / numpy.where(alliance_mean > 0, alliance_mean, 1)).astype(numpy.float32)
+            for idx in range(len(expected_tiebreakers)):
+                tiebreakers[idx] += (ratio * expected_tiebreakers[idx][self.alliances[color]].sum(axis=1)) @ \
+                    self.members[color]
+
+        played = self.matches + self.members['red'].sum(axis=0) + self.members['blue'].sum(axis=0)
+        ranking_score = numpy.round(rp / numpy.maximum(played, 1), 2)
+        # Sorted by ranking score, then each tiebreaker (numpy.lexsort's last key is its primary one)
+        order = numpy.lexsort([numpy.tile(numpy.arange(teams), (iterations, 1))] +
+                              [-t for t in tiebreakers[::-1]] + [-ranking_score], axis=-1)
+        ranks = numpy.empty_like(order)
+        numpy.put_along_axis(ranks, order, numpy.arange(teams), axis=1)
+        distribution = numpy.bincount((numpy.arange(teams) * teams + ranks).ravel(),
+                                      minlength=teams * teams).reshape(teams, teams) / iterations
+        return scores, ranking_score, distribution
+
+    def result(self, iterations):
+        scores, ranking_score, distribution = self.run(iterations)
+        cumulative = numpy.cumsum(distribution, axis=1)
+        positions = numpy.arange(1, len(self.teams) + 1)
+        teams = [{
+            'team_key': team_key,
+            'team_number': int(re.sub(r'[^0-9]', '', team_key) or 0),
+            'rank': self.ranks.get(team_key),
+            'ranking_score': round(float(self.rp[idx] / self.matches[idx]), 2) if self.matches[idx] else 0,
+            'projected_ranking_score': round(float(ranking_score[:, idx].mean()), 2),
+            'mean_rank': round(float(distribution[idx] @ positions), 2),
+            'best_rank': int(numpy.searchsorted(cumulative[idx], 0.1, side='right')) + 1,
+            'worst_rank': int(numpy.searchsorted(cumulative[idx], 0.9, side='right')) + 1,
+            'first': round(float(distribution[idx][0]), 3),
+            'captain': round(float(cumulative[idx][min(self.captains, len(self.teams)) - 1]), 3),
+            'ranks': [round(float(p), 3) for p in distribution[idx]]
+        } for idx, team_key in enumerate(self.teams)]
+        matches = [{
+            'key': match['key'],
+            'match_number': match.get('match_number'),
+            'alliances': {c: match['alliances'][c]['team_keys'] for c in match['alliances']},
+            'red_score': round(float(scores['red'][:, idx].mean()), 1),
+            'blue_score': round(float(scores['blue'][:, idx].mean()), 1),
+            'red': round(float((scores['red'][:, idx] > scores['blue'][:, idx]).mean()), 3),
+            'blue': round(float((scores['blue'][:, idx] > scores['red'][:, idx]).mean()), 3)
+        } for idx, match in enumerate(self.remaining)]
+        return {
+            'iterations': iterations,
+            'played': len(self.played),
+            'remaining': len(self.remaining),
+            'teams': sorted(teams, key=lambda t: t['mean_rank']),
+            'matches': matches
+        }
+
+    # The projection of an event (from Mongo.event()), reused until its matches, rankings, ratings or stats change
+    @classmethod
+    def project(cls, event, ratings, stats, spec=None, iterations=None):
+        iterations = iterations or cls.iterations
+        projection = cls(event, ratings, stats, spec)
+        if not projection.teams:
+            return {}
+        version = projection.version(iterations)
+        with cls.lock:
+            cached = cls.cache.get(event['key'])
+            if cached is not None and cached[0] == version:
+                cls.cache.move_to_end(event['key'])
+                return cached[1]
+        result = projection.result(iterations)
+        with cls.lock:
+            cls.cache[event['key']] = (version, result)
+            cls.cache.move_to_end(event['key'])
+            while len(cls.cache) > cls.limit:
+                cls.cache.popitem(last=False)
+        return result
@@ -0,0 +1,378 @@
+import bson
+import copy
+import functools
+import pymongo.errors
+import re
+from datetime import datetime
+
+import sharkscout
+
+
+# MongoDB query, update, projection, and sort semantics for plain Python documents
+#  (the subset SharkScout issues, used by the embedded storage backend)
+class Query(object):
+    # Stand-in for a field that doesn't exist, distinct from None (null)
+    MISSING = type('Missing', (object,), {'__repr__': lambda self: 'MISSING', '__bool__': lambda self: False})()
+
+    # ----- Values -----
+
+    # BSON comparison order of types
+    @staticmethod
+    def bracket(value):
+        if value is Query.MISSING:
+            return 0
+        if value is None:
+            return 1
+        if isinstance(value, bool):
+            return 8
+        if isinstance(value, (int, float)):
+            return 2
+        if isinstance(value, str):
+            return 3
+        if isinstance(value, dict):
+            return 4
+        if isinstance(value, (list, tuple)):
+            return 5
+        if isinstance(value, bytes):
+            return 6
+        if isinstance(value, bson.ObjectId):
+            return 7
+        if isinstance(value, datetime):
+            return 9
+        return 11
+
+    @staticmethod
+    def compare(a, b):
+        bracket_a = Query.bracket(a)
+        bracket_b = Query.bracket(b)
+        if bracket_a != bracket_b:
+            return -1 if bracket_a < bracket_b else 1
+        if bracket_a == 4:
+            for (key_a, value_a), (key_b, value_b) in zip(a.items(), b.items()):
+                result = Query.compare(key_a, key_b) or Query.compare(value_a, value_b)
+                if result:
+                    return result
+            return Query.compare(len(a), len(b))
+        if bracket_a == 5:
+            for value_a, value_b in zip(a, b):
+                result = Query.compare(value_a, value_b)
+                if result:
+                    return result
+            return Query.compare(len(a), len(b))
+        if bracket_a in [0, 1]:
+            return 0
+        if bracket_a == 11:
+            a, b = str(a), str(b)
+        return (a > b) - (a < b)
+
+    @staticmethod
+    def equal(a, b):
+        return Query.compare(a, b) == 0
+
+    # Value of a dotted path, without traversing arrays
+    @staticmethod
+    def get(doc, path):
+        value = doc
+        for part in path.split('.'):
+            if isinstance(value, dict) and part in value:
+                value = value[part]
+            elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+                value = value[int(part)]
+            else:
+                return Query.MISSING
+        return value
+
+    # All values a dotted path can refer to, traversing arrays like MongoDB does
+    @staticmethod
+    def values(doc, path):
+        parts = path.split('.')
+
+        def walk(value, idx):
+            if idx == len(parts):
+                return [value]
+            part = parts[idx]
+            if isinstance(value, dict):
+                return walk(value[part], idx + 1) if part in value else []
+            if isinstance(value, list):
+                found = []
+                if part.isdigit() and int(part) < len(value):
+                    found += walk(value[int(part)], idx + 1)
+                for item in value:
+                    if isinstance(item, dict):
+                        found += walk(item, idx + 1)
+                return found
+            return []
+
+        return walk(doc, 0)
+
+    # Whether a dotted path crosses or ends at an array (a "multikey" path in MongoDB terms)
+    @staticmethod
+    def multikey(doc, path):
+        value = doc
+        for part in path.split('.'):
+            if isinstance(value, list):
+                return True
+            if not isinstance(value, dict) or part not in value:
+                return False
+            value = value[part]
+        return isinstance(value, list)
+
+    @staticmethod
+    def set(doc, path, value):
+        parts = path.split('.')
+        node = doc
+        for part in parts[:-1]:
+            if isinstance(node, list) and part.isdigit():
+                node = node[int(part)]
+                continue
+            if part not in node or not isinstance(node[part], (dict, list)):
+                node[part] = {}
+            node = node[part]
+        if isinstance(node, list) and parts[-1].isdigit():
+            idx = int(parts[-1])
+            node.extend([None] * (idx + 1 - len(node)))
+            node[idx] = value
+        else:
+            node[parts[-1]] = value
+
+    @staticmethod
+    def unset(doc, path):
+        parts = path.split('.')
+        node = Query.get(doc, '.'.join(parts[:-1])) if len(parts) > 1 else doc
+        if isinstance(node, dict):
+            node.pop(parts[-1], None)
+        elif isinstance(node, list) and parts[-1].isdigit() and int(parts[-1]) < len(node):
+            node[int(parts[-1])] = None
+
+    # ----- Filters -----
+
+    @staticmethod
+    def match(doc, filter):
+        for key, condition in (filter or {}).items():
+            if key == '$and':
+                if not all(Query.match(doc, f) for f in condition):
+                    return False
+            elif key == '$or':
+                if not any(Query.match(doc, f) for f in condition):
+                    return False
+            elif key == '$nor':
+                if any(Query.match(doc, f) for f in condition):
+                    return False
+            elif key == '$expr':
+                if not sharkscout.Aggregation.truthy(sharkscout.Aggregation.evaluate(condition, doc)):
+                    return False
+            elif key.startswith('$'):
+                raise pymongo.errors.OperationFailure('unknown top level operator: ' + key)
+            elif not Query._match_field(doc, key, condition):
+                return False
+        return True
+
+    @staticmethod
+    def _operators(condition):
+        return isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition)
+
+    @staticmethod
+    def _match_field(doc, path, condition):
+        if Query._operators(condition):
+            options = condition.get('$options', '')
+            return all(Query._match_operator(doc, path, op, arg, options)
+                       for op, arg in condition.items() if op != '$options')
+        if isinstance(condition, re.Pattern):
+            return Query._match_operator(doc, path, '$regex', condition, '')
+        return Query._match_equal(doc, path, condition)
+
+    # Candidate values for comparisons, array elements are compared individually as well as the array itself
+    @staticmethod
+    def _candidates(doc, path):
+        candidates = []
+        for value in Query.values(doc, path):
+            if isinstance(value, list):
+                candidates += value
+            candidates.append(value)
+        return candidates
+
+    @staticmethod
+    def _match_equal(doc, path, value):
+        candidates = Query._candidates(doc, path)
+        if value is None:
+            return not candidates or any(c is None for c in candidates)
+        return any(Query.equal(c, value) for c in candidates)
+
+    @staticmethod
+    def _match_operator(doc, path, op, arg, options=''):
+        if op == '$eq':
+            return Query._match_equal(doc, path, arg)
+        if op == '$ne':
+            return not Query._match_equal(doc, path, arg)
+        if op in ['$gt', '$gte', '$lt', '$lte']:
+            for candidate in Query._candidates(doc, path):
+                if Query.bracket(candidate) != Query.bracket(arg):
+                    continue
+                result = Query.compare(candidate, arg)
+                if (op == '$gt' and result > 0) or (op == '$gte' and result >= 0) or \
+                        (op == '$lt' and result < 0) or (op == '$lte' and result <= 0):
+                    return True
+            return False
+        if op == '$in':
+            return any(Query._match_field(doc, path, a if isinstance(a, re.Pattern) else {'$eq': a}) for a in arg)
+        if op == '$nin':
+            return not Query._match_operator(doc, path, '$in', arg)
+        if op == '$exists':
+            return bool(Query.values(doc, path)) == bool(arg)
+        if op == '$size':
+            return any(isinstance(v, list) and len(v) == arg for v in Query.values(doc, path))
+        if op == '$all':
+            return bool(arg) and all(Query._match_equal(doc, path, a) for a in arg)
+        if op == '$elemMatch':
+            for value in Query.values(doc, path):
+                if isinstance(value, list):
+                    for item in value:
+                        if Query._operators(arg):
+                            if Query._match_field({'item': item}, 'item', arg):
+                                return True
+                        elif isinstance(item, dict) and Query.match(item, arg):
+                            return True
+            return False
+        if op == '$not':
+            return not Query._match_field(doc, path, arg)
+        if op == '$regex':
+            if not isinstance(arg, re.Pattern):
+                flags = 0
+                for option, flag in [('i', re.IGNORECASE), ('m', re.MULTILINE), ('s', re.DOTALL), ('x', re.VERBOSE)]:
+                    if option in options:
+                        flags |= flag
+                arg = re.compile(arg, flags)
+            return any(isinstance(c, str) and arg.search(c) for c in Query._candidates(doc, path))
+        raise pymongo.errors.OperationFailure('unknown operator: ' + op)
+
+    # Fields an upsert starts with, from the filter's equality conditions
+    @staticmethod
+    def seed(filter):
+        doc = {}
+        for key, condition in (filter or {}).items():
+            if key == '$and':
+                for f in condition:
+                    for k, v in Query.seed(f).items():
+                        doc[k] = v
+            elif key.startswith('$'):
+                continue
+            elif Query._operators(condition):
+                if '$eq' in condition:
+                    Query.set(doc, key, copy.deepcopy(condition['$eq']))
+            elif not isinstance(condition, re.Pattern):
+                Query.set(doc, key, copy.deepcopy(condition))
+        return doc
+
+    # ----- Updates -----
+
+    # Apply an update document in place, returning whether anything changed
+    @staticmethod
+    def update(doc, update, inserting=False):
+        before = copy.deepcopy(doc)
+
+        # Replacement document
+        if not any(k.startswith('$') for k in update):
+            _id = doc.get('_id', Query.MISSING)
+            doc.clear()
+            doc.update(copy.deepcopy(update))
+            if _id is not Query.MISSING:
+                doc['_id'] = _id
+            return doc != before
+
+        for op, fields in update.items():
+            for path, arg in fields.items():
+                arg = copy.deepcopy(arg)
+                current = Query.get(doc, path)
+                if op == '$set':
+                    Query.set(doc, path, arg)
+                elif op == '$setOnInsert':
+                    if inserting:
+                        Query.set(doc, path, arg)
+                elif op == '$unset':
+                    Query.unset(doc, path)
+                elif op == '$inc':
+                    Query.set(doc, path, (0 if current is Query.MISSING else current) + arg)
+                elif op in ['$min', '$max']:
+                    if current is Query.MISSING or (Query.compare(arg, current) < 0) == (op == '$min') and \
+                            not Query.equal(arg, current):
+                        Query.set(doc, path, arg)
+                elif op in ['$push', '$addToSet']:
+                    if current is Query.MISSING:
+                        current = []
+                        Query.set(doc, path, current)
+                    if not isinstance(current, list):
+                        raise pymongo.errors.WriteError('The field \'' + path + '\' must be an array')
+                    items = arg['$each'] if isinstance(arg, dict) and '$each' in arg else [arg]
+                    for item in items:
+                        if op == '$push' or not any(Query.equal(item, c) for c in current):
+                            current.append(item)
+                elif op == '$pull':
+                    if isinstance(current, list):
+                        if Query._operators(arg):
+                            kept = [c for c in current if not Query._match_field({'item': c}, 'item', arg)]
+                        elif isinstance(arg, dict):
+                            kept = [c for c in current if not (isinstance(c, dict) and Query.match(c, arg))]
+                        else:
+                            kept = [c for c in current if not Query.equal(c, arg)]
+                        current[:] = kept
+                else:
+                    raise pymongo.errors.WriteError('Unknown modifier: ' + op)
+        return doc != before
+
+    # ----- Projections -----
+
+    @staticmethod
+    def project(doc, projection):
+        if not projection:
+            return doc
+        if isinstance(projection, (list, tuple)):
+            projection = {k: 1 for k in projection}
+
+        include_id = projection.get('_id', 1)
+        fields = {k: v for k, v in projection.items() if k != '_id'}
+        if fields and all(fields.values()):
+            # Inclusion
+            projected = {}
+            for path in fields:
+                value = Query.get(doc, path)
+                if value is not Query.MISSING:
+                    Query.set(projected, path, value)
+        else:
+            # Exclusion
+            projected = copy.deepcopy(doc)
+            for path in fields:
+                Query.unset(projected, path)
+        if include_id and '_id' in doc:
+            projected['_id'] = doc['_id']
+        elif not include_id:
+            projected.pop('_id', None)
+        return projected
+
+    # ----- Sorting -----
+
+    # Normalize pymongo's sort arguments to [(path, direction)]
+    @staticmethod
+    def sort_spec(key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            return [(key_or_list, direction or pymongo.ASCENDING)]
+        if isinstance(key_or_list, dict):
+            return list(key_or_list.items())
+        return list(key_or_list)
+
+    @staticmethod
+    def sort_key(spec):
+        def sort_value(doc, path, direction):
+            value = Query.get(doc, path)
+            # Arrays sort by their lowest (ascending) or highest (descending) element
+            if isinstance(value, list) and value:
+                value = sorted(value, key=functools.cmp_to_key(Query.compare))[0 if direction > 0 else -1]
+            return None if value is Query.MISSING else value
+
+        def compare(a, b):
+            for path, direction in spec:
+                result = Query.compare(sort_value(a, path, direction), sort_value(b, path, direction))
+                if result:
+                    return result * (1 if direction > 0 else -1)
+            return 0
+
+        return functools.cmp_to_key(compare)
@@ -0,0 +1,228 @@
+import collections
+import json
+import numpy
+import re
+import threading
+
+import sharkscout
+
+
+# One least-squares system: every row is an alliance, modelled as the sum of its teams' contributions to each field.
+#  Only the normal equations AᵀA and Aᵀb are kept, so adding, changing or removing an alliance is a rank-one update
+#  and solving is one small dense solve no matter how many matches have been played.
+class NormalEquations(object):
+    ridge = 0.001  # keeps AᵀA invertible before every team has played
+
+    def __init__(self):
+        self.fields = []  # Aᵀb columns
+        self.ata = numpy.zeros((0, 0))
+        self.atb = numpy.zeros((0, 0))
+        self.rows = {}  # {row key: (team columns, {field: value})}
+        self.solution = None
+
+    def grow(self, teams):
+        pad = teams - self.ata.shape[0]
+        if pad > 0:
+            self.ata = numpy.pad(self.ata, ((0, pad), (0, pad)))
+            self.atb = numpy.pad(self.atb, ((0, pad), (0, 0)))
+
+    # Add, change or remove (columns=None) one alliance
+    def set(self, key, columns, values):
+        old = self.rows.get(key)
+        if old == (columns, values) or (old is None and columns is None):
+            return
+        self.solution = None
+        if columns is not None and [f for f in values if f not in self.fields]:
+            # A field no row had before, every row needs a value (or zero) for it
+            if old is not None:
+                del self.rows[key]
+            self.fields += sorted([f for f in values if f not in self.fields])
+            self.rows[key] = (columns, values)
+            self.rebuild()
+            return
+        if old is not None:
+            self._update(old[0], old[1], -1)
+            del self.rows[key]
+        if columns is not None:
+            self._update(columns, values, 1)
+            self.rows[key] = (columns, values)
+
+    def _update(self, columns, values, sign):
+        index = numpy.array(columns)
+        self.ata[numpy.ix_(index, index)] += sign
+        self.atb[index] += sign * numpy.array([values.get(f, 0) for f in self.fields])
+
+    def rebuild(self):
+        self.ata = numpy.zeros((self.ata.shape[0], self.ata.shape[0]))
+        self.atb = numpy.zeros((self.ata.shape[0], len(self.fields)))
+        for columns, values in self.rows.values():
+            self._update(columns, values, 1)
+
+    # {field: contributions}, for the teams in at least one row
+    def solve(self):
+        if self.solution is None:
+            teams = self.ata.shape[0]
+            self.solution = numpy.linalg.solve(self.ata + self.ridge * numpy.eye(teams), self.atb) if teams else \
+                self.atb
+        return self.solution
+
+    # Rows each team is in
+    def played(self):
+        return numpy.diagonal(self.ata)
+
+
+# OPR (contribution to the alliance's own score), DPR (to the opponent's), CCWM (to the winning margin) and component
+#  ratings of every numeric score breakdown field, solved from an event's qualification matches, plus ratings of every
+#  numeric match scouting field the year's stats spec reads, from the alliances whose robots were all scouted. Each
+#  event's systems are kept between requests and only see the alliances that posted or changed since the last update.
+class Ratings(object):
+    levels = ['qm']
+    ignored = ['event_key', 'match_key', 'team_key']  # scouting fields that aren't measurements
+    booleans = {'Y': 1, 'N': 0}
+    names = {'score': 'oprs', 'opponent_score': 'dprs', 'margin': 'ccwms'}
+    limit = 32  # events kept, least recently asked for dropped first
+
+    # Class-level, shared by every request. Don't rebind these!
+    events = collections.OrderedDict()  # {event_key: Ratings}
+    lock = threading.Lock()
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.teams = []  # team keys, in column order
+        self.columns = {}  # {team_key: column}
+        self.sources = {}  # {(match_key, color): what the alliance's rows were made from}
+        self.tba = NormalEquations()
+        self.scouting = NormalEquations()
+
+    @classmethod
+    def event(cls, event_key):
+        with cls.lock:
+            if event_key not in cls.events:
+                cls.events[event_key] = cls()
+                while len(cls.events) > cls.limit:
+                    cls.events.popitem(last=False)
+            cls.events.move_to_end(event_key)
+            return cls.events[event_key]
+
+    # Match scouting fields read by a stats spec ("$matches.<field>")
+    @classmethod
+    def fields(cls, year_individual):
+        return sorted(set([f for f in re.findall(r'\$matches\.([A-Za-z0-9_]+)', json.dumps(year_individual))
+                           if f not in cls.ignored]))
+
+    @classmethod
+    def value(cls, value):
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (int, float)):
+            return value
+        if not isinstance(value, str):
+            return None  # (checkbox fields are lists)
+        if value in cls.booleans:
+            return cls.booleans[value]
+        if sharkscout.Util.isnumeric(value):
+            return float(value)
+        return None
+
+    def column(self, team_key):
+        if team_key not in self.columns:
+            self.columns[team_key] = len(self.teams)
+            self.teams.append(team_key)
+            self.tba.grow(len(self.teams))
+            self.scouting.grow(len(self.teams))
+        return self.columns[team_key]
+
+    # Bring the systems up to date with an event's matches and its match scouting documents
+    def update(self, matches, scouting):
+        scouted = {}
+        for document in scouting:
+            values = {k: self.value(v) for k, v in document.items() if k not in self.ignored}
+            scouted[(document.get('match_key'), document.get('team_key'))] = {k: v for k, v in values.items() if
+                                                                                v is not None}
+
+        with self.lock:
+            seen = set()
+            for match in matches:
+                if match.get('comp_level', 'qm') not in self.levels:
+                    continue
+                alliances = match.get('alliances', {})
+                for color, opponent in [('red', 'blue'), ('blue', 'red')]:
+                    if color not in alliances:
+                        continue
+                    key = (match['key'], color)
+                    seen.add(key)
+                    alliance = alliances[color]
+                    # TBA matches have "team_keys", ones inferred from scouting only have "teams" and no score
+                    team_keys = alliance.get('team_keys') or alliance.get('teams') or []
+                    score = alliance.get('score')
+                    opponent_score = alliances.get(opponent, {}).get('score')
+                    breakdown = (match.get('score_breakdown') or {}).get(color) or {}
+                    robots = [scouted.get((match['key'], t)) for t in team_keys]
+                    # Most alliances haven't changed since the last update
+                    source = (team_keys, score, opponent_score, breakdown, robots)
+                    if self.sources.get(key) == source:
+                        continue
+                    self.sources[key] = source
+                    columns = tuple(sorted([self.column(t) for t in team_keys]))
+
+                    if 'team_keys' in alliance and team_keys and score is not None and score >= 0 and \
+                            opponent_score is not None and opponent_score >= 0:
+                        values = {'score': score, 'opponent_score': opponent_score, 'margin': score - opponent_score}
+                        values.update({'breakdown.' + k: int(v) if isinstance(v, bool) else v for k, v in
+                                       breakdown.items() if isinstance(v, (bool, int, float))})
+                        self.tba.set(key, columns, values)
+                    else:
+                        self.tba.set(key, None, None)
+
+                    if team_keys and None not in robots:
+                        values = {}
+                        for robot in robots:
+                            for field, value in robot.items():
+                                values[field] = values.get(field, 0) + value
+                        self.scouting.set(key, columns, values)
+                    else:
+                        self.scouting.set(key, None, None)
+
+            # Matches that are gone (e.g. a mistyped match key that was scouted and fixed)
+            for key in [k for k in self.sources if k not in seen]:
+                del self.sources[key]
+                self.tba.set(key, None, None)
+                self.scouting.set(key, None, None)
+        return self
+
+    # Ratings keyed by team key, like TBA's event oprs ({'oprs': {'frc254': 52.1}, ...}), with breakdown and scouting
+    #  components as {'components': {field: {team_key: rating}}}
+    def stats(self):
+        with self.lock:
+            stats = {'oprs': {}, 'dprs': {}, 'ccwms': {}, 'components': {}}
+            for system in [self.tba, self.scouting]:
+                played = system.played() > 0
+                solution = numpy.round(system.solve()[played], 2)
+                team_keys = [t for t, p in zip(self.teams, played) if p]
+                for field_idx, field in enumerate(system.fields):
+                    ratings = dict(zip(team_keys, solution[:, field_idx].tolist()))
+                    if field in self.names:
+                        stats[self.names[field]] = ratings
+                    else:
+                        stats['components'][field] = ratings
+            stats['matches'] = len(set([k[0] for k in self.tba.rows]))
+            return stats
+
+    # Ratings as rows for the stats listing, one per team
+    @staticmethod
+    def listing(stats):
+        teams = {}
+        for column, ratings in [('200_opr', stats['oprs']), ('201_dpr', stats['dprs']), ('202_ccwm', stats['ccwms'])] + \
+                [(('300_' if f.startswith('breakdown.') else '400_') +
+                  re.sub(r'([a-z])([A-Z])', r'\1_\2', f.split('.')[-1]).lower(), r) for f, r in
+                 sorted(stats['components'].items())]:
+            for team_key, rating in ratings.items():
+                number = team_key[3:]  # (B teams, e.g. frc254B, keep their letter)
+                teams.setdefault(team_key, {
+                    '_id': team_key,
+                    '100_team': int(number) if number.isdigit() else number
+                })[column] = rating
+        columns = set([c for t in teams.values() for c in t])
+        for team in teams.values():
+            team.update({c: '' for c in columns if c not in team})
+        return sorted(teams.values(), key=lambda t: (int(re.sub(r'[^0-9]', '', t['_id']) or 0), t['_id']))
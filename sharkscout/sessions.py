@@ -0,0 +1,157 @@
+import cherrypy
+import cherrypy.lib.sessions
+import cherrypy.process.plugins
+import os
+import pickle
+import threading
+
+import sharkscout
+
+
+class MemorySession(cherrypy.lib.sessions.Session):
+    # Class-level objects, shared by every request. Don't rebind these!
+    cache = {}  # {id: [data, expiration_time]}
+    mutex = threading.Lock()  # held only while touching the cache, never for a whole request
+
+    storage_path = None
+    snapshot_freq = 1  # minutes
+    snapshot_thread = None
+    dirty = False
+
+    @classmethod
+    def setup(cls, **kwargs):
+        for key in kwargs:
+            setattr(cls, key, kwargs[key])
+
+        # Restore the last snapshot
+        snapshot = cls._snapshot_file()
+        if snapshot and os.path.exists(snapshot):
+            try:
+                with open(snapshot, 'rb') as f:
+                    cls.cache.update({k: [v[0], v[1]] for k, v in pickle.load(f).items()})
+            except Exception as e:
+                cherrypy.log('Couldn\'t restore sessions from "' + snapshot + '": ' + repr(e))
+
+        # Periodically snapshot, and snapshot when stopping
+        if snapshot and cls.snapshot_freq and not cls.snapshot_thread:
+            cls.snapshot_thread = cherrypy.process.plugins.Monitor(cherrypy.engine, cls.snapshot,
+                                                                   cls.snapshot_freq * 60, name='Session snapshot')
+            cls.snapshot_thread.subscribe()
+            cls.snapshot_thread.start()
+            cherrypy.engine.subscribe('stop', cls.snapshot)
+
+    @classmethod
+    def _snapshot_file(cls):
+        if cls.storage_path:
+            return os.path.join(cls.storage_path, 'sessions.pickle')
+        return None
+
+    # Write all sessions to disk, only if any data changed since the last snapshot
+    @classmethod
+    def snapshot(cls):
+        snapshot = cls._snapshot_file()
+        if not snapshot or not cls.dirty:
+            return
+        with cls.mutex:
+            cache = {k: (dict(v[0]), v[1]) for k, v in cls.cache.items()}
+            cls.dirty = False
+        with open(snapshot + '.tmp', 'wb') as f:
+            pickle.dump(cache, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(snapshot + '.tmp', snapshot)
+
+    def clean_up(self):
+        now = self.now()
+        with self.mutex:
+            for id in [k for k, v in self.cache.items() if v[1] <= now]:
+                del self.cache[id]
+                self.__class__.dirty = True
+
+    def _exists(self):
+        return self.id in self.cache
+
+    # Load a private copy of the session so concurrent requests never share a dict
+    def _load(self):
+        with self.mutex:
+            stored = self.cache.get(self.id)
+            self._loaded = dict(stored[0]) if stored else {}
+            return (dict(stored[0]), stored[1]) if stored else None
+
+    # Apply only the keys this request changed, so parallel requests don't overwrite each other
+    def _save(self, expiration_time):
+        loaded = getattr(self, '_loaded', {})
+        changed = {k: v for k, v in self._data.items() if k not in loaded or loaded[k] != v}
+        removed = [k for k in loaded if k not in self._data]
+        with self.mutex:
+            stored = self.cache.setdefault(self.id, [{}, expiration_time])
+            stored[1] = expiration_time
+            if changed or removed:
+                stored[0].update(changed)
+                for key in removed:
+                    stored[0].pop(key, None)
+                self.__class__.dirty = True
+
+    def _delete(self):
+        with self.mutex:
+            if self.cache.pop(self.id, None) is not None:
+                self.__class__.dirty = True
+
+    # No request-level locking, writes are merged per key instead
+    def acquire_lock(self):
+        self.locked = True
+
+    def release_lock(self):
+        self.locked = False
+
+    def __len__(self):
+        return len(self.cache)
+
+
+# Sessions stored in the database, shared by every web server process (--workers)
+class MongoSession(cherrypy.lib.sessions.Session):
+    collection = 'sessions'  # {_id: id, data: {key: value}, expiration_time: datetime}
+
+    @classmethod
+    def setup(cls, **kwargs):
+        for key in kwargs:
+            setattr(cls, key, kwargs[key])
+        cls._collection().create_index('expiration_time')
+
+    @classmethod
+    def _collection(cls):
+        return sharkscout.Mongo().shark_scout[cls.collection]
+
+    def clean_up(self):
+        self._collection().delete_many({'expiration_time': {'$lte': self.now()}})
+
+    def _exists(self):
+        return self._collection().find_one({'_id': self.id}, {'_id': 1}) is not None
+
+    # Remember what was loaded, like MemorySession, so saves only touch the keys this request changed
+    def _load(self):
+        stored = self._collection().find_one({'_id': self.id})
+        self._loaded = dict(stored.get('data', {})) if stored else {}
+        return (dict(self._loaded), stored['expiration_time']) if stored else None
+
+    def _save(self, expiration_time):
+        loaded = getattr(self, '_loaded', {})
+        update = {'$set': {'expiration_time': expiration_time}}
+        for key, value in self._data.items():
+            if key not in loaded or loaded[key] != value:
+                update['$set']['data.' + key] = value
+        removed = [k for k in loaded if k not in self._data]
+        if removed:
+            update['$unset'] = {'data.' + k: '' for k in removed}
+        self._collection().update_one({'_id': self.id}, update, upsert=True)
+
+    def _delete(self):
+        self._collection().delete_one({'_id': self.id})
+
+    # No request-level locking, writes are merged per key instead
+    def acquire_lock(self):
+        self.locked = True
+
+    def release_lock(self):
+        self.locked = False
+
+    def __len__(self):
+        return self._collection().count_documents({})
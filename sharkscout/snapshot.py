@@ -0,0 +1,221 @@
+import time
+
+import bson
+import bson.json_util
+import concurrent.futures
+import gzip
+import hashlib
+import json
+import os
+import pymongo
+import pymongo.errors
+import threading
+from datetime import datetime
+
+import sharkscout
+
+
+# In-process database snapshots: one gzipped BSON (or NDJSON) file per collection plus a manifest.json with counts and
+#  checksums. Incremental snapshots only hold documents changed since their base snapshot, and restoring one restores
+#  its base first. (Deletions aren't captured by incremental snapshots, only by the next full one.)
+class Snapshot(object):
+    formats = {
+        'bson': '.bson.gz',
+        'ndjson': '.ndjson.gz'
+    }
+    # The field that tells when a document last changed, collections not listed here are always copied in full
+    changed = {
+        'tba_events': 'modified_timestamp',
+        'tba_teams': 'modified_timestamp',
+        'scouting': 'modified_timestamp',
+        'scouting_matches': 'modified_timestamp',
+        'scouting_changes': '_id'  # insert-only, ObjectIds start with their creation time (to the second)
+    }
+    skipped = ['jobs']  # never dumped or restored: a restored queued or running job would hold its update back
+    batch = 1000  # documents per restore write
+    workers = 4  # collections dumped or restored in parallel
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def manifest(self):
+        with open(os.path.join(self.path, 'manifest.json'), 'r') as f:
+            return json.load(f)
+
+    # The newest snapshot in a directory of snapshots (or the directory itself if it's a snapshot)
+    @staticmethod
+    def latest(path):
+        if os.path.exists(os.path.join(path, 'manifest.json')):
+            return Snapshot(path)
+        if not os.path.isdir(path):
+            return None
+        snapshots = sorted([d for d in os.listdir(path) if os.path.exists(os.path.join(path, d, 'manifest.json'))])
+        return Snapshot(os.path.join(path, snapshots[-1])) if snapshots else None
+
+    # Snapshots that have to be restored, oldest first
+    def chain(self):
+        chain = [self]
+        while chain[0].manifest['base']:
+            chain.insert(0, Snapshot(os.path.join(os.path.dirname(os.path.abspath(chain[0].path)),
+                                                  chain[0].manifest['base'])))
+        return chain
+
+    @staticmethod
+    def _sha256(file):
+        sha256 = hashlib.sha256()
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    # Raise if any file in the snapshot (or its base snapshots) is missing or corrupt
+    def verify(self):
+        for snapshot in self.chain():
+            for name, collection in snapshot.manifest['collections'].items():
+                file = os.path.join(snapshot.path, collection['file'])
+                if not os.path.exists(file) or self._sha256(file) != collection['sha256']:
+                    raise ValueError('snapshot "' + snapshot.path + '" has a missing or corrupt ' + name)
+
+    # ----- Dump -----
+
+    def dump(self, database, base=None, format='bson'):
+        created = datetime.utcnow()
+        since = None
+        if base is not None:
+            since = datetime.strptime(base.manifest['created'], '%Y-%m-%dT%H:%M:%S.%f')
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+        names = [n for n in database.list_collection_names() if not n.startswith('system.') and n not in self.skipped]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {n: pool.submit(self._dump_collection, database[n], since, format) for n in names}
+            collections = {n: futures[n].result() for n in names}
+
+        manifest = {
+            'format': format,
+            'database': database.name,
+            'created': created.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            'base': os.path.basename(os.path.abspath(base.path)) if base is not None else None,
+            'collections': collections
+        }
+        with open(os.path.join(self.path, 'manifest.json.tmp'), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(os.path.join(self.path, 'manifest.json.tmp'), os.path.join(self.path, 'manifest.json'))
+        return manifest
+
+    def _dump_collection(self, collection, since, format):
+        filter = {}
+        field = self.changed.get(collection.name)
+        if since is not None and field is not None:
+            filter = {field: {'$gte': bson.ObjectId.from_datetime(since) if field == '_id' else since}}
+
+        file = collection.name + self.formats[format]
+        count = 0
+        with gzip.open(os.path.join(self.path, file), 'wb', compresslevel=6) as f:
+            for document in collection.find(filter):
+                if format == 'bson':
+                    f.write(bson.encode(document))
+                else:
+                    f.write((bson.json_util.dumps(document, json_options=bson.json_util.CANONICAL_JSON_OPTIONS) +
+                             '\n').encode('utf-8'))
+                count += 1
+        return {
+            'file': file,
+            'count': count,
+            'incremental': bool(filter),
+            'sha256': self._sha256(os.path.join(self.path, file))
+        }
+
+    # ----- Restore -----
+
+    def documents(self, name):
+        collection = self.manifest['collections'][name]
+        with gzip.open(os.path.join(self.path, collection['file']), 'rb') as f:
+            if self.manifest['format'] == 'bson':
+                for document in bson.decode_file_iter(f):
+                    yield document
+            else:
+                for line in f:
+                    yield bson.json_util.loads(line.decode('utf-8'),
+                                               json_options=bson.json_util.CANONICAL_JSON_OPTIONS)
+
+    # Restore this snapshot (after its base snapshots), documents replace ones with the same _id. Documents that clash
+    #  with another one's unique key (e.g. the same event under a different _id) are left out, like mongorestore
+    #  does, returning {collection: documents left out}
+    def restore(self, database):
+        self.verify()
+        clashes = {}
+        for snapshot in self.chain():
+            names = [n for n in snapshot.manifest['collections'].keys() if n not in self.skipped]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = {n: pool.submit(snapshot._restore_collection, database[n], n) for n in names}
+                for name in names:
+                    if futures[name].result():
+                        clashes[name] = clashes.get(name, 0) + futures[name].result()
+        return clashes
+
+    # (documents left out)
+    def _restore_collection(self, collection, name):
+        # Nothing to replace in an empty collection, plain inserts are faster
+        insert = not collection.estimated_document_count()
+        clashes = 0
+        batch = []
+        for document in self.documents(name):
+            batch.append(document)
+            if len(batch) >= self.batch:
+                clashes += self._restore_batch(collection, batch, insert)
+                batch = []
+        if batch:
+            clashes += self._restore_batch(collection, batch, insert)
+        return clashes
+
+    # (duplicate key errors, the rest of the batch is still written)
+    @staticmethod
+    def _restore_batch(collection, batch, insert):
+        try:
+            collection.bulk_write([pymongo.InsertOne(d) if insert else
+                                   pymongo.ReplaceOne({'_id': d['_id']}, d, upsert=True) for d in batch],
+                                  ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            if e.details.get('writeConcernErrors') or [r for r in errors if r.get('code') != 11000]:
+                raise
+            return len(errors)
+        return 0
+
+
+# Snapshot on an interval, in the background: a full snapshot first, then incremental ones, skipping empty ones, and
+#  a new full one every `incrementals` so a restore never has to replay an ever longer chain
+class SnapshotBackup(threading.Thread):
+    incrementals = 60  # incremental snapshots on one full snapshot
+
+    def __init__(self, path, interval, format='bson'):
+        super().__init__(daemon=True)
+        self.path = path
+        self.interval = interval  # minutes
+        self.format = format
+
+    def run(self):
+        base = None
+        chained = 0  # incremental snapshots on the current full one
+        while True:
+            if chained >= self.incrementals:
+                base = None
+            database = sharkscout.Mongo().shark_scout
+            name = datetime.utcnow().strftime('%Y%m%d-%H%M%S') + ('-full' if base is None else '')
+            snapshot = Snapshot(os.path.join(self.path, name))
+            try:
+                manifest = snapshot.dump(database, base, self.format)
+                if base is not None and not [c for c in manifest['collections'].values() if
+                                             c['incremental'] and c['count']]:
+                    # Nothing changed, but the next snapshot still needs to cover this one's time span
+                    for file in os.listdir(snapshot.path):
+                        os.remove(os.path.join(snapshot.path, file))
+                    os.rmdir(snapshot.path)
+                else:
+                    chained = chained + 1 if base is not None else 0
+                    base = snapshot
+            except (OSError, pymongo.errors.PyMongoError) as e:
+                print('Couldn\'t snapshot to "' + snapshot.path + '": ' + repr(e))
+            time.sleep(self.interval * 60)
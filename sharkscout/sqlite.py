@@ -0,0 +1,529 @@
+import base64
+import bson
+import contextlib
+import itertools
+import json
+import os
+import pymongo
+import pymongo.errors
+import pymongo.results
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+import sharkscout
+
+
+# Embedded storage backend: the subset of pymongo's client/database/collection interface that Mongo uses,
+#  stored in SQLite (one JSON document column per row, indexes are expression indexes on json_extract())
+class SQLiteClient(object):
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        self.databases = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.databases:
+                self.databases[name] = SQLiteDatabase(self, name)
+            return self.databases[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def drop_database(self, name):
+        self[name].drop()
+
+    def close(self):
+        for database in self.databases.values():
+            database.close()
+
+
+class SQLiteDatabase(object):
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.path = os.path.join(client.path, name + '.sqlite3')
+        self.local = threading.local()
+        self.lock = threading.RLock()  # one writer at a time (SQLite's own locking covers other processes)
+        self.connections = []
+        self.collections = {}
+        self.meta = (None, {}, {})  # (version, {collection: indexed paths}, {collection: multikey paths})
+
+        with self.transaction() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS _indexes (collection TEXT, name TEXT, keys TEXT, '
+                         'PRIMARY KEY (collection, name))')
+            conn.execute('CREATE TABLE IF NOT EXISTS _multikey (collection TEXT, path TEXT, '
+                         'PRIMARY KEY (collection, path))')
+            conn.execute('CREATE TABLE IF NOT EXISTS _meta (version INTEGER)')
+            if conn.execute('SELECT COUNT(*) FROM _meta').fetchone()[0] == 0:
+                conn.execute('INSERT INTO _meta (version) VALUES (0)')
+
+    def __getitem__(self, name):
+        if name not in self.collections:
+            self.collections[name] = SQLiteCollection(self, name)
+        return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self.connections.append(conn)
+        return conn
+
+    # Per-thread connections, reads never wait on writes
+    @property
+    def reader(self):
+        if getattr(self.local, 'reader', None) is None:
+            self.local.reader = self._connect()
+        return self.local.reader
+
+    @property
+    def writer(self):
+        if getattr(self.local, 'writer', None) is None:
+            self.local.writer = self._connect()
+        return self.local.writer
+
+    @contextlib.contextmanager
+    def transaction(self):
+        with self.lock:
+            conn = self.writer
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def close(self):
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
+        self.local = threading.local()
+
+    def command(self, command, *args, **kwargs):
+        if command == 'serverStatus':
+            return {'ok': 1.0, 'version': sqlite3.sqlite_version}
+        if command == 'ping':
+            return {'ok': 1.0}
+        raise pymongo.errors.OperationFailure('no such command: \'' + str(command) + '\'')
+
+    def watch(self, *args, **kwargs):
+        raise pymongo.errors.OperationFailure('change streams are not supported by the SQLite backend')
+
+    def list_collection_names(self):
+        return [r[0] for r in self.reader.execute('SELECT name FROM sqlite_master WHERE type = \'table\'') if
+                not r[0].startswith('_') and not r[0].startswith('sqlite_')]
+
+    def drop_collection(self, name):
+        self[name].drop()
+
+    def drop(self):
+        for name in self.list_collection_names():
+            self.drop_collection(name)
+
+    # Index metadata, reloaded whenever any process changes it
+    def metadata(self, collection, conn):
+        version = conn.execute('SELECT version FROM _meta').fetchone()[0]
+        if self.meta[0] != version:
+            indexed = {}
+            multikey = {}
+            for name, keys in conn.execute('SELECT collection, keys FROM _indexes'):
+                indexed.setdefault(name, set()).update(json.loads(keys))
+            for name, path in conn.execute('SELECT collection, path FROM _multikey'):
+                multikey.setdefault(name, set()).add(path)
+            self.meta = (version, indexed, multikey)
+        return self.meta[1].get(collection, set()), self.meta[2].get(collection, set())
+
+    # ----- Documents to and from JSON -----
+
+    @staticmethod
+    def encode(value):
+        return json.dumps(value, separators=(',', ':'), ensure_ascii=False, check_circular=False,
+                          default=SQLiteDatabase._encode_default)
+
+    @staticmethod
+    def _encode_default(value):
+        if isinstance(value, bson.ObjectId):
+            return {'$oid': str(value)}
+        if isinstance(value, datetime):
+            # Like BSON: UTC, millisecond precision
+            if value.tzinfo is not None:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            return {'$date': value.replace(microsecond=value.microsecond // 1000 * 1000).isoformat()}
+        if isinstance(value, bytes):
+            return {'$binary': base64.b64encode(value).decode()}
+        if isinstance(value, set):
+            return list(value)
+        raise TypeError('cannot encode object: ' + repr(value) + ', of type: ' + str(type(value)))
+
+    @staticmethod
+    def decode(text):
+        return json.loads(text, object_hook=SQLiteDatabase._decode_hook)
+
+    @staticmethod
+    def _decode_hook(obj):
+        if len(obj) == 1:
+            if '$oid' in obj:
+                return bson.ObjectId(obj['$oid'])
+            if '$date' in obj:
+                return datetime.fromisoformat(obj['$date'])
+            if '$binary' in obj:
+                return base64.b64decode(obj['$binary'])
+        return obj
+
+
+class SQLiteCollection(object):
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.table = '"' + name.replace('"', '""') + '"'
+        self.created = False
+        self._create()
+
+    # Like MongoDB, collections are created on first use (again after being dropped)
+    def _create(self):
+        if not self.created:
+            with self.database.transaction() as conn:
+                conn.execute('CREATE TABLE IF NOT EXISTS ' + self.table + ' (id TEXT PRIMARY KEY, doc TEXT NOT NULL)')
+            self.created = True
+
+    @staticmethod
+    def _json_path(path):
+        return '\'$' + ''.join(['."' + p.replace('"', '""').replace('\'', '\'\'') + '"' for p in path.split('.')]) + '\''
+
+    # ----- Reads -----
+
+    # SQL pre-filter using indexed fields, a superset of what the filter matches
+    #  (multikey paths are skipped, SQL equality doesn't look inside arrays)
+    def _where(self, filter, conn):
+        indexed, multikey = self.database.metadata(self.name, conn)
+        clauses = []
+        params = []
+
+        def sql_scalar(value):
+            # datetimes are stored as (sortable) ISO 8601 strings
+            return isinstance(value, (str, int, float, datetime)) and not isinstance(value, bool)
+
+        for key, condition in (filter or {}).items():
+            if key == '$and':
+                for f in condition:
+                    where, where_params = self._where(f, conn)
+                    if where:
+                        clauses.append(where)
+                        params += where_params
+                continue
+
+            if key == '_id':
+                expression = 'id'
+                encode = SQLiteDatabase.encode
+            elif key in indexed and key not in multikey:
+                expression = 'json_extract(doc, ' + self._json_path(key) + ')'
+                encode = None
+            else:
+                continue
+
+            def param(value):
+                if encode:
+                    return encode(value)
+                return SQLiteDatabase.encode(value) if isinstance(value, datetime) else value
+
+            if not isinstance(condition, dict) and (sql_scalar(condition) or (
+                    encode and isinstance(condition, bson.ObjectId))):
+                clauses.append(expression + ' = ?')
+                params.append(param(condition))
+            elif sharkscout.Query._operators(condition):
+                for op, arg in condition.items():
+                    if op == '$eq' and sql_scalar(arg):
+                        clauses.append(expression + ' = ?')
+                        params.append(param(arg))
+                    elif op == '$in' and arg and all(sql_scalar(a) or (encode and isinstance(a, bson.ObjectId))
+                                                     for a in arg):
+                        clauses.append(expression + ' IN (' + ','.join(['?'] * len(arg)) + ')')
+                        params += [param(a) for a in arg]
+                    elif op in ['$gt', '$gte', '$lt', '$lte'] and not encode and sql_scalar(arg):
+                        clauses.append(expression + {'$gt': ' > ?', '$gte': ' >= ?', '$lt': ' < ?',
+                                                     '$lte': ' <= ?'}[op])
+                        params.append(param(arg))
+
+        return ' AND '.join(clauses), params
+
+    def _find(self, filter=None, conn=None):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {'_id': filter}
+        self._create()
+        conn = conn or self.database.reader
+        where, params = self._where(filter, conn)
+        rows = conn.execute('SELECT doc FROM ' + self.table + (' WHERE ' + where if where else ''), params)
+        for row in rows:
+            doc = SQLiteDatabase.decode(row[0])
+            if sharkscout.Query.match(doc, filter):
+                yield doc
+
+    def find(self, filter=None, projection=None, skip=0, limit=0, sort=None):
+        cursor = SQLiteCursor(self, filter, projection)
+        if sort:
+            cursor.sort(sort)
+        return cursor.skip(skip).limit(limit)
+
+    def find_one(self, filter=None, projection=None, *args, **kwargs):
+        for doc in self.find(filter, projection, *args, **kwargs).limit(1):
+            return doc
+        return None
+
+    def count_documents(self, filter, **kwargs):
+        if not filter:
+            return self.estimated_document_count()
+        return sum(1 for _ in self._find(filter))
+
+    def estimated_document_count(self, **kwargs):
+        self._create()
+        return self.database.reader.execute('SELECT COUNT(*) FROM ' + self.table).fetchone()[0]
+
+    def distinct(self, key, filter=None, **kwargs):
+        return SQLiteCursor(self, filter).distinct(key)
+
+    def aggregate(self, pipeline, **kwargs):
+        pipeline = list(pipeline)
+        # Leading $match uses the SQL pre-filter
+        filter = pipeline.pop(0)['$match'] if pipeline and '$match' in pipeline[0] else None
+        return sharkscout.Aggregation(self.database).run(pipeline, self._find(filter))
+
+    def watch(self, *args, **kwargs):
+        raise pymongo.errors.OperationFailure('change streams are not supported by the SQLite backend')
+
+    # ----- Writes -----
+
+    def _mark_multikey(self, conn, documents):
+        indexed, multikey = self.database.metadata(self.name, conn)
+        found = set()
+        for path in indexed - multikey:
+            if [d for d in documents if sharkscout.Query.multikey(d, path)]:
+                found.add(path)
+        if found:
+            conn.executemany('INSERT OR IGNORE INTO _multikey (collection, path) VALUES (?, ?)',
+                             [(self.name, p) for p in found])
+            conn.execute('UPDATE _meta SET version = version + 1')
+
+    def _insert(self, conn, document):
+        self._create()
+        if '_id' not in document:
+            document['_id'] = bson.ObjectId()
+        try:
+            conn.execute('INSERT INTO ' + self.table + ' (id, doc) VALUES (?, ?)',
+                         (SQLiteDatabase.encode(document['_id']), SQLiteDatabase.encode(document)))
+        except sqlite3.IntegrityError as e:
+            raise pymongo.errors.DuplicateKeyError('E11000 duplicate key error collection: ' + self.name + ' ' +
+                                                   str(e), 11000)
+        self._mark_multikey(conn, [document])
+        return document['_id']
+
+    def _update(self, conn, filter, update, upsert=False, multi=False, replace=False):
+        if replace and any(k.startswith('$') for k in update):
+            raise ValueError('replacement can not include $ operators')
+        if not replace and not all(k.startswith('$') for k in update):
+            raise ValueError('update only works with $ operators')
+
+        documents = list(itertools.islice(self._find(filter, conn), None if multi else 1))
+        modified = []
+        for doc in documents:
+            _id = doc['_id']
+            if sharkscout.Query.update(doc, update):
+                if not sharkscout.Query.equal(doc.get('_id'), _id):
+                    raise pymongo.errors.WriteError('Performing an update on the path \'_id\' would modify the '
+                                                    'immutable field \'_id\'')
+                modified.append(doc)
+        for doc in modified:
+            try:
+                conn.execute('UPDATE ' + self.table + ' SET doc = ? WHERE id = ?',
+                             (SQLiteDatabase.encode(doc), SQLiteDatabase.encode(doc['_id'])))
+            except sqlite3.IntegrityError as e:
+                raise pymongo.errors.DuplicateKeyError('E11000 duplicate key error collection: ' + self.name + ' ' +
+                                                       str(e), 11000)
+        self._mark_multikey(conn, modified)
+
+        if documents or not upsert:
+            return {'n': len(documents), 'nModified': len(modified)}
+
+        document = sharkscout.Query.seed(filter)
+        sharkscout.Query.update(document, update, inserting=True)
+        return {'n': 1, 'nModified': 0, 'upserted': self._insert(conn, document)}
+
+    def _delete(self, conn, filter, multi=False):
+        ids = [SQLiteDatabase.encode(d['_id']) for d in
+               itertools.islice(self._find(filter, conn), None if multi else 1)]
+        for idx in range(0, len(ids), 500):
+            chunk = ids[idx:idx + 500]
+            conn.execute('DELETE FROM ' + self.table + ' WHERE id IN (' + ','.join(['?'] * len(chunk)) + ')', chunk)
+        return {'n': len(ids)}
+
+    def insert_one(self, document, **kwargs):
+        with self.database.transaction() as conn:
+            return pymongo.results.InsertOneResult(self._insert(conn, document), True)
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        with self.database.transaction() as conn:
+            return pymongo.results.InsertManyResult([self._insert(conn, d) for d in documents], True)
+
+    def update_one(self, filter, update, upsert=False, **kwargs):
+        with self.database.transaction() as conn:
+            return pymongo.results.UpdateResult(self._update(conn, filter, update, upsert), True)
+
+    def update_many(self, filter, update, upsert=False, **kwargs):
+        with self.database.transaction() as conn:
+            return pymongo.results.UpdateResult(self._update(conn, filter, update, upsert, multi=True), True)
+
+    def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        with self.database.transaction() as conn:
+            return pymongo.results.UpdateResult(self._update(conn, filter, replacement, upsert, replace=True), True)
+
+    def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                            return_document=pymongo.ReturnDocument.BEFORE, **kwargs):
+        with self.database.transaction() as conn:
+            documents = self._find(filter, conn)
+            if sort:
+                documents = iter(sorted(documents, key=sharkscout.Query.sort_key(sharkscout.Query.sort_spec(sort))))
+            before = next(documents, None)
+            if before is None:
+                if not upsert:
+                    return None
+                _id = self._update(conn, filter, update, upsert=True)['upserted']
+            else:
+                _id = before['_id']
+                self._update(conn, {'_id': _id}, update)
+            if return_document == pymongo.ReturnDocument.AFTER:
+                return sharkscout.Query.project(next(self._find({'_id': _id}, conn)), projection)
+            return sharkscout.Query.project(before, projection) if before is not None else None
+
+    def delete_one(self, filter, **kwargs):
+        with self.database.transaction() as conn:
+            return pymongo.results.DeleteResult(self._delete(conn, filter), True)
+
+    def delete_many(self, filter, **kwargs):
+        with self.database.transaction() as conn:
+            return pymongo.results.DeleteResult(self._delete(conn, filter, multi=True), True)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        if not requests:
+            raise pymongo.errors.InvalidOperation('No operations to execute')
+        result = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'upserted': [],
+                  'writeErrors': [], 'writeConcernErrors': []}
+        with self.database.transaction() as conn:
+            for idx, request in enumerate(requests):
+                try:
+                    if isinstance(request, pymongo.InsertOne):
+                        self._insert(conn, request._doc)
+                        result['nInserted'] += 1
+                    elif isinstance(request, (pymongo.UpdateOne, pymongo.UpdateMany, pymongo.ReplaceOne)):
+                        raw = self._update(conn, request._filter, request._doc, request._upsert,
+                                           multi=isinstance(request, pymongo.UpdateMany),
+                                           replace=isinstance(request, pymongo.ReplaceOne))
+                        if 'upserted' in raw:
+                            result['nUpserted'] += 1
+                            result['upserted'].append({'index': idx, '_id': raw['upserted']})
+                        else:
+                            result['nMatched'] += raw['n']
+                            result['nModified'] += raw['nModified']
+                    elif isinstance(request, (pymongo.DeleteOne, pymongo.DeleteMany)):
+                        result['nRemoved'] += self._delete(conn, request._filter,
+                                                           multi=isinstance(request, pymongo.DeleteMany))['n']
+                    else:
+                        raise TypeError(repr(request) + ' is not a valid request')
+                except pymongo.errors.DuplicateKeyError as e:
+                    result['writeErrors'].append({'index': idx, 'code': 11000, 'errmsg': str(e), 'op': request})
+                    if ordered:
+                        break
+        if result['writeErrors']:
+            raise pymongo.errors.BulkWriteError(result)
+        return pymongo.results.BulkWriteResult(result, True)
+
+    # ----- Indexes -----
+
+    def create_index(self, keys, unique=False, name=None, **kwargs):
+        keys = sharkscout.Query.sort_spec(keys)
+        name = name or '_'.join([str(p) + '_' + str(d) for p, d in keys])
+        paths = [p for p, _ in keys]
+        self._create()
+        with self.database.transaction() as conn:
+            try:
+                conn.execute('CREATE ' + ('UNIQUE ' if unique else '') + 'INDEX IF NOT EXISTS "' +
+                             (self.name + '.' + name).replace('"', '""') + '" ON ' + self.table + ' (' +
+                             ', '.join(['json_extract(doc, ' + self._json_path(p) + ')' for p in paths]) + ')')
+            except sqlite3.IntegrityError as e:
+                raise pymongo.errors.DuplicateKeyError('E11000 duplicate key error collection: ' + self.name + ' ' +
+                                                       str(e), 11000)
+            conn.execute('INSERT OR REPLACE INTO _indexes (collection, name, keys) VALUES (?, ?, ?)',
+                         (self.name, name, json.dumps(paths)))
+            # Existing array values make the path multikey
+            for path in paths:
+                parts = path.split('.')
+                prefixes = ['.'.join(parts[:idx + 1]) for idx in range(len(parts))]
+                if conn.execute('SELECT 1 FROM ' + self.table + ' WHERE ' + ' OR '.join(
+                        ['json_type(doc, ' + self._json_path(p) + ') = \'array\'' for p in prefixes]) +
+                                ' LIMIT 1').fetchone():
+                    conn.execute('INSERT OR IGNORE INTO _multikey (collection, path) VALUES (?, ?)', (self.name, path))
+            conn.execute('UPDATE _meta SET version = version + 1')
+        return name
+
+    def drop(self):
+        with self.database.transaction() as conn:
+            conn.execute('DROP TABLE IF EXISTS ' + self.table)
+            conn.execute('DELETE FROM _indexes WHERE collection = ?', (self.name,))
+            conn.execute('DELETE FROM _multikey WHERE collection = ?', (self.name,))
+            conn.execute('UPDATE _meta SET version = version + 1')
+        self.created = False
+
+
+class SQLiteCursor(object):
+    def __init__(self, collection, filter=None, projection=None):
+        self.collection = collection
+        self.filter = filter
+        self.projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=None):
+        self._sort = sharkscout.Query.sort_spec(key_or_list, direction)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self  # (rows are already read from SQLite one at a time)
+
+    def distinct(self, key):
+        values = []
+        for doc in self.collection._find(self.filter):
+            for value in sharkscout.Query.values(doc, key):
+                for item in (value if isinstance(value, list) else [value]):
+                    if not [v for v in values if sharkscout.Query.equal(v, item)]:
+                        values.append(item)
+        return values
+
+    def __iter__(self):
+        documents = self.collection._find(self.filter)
+        if self._sort:
+            documents = iter(sorted(documents, key=sharkscout.Query.sort_key(self._sort)))
+        documents = itertools.islice(documents, self._skip, self._skip + self._limit if self._limit else None)
+        for doc in documents:
+            yield sharkscout.Query.project(doc, self.projection)
@@ -0,0 +1,362 @@
+import pymongo
+import random
+from datetime import datetime, timedelta
+
+
+# Made-up but plausible competition data, for load tests and benchmarks: TBA-shaped teams and events with balanced
+#  qualification schedules, and match and pit scouting shaped like the www/scouting/2018 forms. Every team has a
+#  hidden ability, so scouting and match scores agree with each other. The same seed always generates the same data.
+class Synthetic(object):
+    year = 2018  # the year with scouting forms and a stats spec
+    event_code = 'syn'  # event keys are <year>syn<number>
+    cities = [('Norfolk', 'VA', 'USA'), ('Raleigh', 'NC', 'USA'), ('Columbus', 'OH', 'USA'), ('Austin', 'TX', 'USA'),
+              ('Denver', 'CO', 'USA'), ('Portland', 'OR', 'USA'), ('Toronto', 'ON', 'Canada'),
+              ('Hartford', 'CT', 'USA'), ('Detroit', 'MI', 'USA'), ('San Jose', 'CA', 'USA')]
+    names = ['Robo', 'Iron', 'Cyber', 'Mech', 'Tech', 'Volt', 'Gear', 'Steel', 'Quantum', 'Circuit', 'Shark', 'Titan']
+    mascots = ['Hawks', 'Knights', 'Dragons', 'Wolves', 'Rams', 'Pirates', 'Bots', 'Raiders', 'Lions', 'Eagles']
+    strategies = ['Cubes in the switch', 'Cubes on the scale', 'Exchange, then defense', 'Scale only',
+                  'Cross the line and wait', 'Switch, then scale', 'Whatever the alliance needs']
+    scouters = ['Alex', 'Blake', 'Casey', 'Drew', 'Emery', 'Finley', 'Gray', 'Harper', 'Jordan', 'Kai']
+    districts = [('chs', 'FIRST Chesapeake'), ('fim', 'FIRST In Michigan'), ('ne', 'New England'),
+                 ('pnw', 'Pacific Northwest')]
+
+    def __init__(self, seed=0, year=None):
+        self.random = random.Random(seed)
+        self.year = year or self.year
+        self.abilities = {}  # {team_key: {...}}
+
+    def team(self, team_number):
+        city, state_prov, country = self.random.choice(self.cities)
+        name = self.random.choice(self.names)
+        team = {
+            'key': 'frc' + str(team_number),
+            'team_number': team_number,
+            'nickname': name + ' ' + self.random.choice(self.mascots),
+            'name': name + ' Foundation & ' + city + ' High School',
+            'city': city,
+            'state_prov': state_prov,
+            'country': country,
+            'locality': city,
+            'region': state_prov,
+            'country_name': country,
+            'location': city + ', ' + state_prov + ', ' + country,
+            'rookie_year': self.year - self.random.randint(0, min(25, self.year - 1992)),
+            'website': None,
+            'motto': None
+        }
+        self.abilities[team['key']] = {
+            'baseline': self.random.uniform(0.5, 1),
+            'auton_cube': self.random.choice(['n/a', 'exchange', 'switch', 'switch', 'scale']),
+            'cubes_exchange': self.random.uniform(0, 4),
+            'cubes_switch_own': self.random.uniform(0, 5),
+            'cubes_scale': self.random.uniform(0, 4) ** 1.3,
+            'cubes_switch_opponent': self.random.uniform(0, 1.5),
+            'climb': self.random.betavariate(1.2, 2.5),
+            'strategy': self.random.choice(self.strategies)
+        }
+        return team
+
+    # Every team plays the same number of matches (give or take one), never twice in the same match
+    def schedule(self, team_keys, matches):
+        played = {t: 0 for t in team_keys}
+        schedule = []
+        for _ in range(matches):
+            teams = sorted(team_keys, key=lambda t: (played[t], self.random.random()))[:6]
+            for team_key in teams:
+                played[team_key] += 1
+            self.random.shuffle(teams)
+            schedule.append({'blue': teams[:3], 'red': teams[3:]})
+        return schedule
+
+    def event(self, number, team_keys, matches=80, week=None):
+        week = week if week is not None else (number - 1) % 7
+        start_date = datetime(self.year, 3, 1) + timedelta(weeks=week, days=self.random.randint(0, 1))
+        city, state_prov, country = self.random.choice(self.cities)
+        key = str(self.year) + self.event_code + str(number)
+        # Two out of three events are district events
+        district = None
+        if number % 3:
+            abbreviation, display_name = self.districts[number % len(self.districts)]
+            district = {
+                'abbreviation': abbreviation,
+                'display_name': display_name,
+                'key': str(self.year) + abbreviation,
+                'year': self.year
+            }
+        event = {
+            'key': key,
+            'year': self.year,
+            'event_code': self.event_code + str(number),
+            'name': city + (' District Event ' if district else ' Regional ') + str(number),
+            'short_name': city,
+            'event_type': 1 if district else 0,
+            'event_type_string': 'District' if district else 'Regional',
+            'event_district': district['abbreviation'] if district else None,
+            'event_district_string': district['display_name'] if district else None,
+            'week': week,
+            'start_date': start_date.strftime('%Y-%m-%d'),
+            'end_date': (start_date + timedelta(days=2)).strftime('%Y-%m-%d'),
+            'city': city,
+            'state_prov': state_prov,
+            'country': country,
+            'location': city + ', ' + state_prov + ', ' + country,
+            'venue_address': None,
+            'website': None,
+            'district': district,
+            'webcast': [],
+            'teams': sorted(team_keys),
+            'matches': []
+        }
+
+        # Qualifications from 9am, 7 minutes apart, 40 matches a day
+        start = (start_date + timedelta(days=1, hours=9)).timestamp()
+        for idx, alliances in enumerate(self.schedule(team_keys, matches)):
+            event['matches'].append(self.match(key, 'qm', 1, idx + 1, alliances,
+                                               start + (idx // 40) * 86400 + (idx % 40) * 420))
+        event['rankings'] = self.rankings(event['matches'])
+
+        # Eliminations on the last afternoon, best of three
+        if len(team_keys) >= 24:
+            event['alliances'] = self.alliance_selection(event['rankings'], team_keys)
+            time = (start_date + timedelta(days=2, hours=13)).timestamp()
+            seeds = [a['picks'] for a in event['alliances']]
+            sets = [('qf', 1, 0, 7), ('qf', 2, 3, 4), ('qf', 3, 1, 6), ('qf', 4, 2, 5)]
+            while sets:
+                winners = []
+                for comp_level, set_number, red, blue in sets:
+                    wins = {'red': 0, 'blue': 0}
+                    match_number = 0
+                    while max(wins.values()) < 2 and match_number < 5:  # ties are replayed
+                        match_number += 1
+                        match = self.match(key, comp_level, set_number, match_number,
+                                           {'red': seeds[red], 'blue': seeds[blue]}, time)
+                        event['matches'].append(match)
+                        if match['winning_alliance']:
+                            wins[match['winning_alliance']] += 1
+                        time += 600
+                    winners.append(red if wins['red'] >= wins['blue'] else blue)
+                comp_level = {'qf': 'sf', 'sf': 'f'}.get(sets[0][0])
+                sets = [(comp_level, i // 2 + 1, winners[i], winners[i + 1]) for i in range(0, len(winners) - 1, 2)]
+        return event
+
+    def match(self, event_key, comp_level, set_number, match_number, alliances, time):
+        match = {
+            'key': event_key + '_' + comp_level + (str(set_number) + 'm' if comp_level != 'qm' else '') + str(
+                match_number),
+            'event_key': event_key,
+            'comp_level': comp_level,
+            'set_number': set_number,
+            'match_number': match_number,
+            'time': int(time),
+            'actual_time': int(time + self.random.randint(0, 300)),
+            'videos': [],
+            'alliances': {},
+            'score_breakdown': {},
+            'performances': {}  # not TBA data, dropped before storing
+        }
+        for color in ['blue', 'red']:
+            performances = [self.performance(t) for t in alliances[color]]
+            breakdown = self.breakdown(performances)
+            match['alliances'][color] = {
+                'teams': alliances[color],
+                'team_keys': alliances[color],
+                'surrogate_team_keys': [],
+                'dq_team_keys': [],
+                'score': breakdown['totalPoints']
+            }
+            match['score_breakdown'][color] = breakdown
+            match['performances'].update(dict(zip(alliances[color], performances)))
+
+        scores = {c: match['alliances'][c]['score'] for c in match['alliances']}
+        match['winning_alliance'] = '' if scores['blue'] == scores['red'] else max(scores, key=scores.get)
+        for color in match['score_breakdown']:
+            breakdown = match['score_breakdown'][color]
+            breakdown['rp'] = (2 if match['winning_alliance'] == color else 1 if not match['winning_alliance'] else 0) + \
+                int(breakdown['autoQuestRankingPoint']) + int(breakdown['faceTheBossRankingPoint'])
+        return match
+
+    # One team's play in one match, drawn from its ability
+    def performance(self, team_key):
+        ability = self.abilities[team_key]
+
+        def cubes(mean):
+            return max(0, int(round(self.random.gauss(mean, 1 + mean / 3))))
+
+        climb = self.random.random()
+        return {
+            'auton_crossed_baseline': 'Y' if self.random.random() < ability['baseline'] else 'N',
+            'auton_cube_position': ability['auton_cube'] if self.random.random() < 0.8 else 'n/a',
+            'cubes_exchange': cubes(ability['cubes_exchange']),
+            'cubes_switch_own': cubes(ability['cubes_switch_own']),
+            'cubes_scale': cubes(ability['cubes_scale']),
+            'cubes_switch_opponent': cubes(ability['cubes_switch_opponent']),
+            'end_position': 'climbed' if climb < ability['climb'] else 'parked' if climb < 0.9 else 'n/a'
+        }
+
+    # An alliance's 2018 score_breakdown, with switch and scale ownership approximated from the cubes placed
+    def breakdown(self, performances):
+        auton = [p['auton_cube_position'] for p in performances]
+        climbed = [p['end_position'] in ['climbed', 'picked_up'] for p in performances]
+        parked = [p['end_position'] == 'parked' for p in performances]
+        crossed = [p['auton_crossed_baseline'] == 'Y' for p in performances]
+        breakdown = {
+            'autoRunPoints': 5 * sum(crossed),
+            'autoSwitchOwnershipSec': min(15, 7 * auton.count('switch')),
+            'autoScaleOwnershipSec': min(15, 6 * auton.count('scale')),
+            'teleopSwitchOwnershipSec': min(135, sum([5 * p['cubes_switch_own'] for p in performances])),
+            'teleopScaleOwnershipSec': min(135, sum([6 * p['cubes_scale'] for p in performances])),
+            'vaultPoints': min(45, 5 * sum([p['cubes_exchange'] for p in performances])),
+            'endgamePoints': 30 * sum(climbed) + 5 * sum(parked),
+            'foulCount': int(self.random.expovariate(1)),  # committed by the other alliance
+            'techFoulCount': 1 if self.random.random() < 0.05 else 0,
+            'adjustPoints': 0
+        }
+        for idx, p in enumerate(performances):
+            breakdown['autoRobot' + str(idx + 1)] = 'AutoRun' if crossed[idx] else 'None'
+            breakdown['endgameRobot' + str(idx + 1)] = 'Climbing' if climbed[idx] else 'Parking' if parked[idx] \
+                else 'None'
+        vault = min(9, sum([p['cubes_exchange'] for p in performances]))
+        breakdown['vaultForceTotal'] = min(3, vault)
+        breakdown['vaultBoostTotal'] = min(3, max(0, vault - 3))
+        breakdown['vaultLevitateTotal'] = min(3, max(0, vault - 6))
+
+        breakdown['autoOwnershipPoints'] = 2 * (breakdown['autoSwitchOwnershipSec'] +
+                                                breakdown['autoScaleOwnershipSec'])
+        breakdown['autoPoints'] = breakdown['autoRunPoints'] + breakdown['autoOwnershipPoints']
+        breakdown['teleopOwnershipPoints'] = breakdown['teleopSwitchOwnershipSec'] + \
+            breakdown['teleopScaleOwnershipSec']
+        breakdown['teleopPoints'] = breakdown['teleopOwnershipPoints'] + breakdown['vaultPoints'] + \
+            breakdown['endgamePoints']
+        breakdown['foulPoints'] = 5 * breakdown['foulCount'] + 25 * breakdown['techFoulCount']
+        breakdown['totalPoints'] = breakdown['autoPoints'] + breakdown['teleopPoints'] + breakdown['foulPoints']
+        breakdown['autoQuestRankingPoint'] = all(crossed) and breakdown['autoSwitchOwnershipSec'] > 0
+        breakdown['faceTheBossRankingPoint'] = sum(climbed) + (1 if breakdown['vaultLevitateTotal'] == 3 else 0) >= 3
+        return breakdown
+
+    # Qualification rankings, shaped like TheBlueAlliance.event_rankings()
+    @staticmethod
+    def rankings(matches):
+        teams = {}
+        for match in [m for m in matches if m['comp_level'] == 'qm']:
+            for color, alliance in match['alliances'].items():
+                breakdown = match['score_breakdown'][color]
+                for team_key in alliance['teams']:
+                    team = teams.setdefault(team_key, {
+                        'team': team_key, 'rp': 0, 'park_climb_points': 0, 'auto_points': 0, 'ownership_points': 0,
+                        'vault_points': 0, 'wins': 0, 'losses': 0, 'ties': 0, 'played': 0, 'dq': 0
+                    })
+                    team['rp'] += breakdown['rp']
+                    team['park_climb_points'] += breakdown['endgamePoints']
+                    team['auto_points'] += breakdown['autoPoints']
+                    team['ownership_points'] += breakdown['autoOwnershipPoints'] + breakdown['teleopOwnershipPoints']
+                    team['vault_points'] += breakdown['vaultPoints']
+                    team['wins' if match['winning_alliance'] == color else
+                         'ties' if not match['winning_alliance'] else 'losses'] += 1
+                    team['played'] += 1
+        for team in teams.values():
+            team['ranking_score'] = round(team.pop('rp') / max(1, team['played']), 2)
+        ranked = sorted(teams.values(), key=lambda t: (-t['ranking_score'], -t['park_climb_points'],
+                                                       -t['auto_points'], t['team']))
+        for idx, team in enumerate(ranked):
+            team['rank'] = idx + 1
+        return {t['team']: t for t in ranked}
+
+    # Eight alliances: the best ranked teams not yet picked captain, picking the best remaining teams in serpentine
+    def alliance_selection(self, rankings, team_keys):
+        remaining = sorted(team_keys, key=lambda t: rankings[t]['rank'] if t in rankings else len(team_keys))
+        best = sorted(team_keys, key=lambda t: -self.expected(t))
+        alliances = []
+        for pick in range(3):
+            for idx in range(8) if pick != 1 else reversed(range(8)):
+                if pick == 0:
+                    team_key = remaining[0]
+                    alliances.append({'name': 'Alliance ' + str(idx + 1), 'picks': [], 'declines': [], 'backup': None})
+                else:
+                    team_key = [t for t in best if t in remaining][0]
+                alliances[idx]['picks'].append(team_key)
+                remaining.remove(team_key)
+        return alliances
+
+    # A team's average points, for alliance selection
+    def expected(self, team_key):
+        ability = self.abilities[team_key]
+        return 5 * ability['baseline'] + 30 * ability['climb'] + 5 * ability['cubes_exchange'] + \
+            5 * ability['cubes_switch_own'] + 6 * ability['cubes_scale']
+
+    # What www/scouting/2018/match.html submits
+    def scouting_match(self, match, team_key, scouter):
+        color = 'blue' if team_key in match['alliances']['blue']['teams'] else 'red'
+        strategy = self.abilities[team_key]['strategy']
+        return dict(match['performances'][team_key], **{
+            'event_key': match['event_key'],
+            'match_key': match['key'],
+            'team_key': team_key,
+            'team_color': color,
+            'scouter': scouter,
+            'auton_strategy': strategy if self.random.random() < 0.7 else '',
+            'teleop_strategy': strategy if self.random.random() < 0.7 else '',
+            'comments_offense': self.random.choice(['', '', 'Fast', 'Dropped cubes', 'Tipped over', 'Great driver']),
+            'comments_defense': self.random.choice(['', '', '', 'Pushed hard', 'Blocked the scale'])
+        })
+
+    # What www/scouting/2018/pit.html submits
+    def scouting_pit(self, event_key, team_key, scouter):
+        ability = self.abilities[team_key]
+        return {
+            'event_key': event_key,
+            'team_key': team_key,
+            'scouter': scouter,
+            'robot_height': self.random.randint(30, 55),
+            'robot_weight': self.random.randint(80, 120),
+            'drivetrain': self.random.choice(['tank', 'tank', 'mecanum', 'swerve', 'butterfly']),
+            'drivetrain_experience': self.random.choice(['', 'First year', 'Used it for years']),
+            'cube_lifter': 'elevator' if ability['cubes_scale'] > 2 else self.random.choice(['none', 'arm', 'lift']),
+            'cube_intake': self.random.choice(['rollers', 'rollers', 'gripper', 'other']),
+            'cube_scoring_location': [l for k, l in [('cubes_exchange', 'exchange'), ('cubes_switch_own', 'switch'),
+                                                     ('cubes_scale', 'scale')] if ability[k] > 1],
+            'auton_strategy': ability['strategy'],
+            'teleop_strategy': ability['strategy'],
+            'avg_cubes_exchange': int(round(ability['cubes_exchange'])),
+            'avg_cubes_switch': int(round(ability['cubes_switch_own'])),
+            'avg_cubes_scale': int(round(ability['cubes_scale'])),
+            'climber': 'Y' if ability['climb'] > 0.3 else 'N',
+            'can_lift': 'Y' if ability['climb'] > 0.7 else 'N',
+            'climb_time': self.random.randint(5, 30) if ability['climb'] > 0.3 else '',
+            'common_robot_problems': '',
+            'driver_practice': self.random.choice(['', 'A few hours', 'Every day for a week'])
+        }
+
+    # Write everything: teams, events and their scouting (through the change log, like real scouting)
+    def generate(self, mongo, events=1, teams=(40, 60), matches=80, scouters=6, progress=None):
+        low, high = teams
+        pool = sorted(self.random.sample(range(1, 8000), max(high, events * (low + high) // 5)))
+        tba_teams = [self.team(n) for n in pool]
+        now = datetime.utcnow()
+        mongo.tba_teams.bulk_write([pymongo.UpdateOne({'key': t['key']}, {
+            '$set': dict(t, modified_timestamp=now, updated_timestamp=now),
+            '$setOnInsert': {'created_timestamp': now}
+        }, upsert=True) for t in tba_teams], ordered=False)
+
+        names = self.scouters[:scouters] + ['Scouter ' + str(i + 1) for i in range(len(self.scouters), scouters)]
+        for number in range(1, events + 1):
+            team_keys = [t['key'] for t in self.random.sample(tba_teams, self.random.randint(low, high))]
+            event = self.event(number, team_keys, matches)
+            performances = {m['key']: m.pop('performances') for m in event['matches']}
+            mongo.tba_events.update_one({'key': event['key']}, {
+                '$set': dict(event, modified_timestamp=now, updated_timestamp=now),
+                '$setOnInsert': {'created_timestamp': now}
+            }, upsert=True)
+
+            # Each scouter watches one driver station for every match, and pit scouts their share of the teams
+            for match in [m for m in event['matches'] if m['comp_level'] == 'qm']:
+                match['performances'] = performances[match['key']]
+                stations = match['alliances']['blue']['teams'] + match['alliances']['red']['teams']
+                for station, team_key in enumerate(stations[:len(names)]):
+                    mongo.scouting_match_update(self.scouting_match(match, team_key, names[station]))
+                del match['performances']
+            for idx, team_key in enumerate(team_keys):
+                if names:
+                    mongo.scouting_pit_update(self.scouting_pit(event['key'], team_key, names[idx % len(names)]))
+
+            if progress is not None:
+                progress(event)
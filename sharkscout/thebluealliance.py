@@ -1,4 +1,5 @@
 import sys
+import time
 
 import backoff
 import json
@@ -7,6 +8,13 @@ import re
 import requests
 from datetime import date
 
+import sharkscout
+
+
+# backoff's on_backoff handler for TheBlueAlliance._get()
+def _retried(details):
+    sharkscout.Metrics.inc('sharkscout_tba_retries_total', (('family', sharkscout.Metrics.family(details['args'][1])),))
+
 
 class TheBlueAlliance(object):
     tba_auth_key = None
@@ -19,8 +27,10 @@ class TheBlueAlliance(object):
                 if not self.__class__.tba_auth_key:
                     raise Exception('Invalid tba_auth_key in config.json')
         self.cache = cache
+        self.requests = 0  # made through this instance
+        self.progress = None  # called with self.requests after each one (see Jobs)
 
-    @backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=3)
+    @backoff.on_exception(backoff.expo, requests.exceptions.RequestException, max_tries=3, on_backoff=_retried)
     def _get(self, endpoint, ignore_cache=False):
         if self.__class__.tba_auth_key is None:
             return {}
@@ -33,7 +43,14 @@ class TheBlueAlliance(object):
             if endpoint in self.cache:
                 headers['If-Modified-Since'] = self.cache[endpoint]
 
+        start = time.perf_counter()
+        labels = (('family', sharkscout.Metrics.family(endpoint)),)
         response = requests.get('https://www.thebluealliance.com/api/v3/' + endpoint, headers=headers, timeout=5)
+        sharkscout.Metrics.observe('sharkscout_tba_request_duration_seconds', time.perf_counter() - start, labels)
+        sharkscout.Metrics.inc('sharkscout_tba_requests_total', labels + (('code', str(response.status_code)),))
+        self.requests += 1
+        if self.progress is not None:
+            self.progress(self.requests)
 
         # Not modified
         if response.status_code == 304:
@@ -0,0 +1,121 @@
+import numpy
+
+
+# Trend lines and rolling averages of the per-match series that scouting stats chart, for every team and every charted
+#  stat at once: the series are padded into one NaN-filled matrix and the same five models the browser used to try one
+#  chart at a time (linear, exponential, logarithmic, power and quadratic) are fit to every row together, keeping each
+#  row's best fit by R².
+class Trends(object):
+    window = 3  # matches per rolling average
+
+    # The series a stats cell charts: one list of numbers, or the average of a dict's lists (see stats_cell()), only
+    #  counting their numbers (None where a match has none)
+    @staticmethod
+    def series(cell):
+        if isinstance(cell, list):
+            if cell and [v for v in cell if str(v).isdigit()] == cell:
+                return [float(v) for v in cell]
+        elif isinstance(cell, dict):
+            datasets = [cell[k] for k in sorted(cell) if isinstance(cell[k], list)]
+            if datasets:
+                length = max([len(d) for d in datasets])
+                numbers = [[float(d[i]) for d in datasets if i < len(d) and str(d[i]).isdigit()] for i in range(length)]
+                if [n for n in numbers if n]:
+                    return [float(numpy.mean(n)) if n else None for n in numbers]
+        return None
+
+    # Add {key: {'trend': [...], 'rolling': [...]}} as '_trends' to every row of individual stats
+    @classmethod
+    def attach(cls, individual):
+        cells = []
+        series = []
+        for row in individual:
+            row['_trends'] = {}
+            for key, cell in row.items():
+                if key.startswith('_'):
+                    continue
+                values = cls.series(cell)
+                if values:
+                    cells.append((row, key))
+                    series.append(values)
+        if not series:
+            return individual
+
+        length = max([len(s) for s in series])
+        y = numpy.full((len(series), length), numpy.nan)
+        for idx, values in enumerate(series):
+            y[idx, :len(values)] = [numpy.nan if v is None else v for v in values]
+        trend = cls.trend(y)
+        rolling = cls.rolling(y)
+        for idx, (row, key) in enumerate(cells):
+            count = len(series[idx])
+            row['_trends'][key] = {
+                'trend': numpy.round(trend[idx, :count], 2).tolist(),
+                'rolling': [None if numpy.isnan(v) else v for v in numpy.round(rolling[idx, :count], 2).tolist()]
+            }
+        return individual
+
+    # Least squares y = a + b·x of every row, only where mask is set
+    @staticmethod
+    def _line(x, y, mask):
+        count = mask.sum(axis=1)
+        x = numpy.where(mask, x, 0)
+        y = numpy.where(mask, y, 0)
+        sx, sy = x.sum(axis=1), y.sum(axis=1)
+        denominator = count * (x * x).sum(axis=1) - sx * sx
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            b = numpy.where(denominator != 0, (count * (x * y).sum(axis=1) - sx * sy) / denominator, 0)
+            a = numpy.where(count > 0, (sy - b * sx) / count, 0)
+        return a[:, None], b[:, None]
+
+    # Each row's best fitting model, evaluated at every x
+    @classmethod
+    def trend(cls, y):
+        mask = ~numpy.isnan(y)
+        x = numpy.broadcast_to(numpy.arange(1, y.shape[1] + 1, dtype=float), y.shape)
+        positive = mask & (numpy.nan_to_num(y) > 0)
+        logs = numpy.log(numpy.where(positive, y, 1))
+        fits = []
+
+        a, b = cls._line(x, y, mask)
+        fits.append(a + b * x)
+        # Exponential and power curves only fit series without zeros
+        a, b = cls._line(x, logs, mask)
+        fits.append(numpy.where((positive == mask).all(axis=1)[:, None], numpy.exp(a + b * x), numpy.nan))
+        a, b = cls._line(numpy.log(x), y, mask)
+        fits.append(a + b * numpy.log(x))
+        a, b = cls._line(numpy.log(x), logs, mask)
+        fits.append(numpy.where((positive == mask).all(axis=1)[:, None], numpy.exp(a) * x ** b, numpy.nan))
+
+        # Quadratic, from a stack of 3x3 normal equations (too few points for one: no fit)
+        powers = numpy.stack([numpy.where(mask, x ** p, 0).sum(axis=1) for p in range(5)], axis=1)
+        normal = numpy.stack([powers[:, i:i + 3] for i in range(3)], axis=1)
+        right = numpy.stack([numpy.where(mask, x ** p * y, 0).sum(axis=1) for p in range(3)], axis=1)
+        enough = mask.sum(axis=1) >= 3
+        coefficients = numpy.zeros((len(y), 3))
+        if enough.any():
+            coefficients[enough] = numpy.linalg.solve(normal[enough], right[enough][:, :, None])[:, :, 0]
+        fits.append(numpy.where(enough[:, None], coefficients[:, :1] + coefficients[:, 1:2] * x +
+                                coefficients[:, 2:] * x * x, numpy.nan))
+
+        # R² of each fit, against the series itself
+        fits = numpy.stack(fits)
+        mean = numpy.nanmean(numpy.where(mask, y, numpy.nan), axis=1)[:, None]
+        total = numpy.where(mask, (y - mean) ** 2, 0).sum(axis=1)
+        residual = numpy.where(mask, (y - fits) ** 2, 0).sum(axis=2)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            r2 = numpy.where(total > 0, 1 - residual / total, numpy.nan)
+        r2 = numpy.where(numpy.isnan(fits).any(axis=2), numpy.nan, r2)
+        best = numpy.argmax(numpy.nan_to_num(r2, nan=-numpy.inf), axis=0)
+        return fits[best, numpy.arange(len(y))]
+
+    # Trailing average of the last (up to) window matches
+    @classmethod
+    def rolling(cls, y):
+        mask = ~numpy.isnan(y)
+        sums = numpy.cumsum(numpy.where(mask, y, 0), axis=1)
+        counts = numpy.cumsum(mask, axis=1)
+        sums[:, cls.window:] = sums[:, cls.window:] - sums[:, :-cls.window]
+        counts[:, cls.window:] = counts[:, cls.window:] - counts[:, :-cls.window]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.where(mask, sums / counts, numpy.nan)
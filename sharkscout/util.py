@@ -1,5 +1,8 @@
 import base64
+import bson
 import collections
+import concurrent.futures
+import json
 import os
 import psutil
 import re
@@ -7,6 +10,7 @@ import requests
 import socket
 import string
 import urllib.parse
+from datetime import datetime, date
 
 
 class Util(object):
@@ -37,6 +41,40 @@ class Util(object):
     def isnumeric(val):
         return str(val).lstrip('-').replace('.', '', 1).isdigit()
 
+    # Compact JSON, with BSON types converted to plain values
+    @staticmethod
+    def json(obj):
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False, check_circular=False,
+                          default=Util._json_default)
+
+    @staticmethod
+    def _json_default(obj):
+        if isinstance(obj, bson.ObjectId):
+            return str(obj)
+        if isinstance(obj, datetime):
+            # pymongo returns naive UTC datetimes
+            return obj.isoformat() + ('Z' if obj.tzinfo is None else '')
+        if isinstance(obj, date):
+            return obj.isoformat()
+        if isinstance(obj, (set, tuple)):
+            return list(obj)
+        return str(obj)
+
+    # function(item) for every item, on `workers` threads, taking items only as threads free up rather than all up
+    #  front (so a cursor is never read into memory whole), yielding the results as they're done
+    @staticmethod
+    def map_bounded(function, items, workers=3):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for item in items:
+                if len(pending) >= workers * 2:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                pending.add(pool.submit(function, item))
+            for future in concurrent.futures.as_completed(pending):
+                yield future.result()
+
     @staticmethod
     def open_port(preferred=0):
         # Check for other processes listening on the port
@@ -0,0 +1,125 @@
+import cherrypy
+import cherrypy.process.plugins
+import pymongo
+import pymongo.errors
+import threading
+from datetime import datetime
+
+import sharkscout
+
+
+# Turns writes to watched collections, including writes by other SharkScout processes sharing the database, into
+#  engine events: bus.publish(Watcher.channel, collection, document) (document is None when it isn't known, e.g.
+#  deletes found by polling). Uses a change stream when mongod supports one, otherwise polls modified_timestamp.
+class Watcher(cherrypy.process.plugins.SimplePlugin):
+    channel = 'sharkscout-change'
+    collections = ['jobs', 'scouting', 'scouting_matches', 'tba_events', 'tba_teams']
+    poll_interval = 2  # seconds
+    nudge = None  # multiprocessing.Event another process (the --gateway) sets after writing, to poll right away
+
+    # Class-level, shared by every request. Don't rebind these!
+    versions = {}  # {collection: version}, bumped on every change, for anything that caches data
+    versions_lock = threading.Lock()
+
+    def __init__(self, bus):
+        super().__init__(bus)
+        self.thread = None
+        self.stopped = threading.Event()
+        self.mode = None
+
+    # (None for a collection nothing is watching, whose changes would go unnoticed: don't cache what's read from it)
+    @classmethod
+    def version(cls, *collections):
+        return tuple([cls.versions.get(c) for c in collections])
+
+    def start(self):
+        with self.versions_lock:
+            for collection in self.collections:
+                self.versions.setdefault(collection, 0)
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name='Watcher', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(5)
+            self.thread = None
+
+    def changed(self, collection, document):
+        with self.versions_lock:
+            self.versions[collection] = self.versions.get(collection, 0) + 1
+        self.bus.publish(self.channel, collection, document)
+
+    def run(self):
+        database = sharkscout.Mongo().shark_scout
+        try:
+            self.watch(database)
+        except pymongo.errors.OperationFailure as e:
+            # Standalone mongod (change streams need a replica set), old mongod, or the SQLite backend
+            self.bus.log('Change streams unavailable (' + str(e) + '), polling every ' + str(self.poll_interval) + 's')
+            self.poll(database)
+
+    def watch(self, database):
+        resume_token = None
+        while not self.stopped.is_set():
+            try:
+                with database.watch([{'$match': {'ns.coll': {'$in': self.collections}}}],
+                                    full_document='updateLookup', resume_after=resume_token,
+                                    max_await_time_ms=1000) as stream:
+                    self.mode = 'change stream'
+                    while not self.stopped.is_set():
+                        change = stream.try_next()
+                        resume_token = stream.resume_token
+                        if change is not None:
+                            self.changed(change['ns']['coll'], change.get('fullDocument') or change.get('documentKey'))
+            except pymongo.errors.OperationFailure:
+                if self.mode is None:
+                    raise
+                self.stopped.wait(1)
+            except pymongo.errors.PyMongoError as e:
+                # Lost the connection, pick up where the stream left off
+                self.bus.log('Change stream interrupted: ' + repr(e))
+                self.stopped.wait(1)
+
+    # Wait out a poll interval, or until nudged. False once stopped
+    def wait(self):
+        if self.nudge is None:
+            return not self.stopped.wait(self.poll_interval)
+        if self.nudge.wait(self.poll_interval):
+            self.nudge.clear()
+        return not self.stopped.is_set()
+
+    def poll(self, database):
+        self.mode = 'polling'
+
+        # {collection: [newest modified_timestamp, _ids seen with it, document count]}
+        state = {}
+        for name in self.collections:
+            newest = database[name].find_one({'modified_timestamp': {'$exists': True}}, {'modified_timestamp': 1},
+                                             sort=[('modified_timestamp', pymongo.DESCENDING)])
+            timestamp = newest['modified_timestamp'] if newest else datetime.utcfromtimestamp(0)
+            seen = set([d['_id'] for d in database[name].find({'modified_timestamp': timestamp}, {'_id': 1})])
+            state[name] = [timestamp, seen, database[name].estimated_document_count()]
+
+        while self.wait():
+            for name in self.collections:
+                try:
+                    collection = database[name]
+                    timestamp, seen, count = state[name]
+                    documents = [d for d in collection.find({'modified_timestamp': {'$gte': timestamp}}).sort(
+                        'modified_timestamp', pymongo.ASCENDING) if d['_id'] not in seen]
+                    for document in documents:
+                        if document['modified_timestamp'] != timestamp:
+                            timestamp = document['modified_timestamp']
+                            seen = set()
+                        seen.add(document['_id'])
+                        self.changed(name, document)
+
+                    # Inserts without a timestamp, and deletes
+                    new_count = collection.estimated_document_count()
+                    if new_count != count and not documents:
+                        self.changed(name, None)
+                    state[name] = [timestamp, seen, new_count]
+                except pymongo.errors.PyMongoError as e:
+                    self.bus.log('Couldn\'t poll ' + name + ': ' + repr(e))
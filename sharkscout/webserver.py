@@ -1,15 +1,23 @@
 import sys
 import time
 
+import base64
 import cherrypy
+import cherrypy._cpserver
+import collections
+import copy
 import csv
 import genshi.core
+import genshi.output
 import genshi.template
+import genshi.template.base
+import gzip
+import io
 import json
+import mimetypes
+import multiprocessing
 import os
-import random
-import string
-import tempfile
+import re
 import threading
 import ws4py.server.cherrypyserver
 import ws4py.websocket
@@ -19,7 +27,13 @@ import sharkscout
 
 
 class WebServer(threading.Thread):
-    def __init__(self, port):
+    def __init__(self, port, workers=1, gateway=None):
+        self.workers = workers  # >1: forked processes sharing the port, instead of this thread
+        self.processes = []
+        # With a Gateway holding the WebSockets, pages point browsers at its port, and it nudges every process's
+        #  Watcher after its writes
+        CherryServer.websocket_port = gateway
+        self.nudges = [multiprocessing.get_context('fork').Event() for _ in range(max(1, workers))] if gateway else []
         sessions_path = os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), 'sessions'))
         if not os.path.exists(sessions_path):
             os.mkdir(sessions_path)
@@ -28,45 +42,128 @@ class WebServer(threading.Thread):
             'global': {
                 'server.socket_host': '0.0.0.0',
                 'server.socket_port': port,
+                'server.thread_pool': sharkscout.Admission.thread_pool,
                 'engine.autoreload.on': False
             },
             '/': {
                 'tools.sessions.on': True,
-                'tools.sessions.locking': 'early',
-                'tools.sessions.storage_class': cherrypy.lib.sessions.FileSession,
+                'tools.sessions.locking': 'explicit',  # MemorySession merges writes per key instead
+                'tools.sessions.storage_class': sharkscout.MemorySession,
                 'tools.sessions.storage_path': sessions_path,
+                'tools.sessions.snapshot_freq': 1,  # minute
                 'tools.sessions.timeout': 12 * 60,  # 12 hours
                 'tools.gzip.on': True,
-                'tools.gzip.mime_types': ['application/*', 'image/*', 'text/*']
+                'tools.gzip.mime_types': ['application/*', 'image/*', 'text/*'],
+                'tools.queries.on': True,  # Mongo commands per request, Server-Timing header
+                'tools.metrics.on': True,  # handler latency histograms
+                'tools.admission.on': True,  # per-class concurrency limits, heavy requests can't starve scouting
+                'tools.request_profiler.on': sharkscout.RequestProfiler.enabled  # ?profile=timing|report|flame
             },
             '/static': {
-                'tools.staticdir.on': True,
-                'tools.staticdir.dir': os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), 'www/static')),
-                'tools.expires.on': True,
-                'tools.expires.secs': 12 * 60 * 60,  # 12 hours
+                'tools.precompressed.on': True,  # staticdir that serves .gz siblings and sets Cache-Control
+                'tools.precompressed.section': '/static',
+                'tools.precompressed.dir': os.path.abspath(os.path.join(os.path.dirname(sys.argv[0]), 'www/static')),
+                'tools.gzip.on': False,  # everything compressible was compressed at build time
+                'tools.queries.on': False,
+                'tools.metrics.on': False,
+                'tools.admission.on': False,
                 'tools.sessions.on': False  # otherwise locking throws frequent 500 errors
             },
+            '/api': {
+                'tools.etags.on': True,  # 304 on If-None-Match
+                'tools.etags.autotags': True,
+                'tools.sessions.on': False,  # stateless
+                'error_page.default': api_error
+            },
+            '/metrics': {
+                'tools.sessions.on': False,  # scraped, not browsed
+                'tools.queries.on': False,
+                'tools.metrics.on': False,
+                'tools.admission.on': False
+            },
+            '/fragment': {
+                'tools.etags.on': True,  # 304 on If-None-Match, for sections that haven't changed
+                'tools.etags.autotags': True
+            },
+            '/sync': {
+                'tools.sessions.on': False,  # stateless
+                'error_page.default': api_error
+            },
             '/ws': {
                 'tools.websocket.on': True,
                 'tools.websocket.handler_cls': WebSocketServer,
+                'tools.websocket.protocols': [sharkscout.Compact.protocol],  # offered, JSON otherwise
                 'tools.sessions.on': False,  # unnecessary
                 'tools.gzip.on': False,  # otherwise websockets will always fail
+                'tools.queries.on': False,
+                'tools.metrics.on': False,
                 'tools.expires.on': False  # otherwise websockets will usually not connect
             }
         }
+        if self.workers > 1:
+            # Every process binds the port with SO_REUSEPORT and the kernel spreads connections across them, sessions
+            #  have to be shared through the database (and WebSocket broadcasts go through the Watcher)
+            self.cherry_config['/']['tools.sessions.storage_class'] = sharkscout.MongoSession
         self.cherry = None
         threading.Thread.__init__(self)
 
+        # Bundle and precompress static files before serving any of them
+        sharkscout.Assets().build()
+
     def run(self):
         ws4py.server.cherrypyserver.WebSocketPlugin(cherrypy.engine).subscribe()
+        sharkscout.Watcher(cherrypy.engine).subscribe()
+        cherrypy.engine.subscribe(sharkscout.Watcher.channel, WebSocketServer.changed)
         cherrypy.tools.websocket = ws4py.server.cherrypyserver.WebSocketTool()
+        cherrypy.tools.precompressed = cherrypy._cptools.HandlerTool(precompressed)
+        cherrypy.tools.queries = cherrypy.Tool('before_finalize', sharkscout.QueryProfiler.finalize)
+        cherrypy.tools.metrics = cherrypy.Tool('on_start_resource', sharkscout.Metrics.request_start)
+        cherrypy.tools.admission = cherrypy.Tool('on_start_resource', sharkscout.Admission.request_start, priority=60)
+        cherrypy.tools.request_profiler = cherrypy.Tool('before_handler', sharkscout.RequestProfiler.request_start,
+                                                        priority=10)
+        sharkscout.Metrics.gauge('sharkscout_websocket_sockets', lambda: len(WebSocketServer.sockets))
+        sharkscout.Admission.gauges()
         self.cherry = cherrypy.quickstart(Index(), '', self.cherry_config)
 
+    def start(self):
+        if self.workers <= 1:
+            if self.nudges:
+                sharkscout.Watcher.nudge = self.nudges[0]
+            return super().start()
+        context = multiprocessing.get_context('fork')
+        self.processes = [context.Process(target=self.worker, args=(i,), name='WebServer-' + str(i)) for i in
+                          range(self.workers)]
+        for process in self.processes:
+            process.start()
+
+    def worker(self, idx):
+        if self.nudges:
+            sharkscout.Watcher.nudge = self.nudges[idx]
+        sharkscout.Mongo.fork()
+        cherrypy.server.unsubscribe()
+        cherrypy.server = ReusePortServer()
+        cherrypy.server.subscribe()
+        self.run()
+
+    def join(self, timeout=None):
+        if not self.processes:
+            return super().join(timeout)
+        for process in self.processes:
+            process.join(timeout)
+
     def stop(self):
+        if self.processes:
+            for process in self.processes:
+                process.terminate()
+            for process in self.processes:
+                process.join()
+            return
         cherrypy.engine.exit()
 
     @property
     def running(self):
+        if self.processes:
+            return self.port in sharkscout.Util.pid_tree_ports(os.getpid())
         try:
             return cherrypy.server.running
         except:
@@ -74,24 +171,69 @@ class WebServer(threading.Thread):
 
     @property
     def port(self):
+        if self.processes:
+            return self.cherry_config['global']['server.socket_port']
         try:
             return cherrypy.server.bound_addr[1]
         except:
             return 0
 
 
+# cherrypy.server, but binding with SO_REUSEPORT so several processes can listen on the same port
+class ReusePortServer(cherrypy._cpserver.Server):
+    def start(self):
+        if not self.httpserver:
+            self.httpserver, self.bind_addr = self.httpserver_from_self()
+            self.httpserver.reuse_port = True
+        # ServerAdapter.start() without its check that the port is free, it won't be
+        self.interrupt = None
+        threading.Thread(target=self._start_http_thread, name='HTTPServer').start()
+        self.wait()
+        self.running = True
+        self.bus.log('Serving on ' + self.description)
+
+
+# Serve build-time .gz siblings of static files, with long-lived caching for content-hashed URLs
+def precompressed(section, dir):
+    request = cherrypy.serving.request
+    response = cherrypy.serving.response
+
+    if sharkscout.Assets.immutable(request.path_info, request.query_string):
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=' + str(12 * 60 * 60)  # 12 hours
+    response.headers['Vary'] = 'Accept-Encoding'
+
+    accept = request.headers.get('Accept-Encoding', '')
+    if request.method in ['GET', 'HEAD'] and re.search(r'\bgzip\b(?!;q=0(\.0+)?\b)', accept):
+        filename = os.path.normpath(os.path.join(dir, request.path_info[len(section):].lstrip('/')))
+        if filename.startswith(os.path.normpath(dir)) and os.path.isfile(filename + '.gz'):
+            content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            cherrypy.lib.static.serve_file(filename + '.gz', content_type)
+            response.headers['Content-Encoding'] = 'gzip'
+            return True
+
+    return cherrypy.lib.static.staticdir(section, dir)
+
+
 class CherryServer(object):
+    websocket_port = None  # the Gateway's, when it holds the WebSockets instead of /ws
+
     def __init__(self):
         self.www = os.path.normpath(os.path.join(os.path.dirname(sys.argv[0]), 'www'))
         self.template_loader = genshi.template.TemplateLoader(self.www, auto_reload=True)
+        self.assets = sharkscout.Assets(self.www)
+        self.compiled = {}
 
     def display(self, template, page=None):
         if page is None:
             page = {}
 
-        cherrypy.session['refresh'] = cherrypy.request.path_info
+        if cherrypy.session.get('refresh') != cherrypy.request.path_info:
+            cherrypy.session['refresh'] = cherrypy.request.path_info
 
         page['__TEMPLATE__'] = template
+        page['__WEBSOCKET_PORT__'] = self.websocket_port
         page['__CONTENT__'] = self.render(template, page)
         return self.render('www', page, False)
 
@@ -112,116 +254,69 @@ class CherryServer(object):
         else:
             page['year_defaulted'] = False
 
-        def strip(stream):
-            ns = None
-            for kind, data, pos in stream:
+        stream = self.compile(template, strip_html).generate(page=page, session=cherrypy.session)
+        return genshi.core.Markup(self.serialize(stream))
+
+    # stream.render('html'), split into timed phases when the request is being profiled
+    @staticmethod
+    def serialize(stream):
+        profiler = sharkscout.RequestProfiler.active()
+        if profiler is None:
+            return stream.render('html')
+        with profiler.phase('generate'):
+            stream = list(stream)
+        serializer = genshi.output.get_serializer('html')
+        with profiler.phase('filters'):
+            for filter_ in serializer.filters:
+                stream = list(filter_(stream))
+        serializer.filters = []
+        with profiler.phase('serialize'):
+            return ''.join(serializer(stream))
+
+    # Load a template with its static stream transforms already applied
+    #  (re-applied whenever the template loader reloads the template)
+    def compile(self, template, strip_html=True):
+        loaded = self.template_loader.load(template + '.html')
+        key = (template, strip_html)
+        if key not in self.compiled or self.compiled[key][0] is not loaded:
+            stream = list(self.transform(loaded.stream, strip_html))  # (also prepares the loaded template)
+            compiled = copy.copy(loaded)
+            compiled._stream = stream
+            self.compiled[key] = (loaded, compiled)
+        return self.compiled[key][1]
+
+    def transform(self, stream, strip_html=True):
+        stream = iter(stream)
+        for kind, data, pos in stream:
+            # Directives, transform their contents
+            if kind is genshi.template.base.SUB:
+                data = (data[0], list(self.transform(data[1], strip_html)))
+
+            if strip_html:
                 # Strip <!DOCTYPE>
                 if kind is genshi.core.DOCTYPE:
                     continue
-                if kind is genshi.core.START_NS:
-                    ns = data[1]
                 # Strip <html>
-                if ns is not None:
-                    if kind is genshi.core.START or kind is genshi.core.END:
-                        tag = data
-                        if type(tag) is tuple:
-                            tag = tag[0]
-                        tag = str(tag).replace('{' + ns + '}', '')
-                        if tag == 'html':
-                            continue
-                yield kind, data, pos
-
-        # Pack <link> and <script> to fewer files
-        def packer(stream):
-            # Find all files to be packed, included packed file
-            has_html = False
-            static_files = {}
-            ns = None
-            for kind, data, pos in stream:
-                strip = False
-                if kind is genshi.core.START_NS:
-                    ns = data[1]
-                if kind is genshi.core.START:
-                    tag = data
-                    if type(tag) is tuple:
-                        tag = tag[0]
-                    tag = str(tag).replace('{' + ns + '}', '')
-                    if tag == 'html':
-                        has_html = True
-                    if tag in ['link', 'script']:
-                        data_1 = list(data[1])
-                        for idx, attr in enumerate(data_1):
-                            if attr[0] in ['href', 'src']:
-                                # If this is a local file
-                                absolute = os.path.normpath(os.path.join(self.www, attr[1].lstrip('/')))
-                                if os.path.exists(absolute):
-                                    extension = os.path.splitext(attr[1])[1]
-                                    if extension.lstrip('.') in ['css', 'js']:
-                                        if extension not in static_files:
-                                            static_files[extension] = {}
-                                        directory = os.path.dirname(absolute)
-                                        if directory not in static_files[extension]:
-                                            static_files[extension][directory] = []
-                                        static_files[extension][directory].append(absolute)
-                                        if len(static_files[extension][directory]) > 1:
-                                            strip = True
-                                        data_1[idx] = (attr[0], os.path.join(os.path.dirname(attr[1]),
-                                                                             'packed' + extension).replace('\\', '/'))
-                        data = (data[0], genshi.core.Attrs(data_1))
-                if not strip:
-                    yield kind, data, pos
-
-            # If we're rendering the parent template with <html>
-            if has_html:
-                for extension in static_files:
-                    for directory in static_files[extension]:
-                        # Look for changed files
-                        mtime = 0
-                        for file in static_files[extension][directory]:
-                            mtime = max(mtime, os.path.getmtime(file))
-                        # Pack files
-                        packed = os.path.join(directory, 'packed' + extension)
-                        if not os.path.exists(packed) or os.path.getmtime(packed) < mtime:
-                            cherrypy.log('Packing "' + packed + '"')
-                            contents = b''
-                            for file in static_files[extension][directory]:
-                                with open(file, 'rb') as f:
-                                    contents += f.read().strip() + b'\n'
-                            with open(packed, 'wb') as f:
-                                f.write(contents)
-                            os.utime(packed, (mtime, mtime))
-
-        # Add a random hash to <link href=""> and <script src="">
-        def static_hash(stream):
-            if not hasattr(self.__class__, 'static_hash'):
-                self.__class__.static_hash = ''.join(
-                    random.choice(string.ascii_lowercase + string.digits) for _ in range(8))
-            ns = None
-            for kind, data, pos in stream:
-                if kind is genshi.core.START_NS:
-                    ns = data[1]
-                if kind is genshi.core.START:
-                    tag = data
-                    if type(tag) is tuple:
-                        tag = tag[0]
-                    tag = str(tag).replace('{' + ns + '}', '')
-                    if tag in ['link', 'script']:
-                        data_1 = list(data[1])
-                        for idx, attr in enumerate(data_1):
-                            if attr[0] in ['href', 'src']:
-                                data_1[idx] = (attr[0], attr[1] + '?' + self.__class__.static_hash)
-                        data = (data[0], genshi.core.Attrs(data_1))
-                yield kind, data, pos
-
-        # Generate the basic stream
-        stream = self.template_loader.load(template + '.html').generate(page=page, session=cherrypy.session)
-        # Filter the stream
-        if strip_html:
-            stream = stream.filter(strip)
-        stream = stream.filter(packer)
-        stream = stream.filter(static_hash)
-        # Render the stream
-        return genshi.core.Markup(stream.render('html'))
+                if kind is genshi.core.START and data[0].localname == 'html':
+                    continue
+                if kind is genshi.core.END and data.localname == 'html':
+                    continue
+
+            # Point <link href=""> and <script src=""> at content-hashed bundles from the asset manifest
+            if kind is genshi.core.START and data[0].localname in ['link', 'script']:
+                data_1 = list(data[1])
+                for idx, attr in enumerate(data_1):
+                    if attr[0] in ['href', 'src'] and isinstance(attr[1], str):  # (not interpolated)
+                        data_1[idx] = (attr[0], self.assets.url(attr[1]))
+                # Bundled into an earlier file, drop the element
+                if [a for a in data_1 if a[1] is None]:
+                    for kind, data, pos in stream:
+                        if kind is genshi.core.END and data.localname in ['link', 'script']:
+                            break
+                    continue
+                data = (data[0], genshi.core.Attrs(data_1))
+
+            yield kind, data, pos
 
     def refresh(self):
         if 'refresh' in cherrypy.session:
@@ -235,6 +330,9 @@ class Index(CherryServer):
         self.scout = Scout()  # /scout/*
         self.update = Update()  # /update/*
         self.download = Download()  # /download/*
+        self.api = Api()  # /api/*
+        self.sync = Sync()  # /sync/*
+        self.fragment = Fragment()  # /fragment/*
 
     # @cherrypy.expose
     # @cherrypy.tools.allow(methods=['GET'])
@@ -267,6 +365,22 @@ class Index(CherryServer):
     def index(self):
         return self.display('index')
 
+    # Rolling report of Mongo commands: per calling method, recent requests, slow commands with their plans
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    def queries(self):
+        return self.display('queries', sharkscout.QueryProfiler.report())
+
+    # Prometheus text format, or JSON with ?format=json
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    def metrics(self, format=None):
+        if format == 'json':
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            return sharkscout.Util.json(sharkscout.Metrics.json()).encode('utf-8')
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+        return sharkscout.Metrics.prometheus().encode('utf-8')
+
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['POST'])
     def settings(self, **kwargs):
@@ -304,28 +418,17 @@ class Index(CherryServer):
                 })
         return self.display('events', page)
 
+    # Only what's needed to draw the page, every tab's section is loaded from /fragment/event/* once it's shown
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['GET'])
     def event(self, event_key, stats_matches=0):
-        event = sharkscout.Mongo().event(event_key)
+        event = sharkscout.Mongo().event_summary(event_key)
         page = {
             'event': event,
             'stats_matches': int(stats_matches),
             'years': sharkscout.Mongo().event_years(event['event_code']),
-            'can_scout': {
-                'match': self.can_render('scouting/' + str(event['year']) + '/match'),
-                'pit': self.can_render('scouting/' + str(event['year']) + '/pit')
-            },
-            'modified_timestamp': event['modified_timestamp']
+            'updated_timestamp': event['updated_timestamp']
         }
-        try:
-            stats = sharkscout.Mongo().scouting_stats(event_key, stats_matches)
-            page['stats'] = stats['individual']
-            page['scatter'] = stats['scatter']
-        except Exception as e:
-            page['stats'] = []
-            page['scatter'] = {}
-            cherrypy.log(e)
         return self.display('event', page)
 
     @cherrypy.expose
@@ -336,7 +439,7 @@ class Index(CherryServer):
         matches = [m for m in event['matches'] if m['key'] == match_key] if match_key else []
         match = matches[0] if matches else {}
 
-        stats = sharkscout.Mongo().scouting_stats(event_key)
+        stats = sharkscout.Mongo().scouting_stats(event_key, trends=True)
 
         alliance_stats = {}
         for alliance in match['alliances']:
@@ -374,7 +477,7 @@ class Index(CherryServer):
                 'match': self.can_render('scouting/' + str(year) + '/match'),
                 'pit': self.can_render('scouting/' + str(year) + '/pit')
             },
-            'modified_timestamp': team['modified_timestamp']
+            'updated_timestamp': team['updated_timestamp']
         }
         return self.display('team', page)
 
@@ -384,6 +487,149 @@ class Index(CherryServer):
         pass
 
 
+# Sections of the event page, each loaded when its tab is first shown
+class Fragment(CherryServer):
+    cache_limit = 64  # renderings and stats kept, least recently used dropped first (one matches section is ~0.5 MB)
+
+    # Class-level, shared by every request. Don't rebind these! (Up here: `collections` below hides the module.)
+    cache = collections.OrderedDict()  # {key: (Watcher.version(), value)}
+    cache_lock = threading.Lock()
+
+    # The collections each section is read from, its rendering is cached until one of them changes
+    collections = {
+        'matches': ['scouting', 'scouting_matches', 'tba_events', 'tba_teams'],
+        'teams': ['scouting', 'scouting_matches', 'tba_events', 'tba_teams'],
+        'alliances': ['tba_events', 'tba_teams'],
+        'stats': ['scouting_matches', 'tba_events', 'tba_teams'],
+        'ratings': ['scouting_matches', 'tba_events'],
+        'projection': ['scouting_matches', 'tba_events', 'tba_teams'],
+        'comparison': ['scouting_matches', 'tba_events', 'tba_teams'],
+        'awards': ['tba_events', 'tba_teams']
+    }
+
+    def __init__(self):
+        super(self.__class__, self).__init__()
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    def event(self, section, event_key, stats_matches=0):
+        if section not in self.collections:
+            raise cherrypy.NotFound()
+        stats_matches = int(stats_matches)
+        # (the home team is marked in most sections)
+        key = (section, event_key, stats_matches, cherrypy.session.get('team_number', ''))
+        return self._cached(key, self.collections[section], lambda: self.render('event_section', dict(
+            getattr(self, '_' + section)(event_key, stats_matches), section=section)))
+
+    # load(), or what it returned last time if none of the collections have changed since
+    def _cached(self, key, collections, load):
+        version = sharkscout.Watcher.version(*collections)
+        with self.cache_lock:
+            if key in self.cache and self.cache[key][0] == version and None not in version:
+                self.cache.move_to_end(key)
+                return self.cache[key][1]
+        value = load()
+        if None not in version:
+            with self.cache_lock:
+                self.cache[key] = (version, value)
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.cache_limit:
+                    self.cache.popitem(last=False)
+        return value
+
+    # Scouting stats, shared by the sections that need them
+    def _scouting_stats(self, event_key, stats_matches):
+        try:
+            return self._cached(('scouting_stats', event_key, stats_matches), self.collections['stats'],
+                                lambda: sharkscout.Mongo().scouting_stats(event_key, stats_matches, True))
+        except Exception as e:
+            cherrypy.log(e)
+            return {'individual': [], 'scatter': {}}
+
+    def _can_scout(self, event):
+        return {
+            'match': self.can_render('scouting/' + str(event['year']) + '/match'),
+            'pit': self.can_render('scouting/' + str(event['year']) + '/pit')
+        }
+
+    def _matches(self, event_key, stats_matches):
+        event = sharkscout.Mongo().event(event_key)
+        return {
+            'event': event,
+            'can_scout': self._can_scout(event),
+            'badge': len(event.get('matches') or [])
+        }
+
+    def _teams(self, event_key, stats_matches):
+        event = sharkscout.Mongo().event(event_key)
+        return {
+            'event': event,
+            'can_scout': self._can_scout(event),
+            'badge': len(event['teams'])
+        }
+
+    def _alliances(self, event_key, stats_matches):
+        event = sharkscout.Mongo().event_section(event_key, ['alliances', 'teams'])
+        return {
+            'event': event,
+            'badge': len(event.get('alliances') or [])
+        }
+
+    def _stats(self, event_key, stats_matches):
+        stats = self._scouting_stats(event_key, stats_matches)
+        return {
+            'event': {'key': event_key},
+            'stats_matches': stats_matches,
+            'stats': stats['individual'],
+            'badge': len(stats['individual'])
+        }
+
+    def _ratings(self, event_key, stats_matches):
+        try:
+            ratings = sharkscout.Mongo().event_ratings(sharkscout.Mongo().event_section(event_key, ['matches']))
+            listing = sharkscout.Ratings.listing(ratings)
+        except Exception as e:
+            ratings = {'matches': 0}
+            listing = []
+            cherrypy.log(e)
+        return {
+            'ratings': listing,
+            'ratings_matches': ratings.get('matches', 0),
+            'badge': len(listing)
+        }
+
+    def _projection(self, event_key, stats_matches):
+        event = sharkscout.Mongo().event_section(event_key, ['matches', 'rankings'])
+        try:
+            ratings = sharkscout.Mongo().event_ratings(event)
+            projection = sharkscout.Mongo().event_projection(
+                event, ratings, self._scouting_stats(event_key, stats_matches)['individual'])
+        except Exception as e:
+            projection = {}
+            cherrypy.log(e)
+        return {
+            'event': event,
+            'projection': projection,
+            'badge': projection['remaining'] if projection else ''
+        }
+
+    def _comparison(self, event_key, stats_matches):
+        scatter = self._scouting_stats(event_key, stats_matches)['scatter']
+        return {
+            'event': {'key': event_key},
+            'stats_matches': stats_matches,
+            'scatter': scatter,
+            'badge': len(scatter['dataset']) if scatter else ''
+        }
+
+    def _awards(self, event_key, stats_matches):
+        event = sharkscout.Mongo().event_section(event_key, ['awards', 'teams'])
+        return {
+            'event': event,
+            'badge': len(event.get('awards') or [])
+        }
+
+
 class Scout(CherryServer):
     def __init__(self):
         super(self.__class__, self).__init__()
@@ -440,36 +686,45 @@ class Scout(CherryServer):
         return self.display('scout_pit', page)
 
 
+# TBA updates, queued as background Jobs: the page is shown again right away (or the job returned as JSON, to a page
+#  that's waiting on its progress over the WebSocket)
 class Update(CherryServer):
     def __init__(self):
         super(self.__class__, self).__init__()
 
+    @staticmethod
+    def _job(description, redirect, function, *args):
+        job = sharkscout.Jobs.submit(cherrypy.request.path_info, description, redirect, function, *args)
+        if job is None:
+            sharkscout.Admission.unavailable('Too many updates are waiting, try again shortly', 30)
+        if cherrypy.request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            cherrypy.response.headers['Content-Type'] = 'application/json'
+            return sharkscout.Util.json(job).encode('utf-8')
+        raise cherrypy.HTTPRedirect(redirect)
+
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['GET'])
     def events(self, year):
-        sharkscout.Mongo().events_update(year)
-        raise cherrypy.HTTPRedirect('/events/' + year)
+        return self._job('Updating ' + year + ' events', '/events/' + year, sharkscout.Mongo.events_update, year)
 
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['GET'])
     def event(self, event_key):
-        sharkscout.Mongo().event_update(event_key)
-        raise cherrypy.HTTPRedirect('/event/' + event_key)
+        return self._job('Updating ' + event_key, '/event/' + event_key, sharkscout.Mongo.event_update, event_key)
 
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['GET'])
     def teams(self):
-        sharkscout.Mongo().teams_update()
-        raise cherrypy.HTTPRedirect('/teams')
+        return self._job('Updating teams', '/teams', sharkscout.Mongo.teams_update)
 
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['GET'])
     def team(self, team_key, path=None, *args):
-        if path is None:
-            sharkscout.Mongo().team_update(team_key)
         if path == 'events':
-            sharkscout.Mongo().team_update_events(team_key, args[0])
-            raise cherrypy.HTTPRedirect('/team/' + team_key + '/' + args[0])
+            return self._job('Updating ' + team_key + '\'s ' + args[0] + ' events', '/team/' + team_key + '/' + args[0],
+                             sharkscout.Mongo.team_update_events, team_key, args[0])
+        if path is None:
+            return self._job('Updating ' + team_key, '/team/' + team_key, sharkscout.Mongo.team_update, team_key)
         raise cherrypy.HTTPRedirect('/team/' + team_key)
 
 
@@ -477,127 +732,453 @@ class Download(CherryServer):
     def __init__(self):
         super(self.__class__, self).__init__()
 
-    def _csv(self, prefix, items):
-        # Enforce a list
-        if type(items) is dict:
-            items = [items[k] for k in sorted(items)]
-
-        # Find all possible keys, sort them
-        keys = []
+    # Stream an export straight from a cursor, nothing is buffered in memory or written to disk
+    #  (event_key can be a comma-separated list of events, exported one after another)
+    def _export(self, prefix, keys, items, format='csv'):
+        if format not in ['csv', 'ndjson']:
+            raise cherrypy.HTTPError(404, 'Unknown export format "' + format + '"')
+
+        filename = prefix + datetime.now().strftime('%Y%m%d-%H%M%S') + '.' + format
+        cherrypy.response.headers['Content-Type'] = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+        cherrypy.response.headers['Content-Disposition'] = 'attachment; filename="' + filename + '"'
+
+        keys = sorted([k for k in keys if not k.startswith('_')])
+        if format == 'csv':
+            return self._csv(keys, items)
+        return self._ndjson(items)
+
+    @staticmethod
+    def _csv(keys, items, rows_per_chunk=100):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=keys, extrasaction='ignore')
+        writer.writerow({k: k.lstrip('0123456789').strip(' _') for k in keys})
+        for idx, item in enumerate(items):
+            writer.writerow(item)
+            if idx % rows_per_chunk == rows_per_chunk - 1:
+                yield buffer.getvalue().encode('utf-8')
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode('utf-8')
+
+    @staticmethod
+    def _ndjson(items):
         for item in items:
-            for key in item:
-                if not key.startswith('_') and key not in keys:
-                    keys.append(key)
-        keys = sorted(keys)
-
-        # Open up the temp file for CSV writing
-        filename = tempfile.gettempdir() + '/' + prefix + datetime.now().strftime('%Y%m%d-%H%M%S') + '.csv'
-        with open(filename, 'w', newline='') as temp:
-            writer = csv.DictWriter(temp, fieldnames=keys)
-            writer.writerow({k: k.lstrip('0123456789').strip(' _') for k in keys})
-            # Write each row
-            for item in items:
-                row = {}
-                for key in keys:
-                    row[key] = item[key] if key in item else ''
-                writer.writerow(row)
-        return cherrypy.lib.static.serve_file(filename, 'application/x-download', 'attachment')
+            yield (sharkscout.Util.json({k: v for k, v in item.items() if not k.startswith('_')}) + '\n').encode('utf-8')
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    @cherrypy.config(**{'response.stream': True})
+    def matches(self, event_key, format='csv'):
+        keys = ['comp_level', 'match_number', 'set_number', 'time'] + \
+               [a + '_' + str(i) for a in ['blue', 'red'] for i in range(1, 4)]
+
+        def rows():
+            for key in event_key.split(','):
+                event = sharkscout.Mongo().event(key)
+                for match in event.get('matches', []):
+                    row = {k: match.get(k, '') for k in ['comp_level', 'match_number', 'set_number', 'time']}
+                    for alliance in match['alliances']:
+                        for idx, team in enumerate(match['alliances'][alliance]['teams']):
+                            row[alliance + '_' + str(idx + 1)] = team
+                    yield row
+
+        return self._export(event_key.replace(',', '_') + '_matches_', keys, rows(), format)
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    @cherrypy.config(**{'response.stream': True})
+    def scouting(self, scouting_type, event_key, format='csv'):
+        event_keys = event_key.split(',')
+        if scouting_type == 'match':
+            keys = set(k for e in event_keys for k in sharkscout.Mongo().scouting_matches_raw_keys(e))
+            items = (m for e in event_keys for m in sharkscout.Mongo().scouting_matches_raw_iter(e))
+        elif scouting_type == 'pit':
+            keys = set(k for e in event_keys for k in sharkscout.Mongo().scouting_pit_teams_keys(e))
+            items = (t for e in event_keys for t in sharkscout.Mongo().scouting_pit_teams_iter(e))
+        else:
+            raise cherrypy.HTTPError(404, 'Unknown scouting type "' + scouting_type + '"')
+        return self._export(event_key.replace(',', '_') + '_scouting_' + scouting_type + '_', keys, items, format)
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    @cherrypy.config(**{'response.stream': True})
+    def stats(self, event_key, stats_matches=0, format='csv'):
+        event_keys = event_key.split(',')
+        keys = set(k for e in event_keys for k in sharkscout.Mongo().scouting_stats_keys(e))
+        items = (s for e in event_keys for s in sharkscout.Mongo().scouting_stats_iter(e, stats_matches))
+        return self._export(event_key.replace(',', '_') + '_scouting_stats_', keys, items, format)
+
+
+# JSON error bodies for /api/*
+def api_error(status, message, traceback, version):
+    cherrypy.response.headers['Content-Type'] = 'application/json'
+    return sharkscout.Util.json({'error': {'status': status, 'message': message}})
+
+
+class Api(object):
+    def __init__(self):
+        self.v1 = ApiV1()  # /api/v1/*
+
+
+class ApiV1(object):
+    limit = 100
+    limit_max = 1000
+
+    def _json(self, data, fields=None, **kwargs):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return sharkscout.Util.json(dict(data=self._select(data, fields), **kwargs)).encode('utf-8')
+
+    def _limit(self, limit):
+        try:
+            return min(max(int(limit), 1), self.limit_max) if limit else self.limit
+        except ValueError:
+            raise cherrypy.HTTPError(400, 'Invalid limit "' + str(limit) + '"')
+
+    @staticmethod
+    def _cursor_encode(value):
+        return base64.urlsafe_b64encode(sharkscout.Util.json(value).encode()).decode()
+
+    # A cursor's value, which valid(value) has to accept (they come from clients, and can be made up)
+    @staticmethod
+    def _cursor_decode(cursor, valid):
+        try:
+            value = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        except Exception:
+            value = None
+        if value is None or not valid(value):
+            raise cherrypy.HTTPError(400, 'Invalid cursor "' + cursor + '"')
+        return value
+
+    @staticmethod
+    def _integer(value):
+        return isinstance(value, int) and not isinstance(value, bool)
+
+    # Keep only the requested (dotted) fields, e.g. ?fields=key,name,alliances.red
+    def _select(self, data, fields):
+        if not fields:
+            return data
+
+        tree = {}
+        for field in fields.split(','):
+            node = tree
+            for part in [p for p in field.strip().split('.') if p]:
+                node = node.setdefault(part, {})
+
+        def select(item, node):
+            if not node:
+                return item
+            if isinstance(item, dict):
+                return {k: select(item[k], node[k]) for k in node if k in item}
+            if isinstance(item, list):
+                return [select(i, node) for i in item]
+            return item
+
+        return select(data, tree)
+
+    # One page of a list, with an opaque cursor to the next page
+    #  (the cursor holds the last item's key, so it survives items being added before it)
+    def _page(self, items, key, fields=None, cursor=None, limit=None):
+        limit = self._limit(limit)
+
+        start = 0
+        if cursor:
+            offset, last = self._cursor_decode(
+                cursor, lambda c: isinstance(c, list) and len(c) == 2 and self._integer(c[0]))
+            if 0 < offset <= len(items) and key(items[offset - 1]) == last:
+                start = offset
+            else:
+                keys = [key(i) for i in items]
+                start = keys.index(last) + 1 if last in keys else min(max(offset, 0), len(items))
+
+        page = items[start:start + limit]
+        next_cursor = None
+        if start + limit < len(items):
+            next_cursor = self._cursor_encode([start + limit, key(page[-1])])
+        return self._json(page, fields, next=next_cursor)
 
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['GET'])
-    def matches(self, event_key):
+    def events(self, year=None, fields=None, cursor=None, limit=None):
+        if year is None:
+            year = date.today().year
+        events = sharkscout.Mongo().events(year)
+        return self._page(events, lambda e: e['key'], fields, cursor, limit)
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    def event(self, event_key, fields=None):
+        event = sharkscout.Mongo().event(event_key)
+        if not event:
+            raise cherrypy.HTTPError(404, 'Unknown event "' + event_key + '"')
+        return self._json(event, fields)
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    def matches(self, event_key, fields=None, cursor=None, limit=None):
         event = sharkscout.Mongo().event(event_key)
-        matches = []
-        if 'matches' in event:
-            for match in event['matches']:
-                row = {k: match[k] for k in ['comp_level', 'match_number', 'set_number', 'time']}
-                for alliance in match['alliances']:
-                    for idx, team in enumerate(match['alliances'][alliance]['teams']):
-                        row[alliance + '_' + str(idx + 1)] = team
-                matches.append(row)
-        return self._csv(event_key + '_matches_', matches)
+        if not event:
+            raise cherrypy.HTTPError(404, 'Unknown event "' + event_key + '"')
+        return self._page(event.get('matches', []), lambda m: m['key'], fields, cursor, limit)
 
+    # Teams are paged in the database rather than in memory, there are too many of them
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['GET'])
-    def scouting(self, scouting_type, event_key):
+    def teams(self, fields=None, cursor=None, limit=None):
+        limit = self._limit(limit)
+        after = self._cursor_decode(cursor, self._integer) if cursor else 0
+        teams = sharkscout.Mongo().teams_after(after, limit)
+        next_cursor = self._cursor_encode(teams[-1]['team_number']) if len(teams) == limit else None
+        return self._json(teams, fields, next=next_cursor)
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    def team(self, team_key, year=None, fields=None):
+        team = sharkscout.Mongo().team(team_key, year)
+        if not team:
+            raise cherrypy.HTTPError(404, 'Unknown team "' + team_key + '"')
+        return self._json(team, fields)
+
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    def scouting(self, scouting_type, event_key, fields=None, cursor=None, limit=None):
         if scouting_type == 'match':
             matches = sharkscout.Mongo().scouting_matches_raw(event_key)
-            return self._csv(event_key + '_scouting_match_', matches)
+            return self._page(matches, lambda m: [m.get('match_key'), m.get('team_key')], fields, cursor, limit)
         elif scouting_type == 'pit':
             teams = sharkscout.Mongo().scouting_pit_teams(event_key)
-            return self._csv(event_key + '_scouting_pit_', teams)
+            teams = [teams[k] for k in sorted(teams)]
+            return self._page(teams, lambda t: t.get('team_key'), fields, cursor, limit)
+        raise cherrypy.HTTPError(404, 'Unknown scouting type "' + scouting_type + '"')
 
     @cherrypy.expose
     @cherrypy.tools.allow(methods=['GET'])
-    def stats(self, event_key, stats_matches):
+    def stats(self, event_key, stats_matches=0, fields=None, cursor=None, limit=None):
         stats = sharkscout.Mongo().scouting_stats(event_key, stats_matches)['individual']
-        return self._csv(event_key + '_scouting_stats_', stats)
+        return self._page(stats, lambda s: s['_id'], fields, cursor, limit)
 
 
-class WebSocketServer(ws4py.websocket.WebSocket):
-    sockets = {}
+# Change log exchange between SharkScout instances (see sharkscout.ChangeLog)
+class Sync(object):
+    def _json(self, data):
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return sharkscout.Util.json(data).encode('utf-8')
+
+    # This instance's node ID and the highest sequence number it has from every node
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET'])
+    def index(self):
+        changelog = sharkscout.ChangeLog(sharkscout.Mongo())
+        return self._json({'node': changelog.node, 'vector': changelog.vector()})
+
+    # GET: entries newer than the ?since={node: seq} vector, POST: entries to apply (optionally gzipped)
+    @cherrypy.expose
+    @cherrypy.tools.allow(methods=['GET', 'POST'])
+    def changes(self, since=None, limit=None):
+        changelog = sharkscout.ChangeLog(sharkscout.Mongo())
+
+        if cherrypy.request.method == 'POST':
+            body = cherrypy.request.body.read()
+            try:
+                if cherrypy.request.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                applied = changelog.apply(json.loads(body.decode('utf-8'))['changes'])
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                raise cherrypy.HTTPError(400, 'Invalid changes: ' + str(e))
+            return self._json({'applied': applied})
+
+        try:
+            since = {str(k): int(v) for k, v in json.loads(since).items()} if since else {}
+            limit = min(max(int(limit), 1), changelog.limit) if limit else changelog.limit
+        except (ValueError, AttributeError) as e:
+            raise cherrypy.HTTPError(400, 'Invalid parameters: ' + str(e))
+        return self._json({'node': changelog.node, 'changes': changelog.changes(since, limit)})
+
+
+# The WebSocket message protocol, for whatever holds the sockets: WebSocketServer inside the web server, or
+#  GatewaySocket in the --gateway process. Subclasses keep their own sockets and written dicts, and inherit a
+#  send(payload, binary) from further along the MRO that puts a message on the wire.
+class WebSocketProtocol(object):
+    written_ttl = 30  # seconds
+    blocking = ['dictionary', 'time_team', 'scouting_match', 'scouting_pit']  # message keys that hit the disk or Mongo
+    dictionary = None  # this socket's Compact dictionary, once asked for (then everything sent is binary)
+    types = ['scouting_match', 'scouting_pit', 'time_team', 'dictionary', 'ping']  # metric labels, or 'other'
 
     def opened(self):
         self.__class__.sockets[self] = time.time()
         cherrypy.log(str(self) + ' Opened (Open: ' + str(len(self.__class__.sockets)) + ')')
         # Note: can't send any messages here
 
-    def received_message(self, message):
-        message = message.data.decode()
+    def received(self, data, binary):
+        message = self.decode(data, binary)
+        if message is not None:
+            self.handle(message)
+
+    # A message, or None (counted as invalid) if it can't be decoded
+    def decode(self, data, binary):
         try:
-            message = json.loads(message)
-
-            if 'ping' in message:
-                self.send({'pong': 'pong'})
-
-            if 'time_team' in message:
-                self.send({'time_team': sharkscout.Mongo().team(message['time_team'])})
-
-            # Match scouting upserts
-            if 'scouting_match' in message:
-                for data in message['scouting_match']:
-                    if sharkscout.Mongo().scouting_match_update(data):
-                        self.send({
-                            'dequeue': {'scouting_match': data},
-                            'toast': {
-                                'message': 'You match scouted ' + data['match_key'] + ' ' + data['team_key'],
-                                'type': 'success'
-                            }
-                        })
-                        self.broadcast(
-                            {'show': '.match-listing .' + data['match_key'] + ' .' + data['team_key'] + ' .fa-check'})
-                        self.broadcast_others({
-                            'toast': {
-                                'message':
-                                    data['scouter'] + ' match scouted ' + data['match_key'] + ' ' + data['team_key'],
-                                'type': 'success',
-                                'mobile': False
-                            }
-                        })
-
-            # Pit scouting upserts
-            if 'scouting_pit' in message:
-                for data in message['scouting_pit']:
-                    if sharkscout.Mongo().scouting_pit_update(data):
-                        self.send({
-                            'dequeue': {'scouting_pit': data},
-                            'toast': {
-                                'message': 'You pit scouted ' + data['event_key'] + ' ' + data['team_key'],
-                                'type': 'success'
-                            }
-                        })
-                        self.broadcast({'show': '.team-listing .' + data['team_key'] + ' .fa-check'})
-                        self.broadcast_others({
-                            'toast': {
-                                'message': data['scouter'] + ' pit scouted ' + data['event_key'] + ' ' + data[
-                                    'team_key'],
-                                'type': 'success',
-                                'mobile': False
-                            }
-                        })
-
-        except json.JSONDecodeError as e:
-            cherrypy.log(e)
+            if binary:
+                if not self.dictionary:
+                    raise ValueError('Binary message before a dictionary was agreed on')
+                message = sharkscout.Compact.decode(data, self.dictionary)
+                encoding = 'compact'
+            else:
+                try:
+                    message = json.loads(data.decode())
+                except RecursionError:
+                    raise ValueError('JSON nested too deeply')
+                encoding = 'json'
+            self._check(message)
+            labels = (('type', self.type(message)),)
+            sharkscout.Metrics.inc('sharkscout_websocket_received_bytes_total', labels + (('encoding', encoding),),
+                                   len(data))
+            return message
+        except ValueError as e:  # (including json.JSONDecodeError)
+            sharkscout.Metrics.inc('sharkscout_websocket_messages_total', (('type', 'invalid'),))
+            cherrypy.log(str(e))
+            return None
+
+    # Raise ValueError unless the message has the shape handle() expects
+    @staticmethod
+    def _check(message):
+        if not isinstance(message, dict):
+            raise ValueError('Message is not an object')
+        if 'dictionary' in message and not isinstance(message['dictionary'], dict):
+            raise ValueError('Message dictionary is not an object')
+        for name in ['scouting_match', 'scouting_pit']:
+            if name in message and not (isinstance(message[name], list) and
+                                        all(isinstance(d, dict) for d in message[name])):
+                raise ValueError('Message ' + name + ' is not a list of objects')
+
+    # A message's metric label: its first known key, so clients can't make up label values
+    @classmethod
+    def type(cls, message):
+        if not isinstance(message, dict):
+            return 'invalid'
+        for name in cls.types:
+            if name in message:
+                return name
+        return 'other'
+
+    def handle(self, message):
+        start = time.perf_counter()
+        labels = (('type', self.type(message)),)
+
+        # Compact encoding: the client's dictionary for a year, sent only if its version is out of date
+        if 'dictionary' in message and sharkscout.Compact.protocol in (self.protocols or []):
+            dictionary = sharkscout.Compact.dictionary(message['dictionary'].get('year'))
+            reply = {'year': dictionary['year'], 'version': dictionary['version']}
+            if message['dictionary'].get('version') != dictionary['version']:
+                reply['keys'] = dictionary['keys']
+            self.send({'dictionary': reply})
+            self.dictionary = dictionary
+
+        if 'ping' in message:
+            self.send({'pong': 'pong'})
+
+        if 'time_team' in message:
+            team = sharkscout.Mongo().team(message['time_team']) or {}
+            self.send({'time_team': {k: team[k] for k in ['key', 'nickname'] if k in team}})
+
+        # Match scouting upserts
+        if 'scouting_match' in message:
+            for data in message['scouting_match']:
+                if self._write((data['event_key'], data['match_key'], data['team_key']),
+                               sharkscout.Mongo().scouting_match_update, data):
+                    self.send({
+                        'dequeue': {'scouting_match': data},
+                        'toast': {
+                            'message': 'You match scouted ' + data['match_key'] + ' ' + data['team_key'],
+                            'type': 'success'
+                        }
+                    })
+                    self.broadcast(
+                        {'show': '.match-listing .' + data['match_key'] + ' .' + data['team_key'] + ' .fa-check'})
+                    self.broadcast_others({
+                        'toast': {
+                            'message':
+                                data['scouter'] + ' match scouted ' + data['match_key'] + ' ' + data['team_key'],
+                            'type': 'success',
+                            'mobile': False
+                        }
+                    })
+
+        # Pit scouting upserts
+        if 'scouting_pit' in message:
+            for data in message['scouting_pit']:
+                if self._write((data['event_key'], data['team_key']), sharkscout.Mongo().scouting_pit_update, data):
+                    self.send({
+                        'dequeue': {'scouting_pit': data},
+                        'toast': {
+                            'message': 'You pit scouted ' + data['event_key'] + ' ' + data['team_key'],
+                            'type': 'success'
+                        }
+                    })
+                    self.broadcast({'show': '.team-listing .' + data['team_key'] + ' .fa-check'})
+                    self.broadcast_others({
+                        'toast': {
+                            'message': data['scouter'] + ' pit scouted ' + data['event_key'] + ' ' + data[
+                                'team_key'],
+                            'type': 'success',
+                            'mobile': False
+                        }
+                    })
+
+        sharkscout.Metrics.inc('sharkscout_websocket_messages_total', labels)
+        sharkscout.Metrics.observe('sharkscout_websocket_message_duration_seconds', time.perf_counter() - start,
+                                   labels)
+
+    # update(data), marked as this process's own write first: the Watcher can see it before update() returns
+    def _write(self, key, update, data):
+        self.__class__.written[key] = time.time()
+        stored = None
+        try:
+            stored = update(data)
+        finally:
+            if not stored:
+                self.__class__.written.pop(key, None)
+        return stored
+
+    # Watcher.channel subscriber: tell everyone about scouting written by other processes (or instances syncing), and
+    #  how background Jobs are getting on
+    @classmethod
+    def changed(cls, collection, document):
+        if document and collection == sharkscout.Jobs.collection and 'run' in document:
+            for socket in list(cls.sockets):
+                socket.send({'job': {k: document.get(k) for k in
+                                     ['_id', 'run', 'description', 'redirect', 'state', 'requests', 'error']}})
+            return
+        if not document or collection not in ['scouting', 'scouting_matches']:
+            return
+        if collection == 'scouting_matches':
+            if 'match_key' not in document:
+                return
+            key = (document['event_key'], document['match_key'], document['team_key'])
+            show = '.match-listing .' + document['match_key'] + ' .' + document['team_key'] + ' .fa-check'
+            message = ' match scouted ' + document['match_key'] + ' ' + document['team_key']
+            scouter = document.get('scouter')
+        else:
+            if 'pit' not in document:
+                return
+            key = (document['event_key'], document['team_key'])
+            show = '.team-listing .' + document['team_key'] + ' .fa-check'
+            message = ' pit scouted ' + document['event_key'] + ' ' + document['team_key']
+            scouter = document['pit'].get('scouter')
+
+        now = time.time()
+        for written in [k for k, t in list(cls.written.items()) if now - t > cls.written_ttl]:
+            cls.written.pop(written, None)
+        if cls.written.pop(key, None) is not None:
+            return  # this process's own write, once
+
+        for socket in list(cls.sockets):
+            socket.send({'show': show})
+            socket.send({
+                'toast': {
+                    'message': (scouter or 'Someone') + message,
+                    'type': 'success',
+                    'mobile': False
+                }
+            })
 
     def closed(self, code, reason=None):
         if self in self.__class__.sockets:
@@ -619,14 +1200,30 @@ class WebSocketServer(ws4py.websocket.WebSocket):
 
         payload = basic(payload)
         if type(payload) is dict:
-            payload = json.dumps(payload)
-        super(self.__class__, self).send(payload, binary)
+            if self.dictionary:
+                payload = sharkscout.Compact.encode(payload, self.dictionary)
+                binary = True
+            else:
+                payload = json.dumps(payload)
+        sharkscout.Metrics.inc('sharkscout_websocket_sent_total')
+        sharkscout.Metrics.inc('sharkscout_websocket_sent_bytes_total',
+                               (('encoding', 'compact' if binary else 'json'),), len(payload))
+        super().send(payload, binary)
 
     def broadcast(self, payload):
-        for socket in self.__class__.sockets:
+        for socket in list(self.__class__.sockets):
             socket.send(payload)
 
     def broadcast_others(self, payload):
-        for socket in self.__class__.sockets:
+        for socket in list(self.__class__.sockets):
             if socket != self:
                 socket.send(payload)
+
+
+# WebSockets at /ws, handled by ws4py inside the web server
+class WebSocketServer(WebSocketProtocol, ws4py.websocket.WebSocket):
+    sockets = {}
+    written = {}  # {scouting key: time} of writes made through this process, already broadcast
+
+    def received_message(self, message):
+        self.received(message.data, message.is_binary)
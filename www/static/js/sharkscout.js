@@ -35,8 +35,10 @@ var queue = function(key, val) {
 
 
 var ws_online = true;
+var ws_compact = {'offer': true, 'opened': false, 'dictionary': undefined};
 function openSocket() {
-    var webSocket = 'ws://' + window.location.hostname + ':' + window.location.port + '/ws'
+    var webSocket = 'ws://' + window.location.hostname + ':' + ($('body').data('websocket-port') || window.location.port) + '/ws'
+    var protocols = ws_compact.offer ? ['sharkscout.compact'] : [];
     var pingInterval;
     var pingCount = 0;
     var timeTeamInterval;
@@ -45,12 +47,32 @@ function openSocket() {
 
     var ws = undefined;
     if(window.WebSocket) {
-        ws = new WebSocket(webSocket);
+        ws = new WebSocket(webSocket, protocols);
     } else if(window.MozWebSocket) {
-        ws = MozWebSocket(webSocket);
+        ws = MozWebSocket(webSocket, protocols);
     }
+    ws.binaryType = 'arraybuffer';
+    ws_compact.opened = false;
+    ws_compact.dictionary = undefined;
+
+    // Everything is JSON until the server has agreed on a dictionary
+    var send = function(message) {
+        if(ws_compact.dictionary) {
+            ws.send(compactEncode(message, ws_compact.dictionary));
+        } else {
+            ws.send(JSON.stringify(message));
+        }
+    };
 
     ws.onopen = function() {
+        ws_compact.opened = true;
+        // Ask for this year's compact dictionary, unless it's already stored
+        if(ws.protocol == 'sharkscout.compact') {
+            var year = parseInt(String($('[name="event_key"]').val()).substr(0, 4)) || moment().year();
+            var dictionary = storage('dictionaries', year);
+            send({'dictionary': {'year': year, 'version': dictionary ? dictionary.version : null}});
+        }
+
         // Keep testing the WebSocket connection
         var ping = function() {
             // Too many pings were not ponged, assume disconnected
@@ -58,7 +80,7 @@ function openSocket() {
                 ws.close();
                 return;
             }
-            ws.send(JSON.stringify({'ping':'ping'}));
+            send({'ping':'ping'});
             pingCount++;
         }
         pingInterval = setInterval(ping, 500);
@@ -68,7 +90,7 @@ function openSocket() {
         var timeTeam = function() {
             var now = moment();
             if(typeof(timeTeamLast) == 'undefined' || timeTeamLast.format('YYYY/MM/DD HH:mm') != now.format('YYYY/MM/DD HH:mm')) {
-                ws.send(JSON.stringify({'time_team':'frc' + _.trimStart(now.format('HHmm'),'0')}));
+                send({'time_team':'frc' + _.trimStart(now.format('HHmm'),'0')});
                 timeTeamLast = now;
             }
         }
@@ -78,7 +100,7 @@ function openSocket() {
         var submit = function() {
             for(var key in queue()) {
                 if(queue(key).length) {
-                    ws.send(JSON.stringify(queue()));
+                    send(queue());
                     $('#icon-queue').addClass('animated')
                     return;
                 }
@@ -92,7 +114,24 @@ function openSocket() {
     };
 
     ws.onmessage = function(e) {
-        var data = JSON.parse(e.data);
+        var data = typeof(e.data) == 'string' ? JSON.parse(e.data) : compactDecode(e.data, ws_compact.dictionary);
+
+        // The dictionary for compact messages, only sent if the stored one is out of date
+        if(data.dictionary) {
+            if(data.dictionary.keys) {
+                storage('dictionaries', data.dictionary.year, {'version': data.dictionary.version, 'keys': data.dictionary.keys});
+            }
+            var keys = storage('dictionaries', data.dictionary.year).keys;
+            ws_compact.dictionary = {'keys': keys, 'index': {}};
+            for(var i = 0; i < keys.length; i++) {
+                ws_compact.dictionary.index[keys[i]] = i;
+            }
+        }
+
+        // Background update progress
+        if(data.job) {
+            updateProgress(data.job);
+        }
 
         // Record if our ping was ponged
         if(data.pong) {
@@ -163,6 +202,10 @@ function openSocket() {
     };
 
     ws.onclose = function(e) {
+        // Never opened while offering the compact encoding: something in between may not like it, retry with JSON
+        if(!ws_compact.opened) {
+            ws_compact.offer = !ws_compact.offer;
+        }
         clearInterval(pingInterval);
         clearInterval(timeTeamInterval);
         clearInterval(submitInterval);
@@ -177,6 +220,140 @@ $(document).ready(function() {
 });
 
 
+// The compact WebSocket encoding (see sharkscout/compact.py): MessagePack, with dictionary keys sent as their index
+function compactEncode(value, dictionary) {
+    var bytes = [];
+    var integer = function(kind, value, size) {
+        bytes.push(kind);
+        for(var i = size - 1; i >= 0; i--) {
+            bytes.push(Math.floor(value / Math.pow(256, i)) & 0xff);
+        }
+    };
+    var header = function(length, fix, fixLimit, type8, type16, type32) {
+        if(length < fixLimit) {
+            bytes.push(fix | length);
+        } else if(type8 && length < 0x100) {
+            integer(type8, length, 1);
+        } else if(length < 0x10000) {
+            integer(type16, length, 2);
+        } else {
+            integer(type32, length, 4);
+        }
+    };
+    var pack = function(value) {
+        if(value === null || typeof(value) == 'undefined') {
+            bytes.push(0xc0);
+        } else if(typeof(value) == 'boolean') {
+            bytes.push(value ? 0xc3 : 0xc2);
+        } else if(typeof(value) == 'number') {
+            if(Number.isInteger(value) && value >= -0x20 && value < 0x80) {
+                bytes.push(value & 0xff);
+            } else if(Number.isInteger(value) && value >= 0 && value < 0x100000000) {
+                integer(value < 0x100 ? 0xcc : (value < 0x10000 ? 0xcd : 0xce), value, value < 0x100 ? 1 : (value < 0x10000 ? 2 : 4));
+            } else if(Number.isInteger(value) && value < 0 && value >= -0x80000000) {
+                integer(value >= -0x80 ? 0xd0 : (value >= -0x8000 ? 0xd1 : 0xd2), value, value >= -0x80 ? 1 : (value >= -0x8000 ? 2 : 4));
+            } else {
+                var view = new DataView(new ArrayBuffer(8));
+                view.setFloat64(0, value);
+                bytes.push(0xcb);
+                for(var i = 0; i < 8; i++) {
+                    bytes.push(view.getUint8(i));
+                }
+            }
+        } else if(typeof(value) == 'string') {
+            var utf8 = unescape(encodeURIComponent(value));
+            header(utf8.length, 0xa0, 0x20, 0xd9, 0xda, 0xdb);
+            for(var i = 0; i < utf8.length; i++) {
+                bytes.push(utf8.charCodeAt(i));
+            }
+        } else if(_.isArray(value)) {
+            header(value.length, 0x90, 0x10, null, 0xdc, 0xdd);
+            for(var i = 0; i < value.length; i++) {
+                pack(value[i]);
+            }
+        } else {
+            var keys = Object.keys(value);
+            header(keys.length, 0x80, 0x10, null, 0xde, 0xdf);
+            for(var i = 0; i < keys.length; i++) {
+                pack(dictionary.index.hasOwnProperty(keys[i]) ? dictionary.index[keys[i]] : keys[i]);
+                pack(value[keys[i]]);
+            }
+        }
+    };
+    pack(value);
+    return new Uint8Array(bytes).buffer;
+}
+function compactDecode(buffer, dictionary) {
+    var view = new DataView(buffer);
+    var offset = 0;
+    var take = function(getter, size) {
+        var value = view[getter](offset);
+        offset += size;
+        return value;
+    };
+    var string = function(length) {
+        var utf8 = '';
+        for(var i = 0; i < length; i++) {
+            utf8 += String.fromCharCode(take('getUint8', 1));
+        }
+        return decodeURIComponent(escape(utf8));
+    };
+    var array = function(length) {
+        var items = [];
+        for(var i = 0; i < length; i++) {
+            items.push(unpack());
+        }
+        return items;
+    };
+    var map = function(length) {
+        var items = {};
+        for(var i = 0; i < length; i++) {
+            var key = unpack();
+            items[typeof(key) == 'number' ? dictionary.keys[key] : key] = unpack();
+        }
+        return items;
+    };
+    var unpack = function() {
+        var kind = take('getUint8', 1);
+        if(kind < 0x80) {
+            return kind;
+        } else if(kind >= 0xe0) {
+            return kind - 0x100;
+        } else if(kind < 0x90) {
+            return map(kind & 0x0f);
+        } else if(kind < 0xa0) {
+            return array(kind & 0x0f);
+        } else if(kind < 0xc0) {
+            return string(kind & 0x1f);
+        }
+        switch(kind) {
+            case 0xc0: return null;
+            case 0xc2: return false;
+            case 0xc3: return true;
+            case 0xca: return take('getFloat32', 4);
+            case 0xcb: return take('getFloat64', 8);
+            case 0xcc: return take('getUint8', 1);
+            case 0xcd: return take('getUint16', 2);
+            case 0xce: return take('getUint32', 4);
+            case 0xcf: return take('getUint32', 4) * 0x100000000 + take('getUint32', 4);
+            case 0xd0: return take('getInt8', 1);
+            case 0xd1: return take('getInt16', 2);
+            case 0xd2: return take('getInt32', 4);
+            case 0xd3: return take('getInt32', 4) * 0x100000000 + take('getUint32', 4);
+            case 0xd9: return string(take('getUint8', 1));
+            case 0xda: return string(take('getUint16', 2));
+            case 0xdb: return string(take('getUint32', 4));
+            case 0xdc: return array(take('getUint16', 2));
+            case 0xdd: return array(take('getUint32', 4));
+            case 0xde: return map(take('getUint16', 2));
+            case 0xdf: return map(take('getUint32', 4));
+        }
+        throw new Error('Unsupported MessagePack type ' + kind);
+    };
+    return unpack();
+}
+
+
 function _scouting(ref, key) {
     if(typeof(ref) == 'object' && ref.nodeType === 1) {
         var obj = serialize(ref);
@@ -300,14 +477,7 @@ function deserialize(form, data) {
 
 // Initialize page
 $(document).ready(function() {
-    // Block page changes when offline
-    $('a[href]:not([href^="#"]), [onclick]:not([onclick=""]), button[type="submit"]')
-        .not('[offline], a[target="_blank"], [data-toggle="dropdown"]').click(function(e) {
-            if(!ws_online) {
-                $('#offline').modal();
-                e.preventDefault();
-            }
-    });
+    initOffline(document);
 
     // btn-group behavior
     $('.btn-group[data-toggle="buttons"] > .btn').click(function(e) {
@@ -361,6 +531,10 @@ $(document).ready(function() {
         $input.val(parseInt($input.val())+1);
     });
 
+    // Load event page sections as their tabs are shown
+    $('ul.nav-tabs > li > a[data-toggle="tab"]').on('show.bs.tab', function() {
+        loadFragment($('#' + $(this).attr('href').substring(1) + '.tab-page'));
+    });
     // Click the first tab on any nav-tabs without an active tab
     $('ul.nav-tabs').each(function() {
         if(!$(this).children('li.active').length) {
@@ -383,6 +557,7 @@ $(document).ready(function() {
             }
         }
     });
+    loadFragment($('.tab-page.active'));
 
     // Initialize selectize on all <select>s (if not IE because native form validation fails?)
     if(!detectIE()) {
@@ -403,8 +578,69 @@ $(document).ready(function() {
         });
     }
 
-    // Initialize Chart.js
-    $('canvas.chart').each(function() {
+    initCharts(document);
+    initTables(document);
+
+    // Initialize non-ASCII popovers
+    $('form').find('input, select, textarea').popover({
+        trigger: 'manual',
+        placement: 'auto',
+        content: 'Special characters are not allowed.'
+    }).change(function() {
+        if(String($(this).val()).match(/[^\x09-\x7E]/)) {
+            $(this).popover('show');
+            nonAscii = true;
+        } else {
+            $(this).popover('hide');
+        }
+    });
+
+    // Handle form key building
+    $('[name="comp_level"], [name="match_number"], [name="set_number"]').change(function() {
+        if($('[name="comp_level"]').val() == '' || $('[name="comp_level"]').val() == 'qm') {
+            $('[name="set_number"]').removeAttr('required').closest('.input-group').hide();
+        } else {
+            $('[name="set_number"]').attr('required','required').closest('.input-group').show();
+        }
+        $('[name="match_key"]').val(
+            $('[name="event_key"]').val() + '_' +
+            $('[name="comp_level"]').val() +
+            ($('[name="set_number"]').is(':visible') ? $('[name="set_number"]').val() + 'm' : '') +
+            $('[name="match_number"]').val()
+        );
+    });
+    $('[name="team_number"]').change(function() {
+        $('[name="team_key"]').val('frc' + $(this).val());
+    });
+    // Handle form deserialization
+    var $saved = $('[name="saved"]');
+    if($saved.length) {
+        deserialize($saved.closest('form'), $saved.val());
+    }
+
+    // Store temporary form data on change, and restore it on page load (make navigation non-destructive)
+    $('form[persistent="true"]').first().each(function() {
+        deserialize(this, forms(window.location.pathname));
+    }).find('input, select, textarea').change(function() {
+        forms(window.location.pathname, serialize($(this).closest('form'), true));
+    });
+});
+
+
+// Block page changes when offline
+function initOffline(root) {
+    $(root).find('a[href]:not([href^="#"]), [onclick]:not([onclick=""]), button[type="submit"]')
+        .not('[offline], a[target="_blank"], [data-toggle="dropdown"]').click(function(e) {
+            if(!ws_online) {
+                $('#offline').modal();
+                e.preventDefault();
+            }
+    });
+}
+
+// Initialize Chart.js
+function initCharts(root) {
+    $(root).find('canvas.chart').each(function() {
         var $chart = $(this);
 
         // Get array of labels
@@ -461,25 +697,13 @@ $(document).ready(function() {
                 }
             }
         }
-        // Calculate averages
-        var averages = Array(maxValues);
-        for(var i = 0; i < averages.length; i++) {
-            var sum = 0;
-            var count = 0;
-            for(var j = 0; j < values.length; j++) {
-                if(i < values[j].length) {
-                    sum += values[j][i];
-                    count++;
-                }
-            }
-            averages[i] = sum / count;
-        }
-        // Calculate regression for averages
-        var fitted = regressionFit(
-            _.map(averages, function(y, x) {
-                return [x+1, y];
-            })
-        );
+        // Get the trend line and rolling average precomputed by the server
+        var series = _.map(['trend', 'rolling'], function(name) {
+            var value = $chart.siblings('input[name="' + name + '"]').val();
+            return value ? _.map(_.split(value, ','), function(val) {
+                return parseFloat(val);
+            }) : [];
+        });
 
         // Get object of axes titles
         var axes = {};
@@ -533,20 +757,30 @@ $(document).ready(function() {
                         }),
                         'fill': idx ? '-1' : 'origin'
                     };
-                }).concat([{
-                    'data': _.map(Array(maxValues), function(y, x) {
-                        return fitted.predict(x+1)[1];
-                    }),
-                    'datalabels': {
-                        'display': false
-                    },
+                }).concat(_.map(_.filter([{
+                    'data': series[0],
                     'borderColor': '#777777',
                     'backgroundColor': 'rgba(119,119,119,0.2)',
-                    'borderWidth': 2,
-                    'borderDash': [15, 10],
-                    'pointRadius': 0,
-                    'pointHoverRadius': 0
-                }])
+                    'borderDash': [15, 10]
+                }, {
+                    'data': series[1],
+                    'borderColor': '#333333',
+                    'backgroundColor': 'rgba(51,51,51,0.1)',
+                    'borderDash': [3, 3],
+                    'fill': false
+                }], function(dataset) {
+                    return dataset.data.length;
+                }), function(dataset) {
+                    return _.assign(dataset, {
+                        'datalabels': {
+                            'display': false
+                        },
+                        'lineTension': 0,
+                        'borderWidth': 2,
+                        'pointRadius': 0,
+                        'pointHoverRadius': 0
+                    });
+                }))
             },
             'options': {
                 'layout': {
@@ -623,9 +857,11 @@ $(document).ready(function() {
             });
         }
     });
+}
 
-    // Initialize DataTable on all Bootstrap <table>s
-    $('table.table').filter(function(){return !$(this).find('*[colspan],*[rowspan]').length;}).each(function() {
+// Initialize DataTable on all Bootstrap <table>s
+function initTables(root) {
+    $(root).find('table.table').filter(function(){return !$(this).find('*[colspan],*[rowspan]').length;}).each(function() {
         var $table = $(this);
         var table = $table.DataTable({
             'paging': false,  // disable paging
@@ -649,52 +885,96 @@ $(document).ready(function() {
             }
         }
     });
+}
 
-    // Initialize non-ASCII popovers
-    $('form').find('input, select, textarea').popover({
-        trigger: 'manual',
-        placement: 'auto',
-        content: 'Special characters are not allowed.'
-    }).change(function() {
-        if(String($(this).val()).match(/[^\x09-\x7E]/)) {
-            $(this).popover('show');
-            nonAscii = true;
-        } else {
-            $(this).popover('hide');
-        }
+// Load a tab's section (from its data-fragment URL) the first time it's shown
+function loadFragment($tab_page) {
+    if(!$tab_page.is('[data-fragment]') || $tab_page.data('loaded')) {
+        return;
+    }
+    $tab_page.data('loaded', true);
+    $.get($tab_page.attr('data-fragment'), function(html) {
+        var $fragment = $($.parseHTML(html)).filter('.fragment');
+        $tab_page.empty().append($fragment);
+        $('ul.nav-tabs > li > a[href="#' + $tab_page.attr('id') + '"] > .badge').text($fragment.attr('data-badge'));
+        initOffline($tab_page);
+        initCharts($tab_page);
+        initTables($tab_page);
+    }).fail(function() {
+        // Try again the next time the tab is shown
+        $tab_page.data('loaded', false);
+        $tab_page.find('.loading').html('<span class="fas fa-exclamation-triangle"></span>&nbsp;&nbsp;This section couldn\'t be loaded.');
     });
+}
 
-    // Handle form key building
-    $('[name="comp_level"], [name="match_number"], [name="set_number"]').change(function() {
-        if($('[name="comp_level"]').val() == '' || $('[name="comp_level"]').val() == 'qm') {
-            $('[name="set_number"]').removeAttr('required').closest('.input-group').hide();
-        } else {
-            $('[name="set_number"]').attr('required','required').closest('.input-group').show();
-        }
-        $('[name="match_key"]').val(
-            $('[name="event_key"]').val() + '_' +
-            $('[name="comp_level"]').val() +
-            ($('[name="set_number"]').is(':visible') ? $('[name="set_number"]').val() + 'm' : '') +
-            $('[name="match_number"]').val()
-        );
-    });
-    $('[name="team_number"]').change(function() {
-        $('[name="team_key"]').val('frc' + $(this).val());
-    });
-    // Handle form deserialization
-    var $saved = $('[name="saved"]');
-    if($saved.length) {
-        deserialize($saved.closest('form'), $saved.val());
-    }
 
-    // Store temporary form data on change, and restore it on page load (make navigation non-destructive)
-    $('form[persistent="true"]').first().each(function() {
-        deserialize(this, forms(window.location.pathname));
-    }).find('input, select, textarea').change(function() {
-        forms(window.location.pathname, serialize($(this).closest('form'), true));
+// Queue a TBA update in the background, following its progress over the WebSocket and reloading the page once it's done
+var update_jobs = {};  // {job _id: {'run': run, '$ref': button, 'notify': notification}}, updates this page is waiting on
+var update_progress = {};  // {job _id: job}, the latest progress of every job, in case it arrives before the job does
+function update(ref) {
+    var $ref = $(ref);
+    // Find dropdown button
+    var $dropdown_menu = $ref.parents('.dropdown-menu');
+    if($dropdown_menu.length) {
+        $ref = $dropdown_menu.siblings('.dropdown-toggle');
+    }
+    if($ref.hasClass('disabled')) {
+        return false;
+    }
+    $ref.addClass('disabled');
+    $ref.find('.fas').addClass('fa-spin');
+
+    $.ajax({
+        'url': $(ref).attr('href'),
+        'dataType': 'json'
+    }).done(function(job) {
+        update_jobs[job._id] = {
+            'run': job.run,
+            '$ref': $ref,
+            'notify': $.notify({
+                'message': job.description + ' ...',
+                'icon': 'fas fa-sync fa-spin'
+            }, {
+                'type': 'info',
+                'delay': 0,
+                'offset': {
+                    'y': 10,
+                    'x': 10
+                }
+            })
+        };
+        updateProgress(update_progress[job._id] || job);
+    }).fail(function(xhr) {
+        $ref.removeClass('disabled');
+        $ref.find('.fas').removeClass('fa-spin');
+        $.notify({
+            'message': xhr.status == 503 ? 'Too many updates are waiting, try again shortly' : 'Update failed',
+            'icon': 'fas fa-exclamation-triangle'
+        }, {
+            'type': 'danger'
+        });
     });
-});
-
+    return false;
+}
+function updateProgress(job) {
+    update_progress[job._id] = job;
+    var started = update_jobs[job._id];
+    if(!started || started.run != job.run) {
+        return;
+    }
+    if(job.state == 'done') {
+        delete update_jobs[job._id];
+        started.notify.update({'type': 'success', 'message': job.description + ' done'});
+        window.location.reload();
+    } else if(job.state == 'failed') {
+        delete update_jobs[job._id];
+        started.notify.update({'type': 'danger', 'message': job.description + ' failed: ' + job.error});
+        started.$ref.removeClass('disabled');
+        started.$ref.find('.fas').removeClass('fa-spin');
+    } else if(job.state == 'running') {
+        started.notify.update('message', job.description + ' ... ' + job.requests + ' TBA request' + (job.requests == 1 ? '' : 's'));
+    }
+}
 
 function loader(ref) {
     var $ref = $(ref);
@@ -734,22 +1014,3 @@ function detectIE() {
     }
     return false;
 }
-
-// Find the best regression formula for the data set
-function regressionFit(data) {
-    var bestRegression;
-    var bestR2 = NaN;
-    _.forEach([
-        regression.linear(data),
-        regression.exponential(data),
-        regression.logarithmic(data),
-        regression.power(data),
-        regression.polynomial(data)
-    ], function(result) {
-        if(isNaN(bestR2) || (!isNaN(result.r2) && result.r2 > bestR2)) {
-            bestRegression = result;
-            bestR2 = result.r2;
-        }
-    });
-    return bestRegression;
-}